@@ -1,13 +1,39 @@
 import eventlet
 eventlet.monkey_patch() # Must be the absolute first thing!
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, send_from_directory, abort, Response, session, redirect, url_for, flash
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from werkzeug.middleware.proxy_fix import ProxyFix
 import yt_dlp
 import os
 import re
+import copy
+import functools
 import logging
-from collections import deque
+import mimetypes
+import time
+
+from auth.google_auth import GoogleAuth
+from auth.token_store import TokenStore
+from config import Config
+from utils import extract_video_id, format_file_size, is_youtube_url
+from downloads.admission import AdmissionController, AdmissionError
+from downloads.batch import BatchDownload, iter_batch_items
+from downloads.cache import MetadataCache, SqliteMetadataStore, cache_key
+from downloads.drive_uploader import DriveUpload, DriveUploader, DriveUploadError, SourceChanged, file_chunks
+from downloads.executor import BlockingExecutor, blocking_sleep
+from downloads.janitor import DiskJanitor
+from downloads.journal import JobJournal
+from downloads.metrics import THROUGHPUT_BUCKETS, HubLagMonitor, MetricsRegistry
+from downloads.progress import LogSampler, ProgressAggregator
+from downloads.scheduler import DownloadJob, DownloadScheduler, QueueFullError
+from downloads.preview import all_formats, format_ladder, paginate, truncate_text
+from downloads.serving import send_json, send_media
+from downloads.shared_queue import SharedJobQueue, connect_broker
+from downloads.store import MediaStore
+from downloads.streaming import follow_download, is_streamable
+from downloads.transcode import PRESETS, TranscodeCancelled, TranscodeError, Transcoder, choose_audio_source
+from downloads.ydl_pool import YdlPool
 
 # --- Configure Logging ---
 # Get the Flask app logger
@@ -28,11 +54,18 @@ if not app_logger.handlers:
 
 # Set up logging for yt-dlp to emit to client and console
 class YtDlpLogger(logging.Logger):
-    def __init__(self, name, level=logging.NOTSET, socketio_instance=None, session_id=None, app_instance=None):
+    def __init__(self, name, level=logging.NOTSET, socketio_instance=None, session_id=None, app_instance=None, event_sink=None,
+                 job_id=None, rooms=None):
         super().__init__(name, level)
         self.socketio_instance = socketio_instance
         self.session_id = session_id
         self.app_instance = app_instance
+        # With a job_id, lines are coalesced into that job's progress batches for `rooms`
+        self.job_id = job_id
+        self.rooms = rooms
+        # When yt-dlp runs on a worker thread, records are handed to event_sink
+        # and published later from the hub via publish()
+        self.event_sink = event_sink
         self.set_log_level('INFO') # Default to INFO, allows progress messages
 
         self.levelname_map = {
@@ -56,118 +89,346 @@ class YtDlpLogger(logging.Logger):
     def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, **kwargs):
         log_message = msg % args
 
-        if self.socketio_instance and self.session_id and self.app_instance:
+        if self.event_sink is not None:
+            self.event_sink('log', (level, log_message))
+            return
+        self.publish(level, log_message)
+
+    def publish(self, level, log_message):
+        if self.job_id:
+            # Only the latest line per tick reaches the client
+            progress_aggregator.update(self.job_id, {'log': f'yt-dlp: {log_message}'}, self.rooms or (self.session_id,))
+        elif self.socketio_instance and self.session_id and self.app_instance:
             with self.app_instance.app_context():
                 # Emit to 'progress_update' as per your original JS
                 self.socketio_instance.emit('progress_update', {'progress': 0, 'message': f'yt-dlp: {log_message}'}, room=self.session_id)
 
-        if level >= logging.INFO:
+        # Warnings and errors are always logged; chatty INFO lines are sampled per job
+        if level >= logging.WARNING or (level >= logging.INFO and log_sampler.allow(('yt-dlp', self.job_id or self.name))):
             app_logger.info(f"yt-dlp {self.levelname_map.get(level, 'UNKNOWN')}: {log_message}")
 
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a_very_secret_key_that_you_should_change_in_production') # CHANGE THIS FOR PRODUCTION!
-socketio = SocketIO(app, async_mode='eventlet')
+# With a message queue, any process (e.g. a download worker) can emit to clients connected to another
+socketio = SocketIO(app, async_mode='eventlet', message_queue=Config.SOCKETIO_MESSAGE_QUEUE)
+if Config.TRUSTED_PROXIES:
+    # Wraps the Socket.IO middleware too, so its connections see the real client address
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.TRUSTED_PROXIES, x_proto=Config.TRUSTED_PROXIES)
+
+# Progress is sent as one 'progress_batch' per client per tick instead of one message per yt-dlp callback
+progress_aggregator = ProgressAggregator(socketio.emit, rate=Config.PROGRESS_UPDATES_PER_SECOND, spawn=socketio.start_background_task)
+log_sampler = LogSampler(interval=Config.PROGRESS_LOG_INTERVAL)
 
-DOWNLOAD_FOLDER = 'downloads'
+DOWNLOAD_FOLDER = Config.DOWNLOAD_FOLDER
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
 
-download_queue = deque()
+active_batches = {}  # batch_id -> BatchDownload
+
+# Finished downloads, keyed by (video_id, format_id)
+media_store = MediaStore(DOWNLOAD_FOLDER)
+
+# yt-dlp work runs here instead of on the eventlet hub
+blocking_executor = BlockingExecutor(max_workers=Config.BLOCKING_POOL_SIZE)
+
+# Retention for the download folder: old, idle and excess items, and leftovers of dead downloads
+disk_janitor = DiskJanitor(
+    DOWNLOAD_FOLDER,
+    media_store,
+    interval=Config.JANITOR_INTERVAL,
+    orphan_age=Config.PARTIAL_FILE_MAX_AGE,
+    max_age=Config.DOWNLOAD_MAX_AGE,
+    max_idle=Config.DOWNLOAD_MAX_IDLE,
+    high_watermark=Config.DOWNLOAD_FOLDER_MAX_BYTES,
+    low_watermark=Config.DOWNLOAD_FOLDER_LOW_WATERMARK,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+    call=blocking_executor.call,
+)
+
+# ffmpeg processes converting finished downloads for the presets in downloads/transcode.py
+transcoder = Transcoder(Config.FFMPEG_PATH, max_processes=Config.TRANSCODE_WORKERS)
+
+# Prewarmed yt-dlp instances, reused across requests instead of built for each one
+info_ydl_pool = YdlPool(
+    {'quiet': True, 'no_warnings': True},
+    max_idle=Config.YDL_POOL_SIZE,
+    spawn=lambda fn: socketio.start_background_task(blocking_executor.call, fn),
+)
+download_ydl_pool = YdlPool(
+    max_idle=Config.YDL_POOL_SIZE if Config.RUN_DOWNLOAD_WORKERS else 0,  # Web-only processes never download
+    spawn=lambda fn: socketio.start_background_task(blocking_executor.call, fn),
+)
+
+# Extracted video info, shared by the preview and download paths
+metadata_cache = MetadataCache(
+    max_entries=Config.METADATA_CACHE_SIZE,
+    ttl=Config.METADATA_CACHE_TTL,
+    store=SqliteMetadataStore(Config.METADATA_CACHE_FILE) if Config.METADATA_CACHE_FILE else None,
+)
+
+# Size/format limits, byte quotas and bandwidth ceilings, applied before a job moves any bytes
+admission = AdmissionController(
+    Config.MAX_FILE_SIZE,
+    Config.ALLOWED_FORMATS,
+    downgrade=Config.ADMISSION_DOWNGRADE,
+    global_quota=Config.GLOBAL_DOWNLOAD_QUOTA,
+    client_quota=Config.SESSION_DOWNLOAD_QUOTA,
+    quota_window=Config.DOWNLOAD_QUOTA_WINDOW,
+    global_bandwidth=Config.MAX_DOWNLOAD_BANDWIDTH,
+    client_bandwidth=Config.SESSION_DOWNLOAD_BANDWIDTH,
+)
+
+# Queued and running jobs are journaled so they can be resumed after a restart
+job_journal = JobJournal(Config.JOB_JOURNAL_FILE, progress_interval=Config.JOURNAL_PROGRESS_INTERVAL)
+
+# --- Metrics (served at /metrics) ---
+metrics = MetricsRegistry(prefix='ytdl_')
+extract_latency = metrics.histogram('extract_seconds', 'yt-dlp info extraction time on cache misses', ['caller'])
+queue_wait = metrics.histogram('queue_wait_seconds', 'Time from submitting a job to a worker starting it')
+download_duration = metrics.histogram('download_seconds', 'Time from a worker starting a job to its end', ['status'])
+download_throughput = metrics.histogram('download_throughput_bytes_per_second', 'Average transfer rate of each finished download',
+                                        buckets=THROUGHPUT_BUCKETS)
+download_bytes = metrics.counter('download_bytes', 'Bytes received by downloads')
+postprocess_latency = metrics.histogram('postprocess_seconds', 'yt-dlp postprocessor run time (Merger is the ffmpeg merge)',
+                                        ['postprocessor'])
+transcode_latency = metrics.histogram('transcode_seconds', 'Time to convert a finished download, including the wait for an ffmpeg slot',
+                                      ['preset'])
+served_bytes = metrics.counter('served_bytes', 'Media bytes sent to clients', ['route'])
+serve_throughput = metrics.histogram('serve_throughput_bytes_per_second', 'Average rate of each media response of 1MB or more',
+                                     ['route'], buckets=THROUGHPUT_BUCKETS)
+store_lookups = metrics.counter('store_lookups', 'Download requests answered from the download store or not', ['result'])
+hub_lag_monitor = HubLagMonitor(
+    metrics.histogram('hub_lag_seconds', 'How much later than requested the eventlet hub wakes a sleeping green thread'),
+    metrics.gauge('hub_lag_last_seconds', 'Most recent hub lag sample'),
+    interval=Config.HUB_LAG_INTERVAL,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+)
+
+@metrics.collector
+def collect_component_stats():
+    # Read from the components' own counters at scrape time, so their hot paths stay untouched
+    cache = metadata_cache.stats()
+    queue = download_queue.stats()
+    progress = progress_aggregator.stats()
+    limits = admission.stats()
+    pools = {'info': info_ydl_pool.stats(), 'download': download_ydl_pool.stats()}
+    janitor = disk_janitor.stats()
+    transcodes = transcoder.stats()
+    return [
+        ('metadata_cache_lookups', 'counter', 'Preview lookups, by whether the metadata cache had the video info',
+         {(('result', 'hit'),): cache['hits'], (('result', 'miss'),): cache['misses']}),
+        ('metadata_cache_entries', 'gauge', 'Entries in the metadata cache', cache['entries']),
+        ('jobs', 'gauge', 'Download jobs by state', {(('state', 'running'),): queue['running'],
+                                                     (('state', 'queued'),): queue['queued']}),
+        ('download_workers', 'gauge', 'Download slots in this process', queue['workers']),
+        ('progress_updates', 'counter', 'Progress updates received from yt-dlp', progress['updates_received']),
+        ('progress_updates_dropped', 'counter', 'Progress updates superseded before they were sent', progress['updates_dropped']),
+        ('progress_messages', 'counter', 'Coalesced progress messages sent to clients', progress['messages_sent']),
+        ('admissions', 'counter', 'Admission decisions', {(('result', result),): limits[result]
+                                                          for result in ('admitted', 'downgraded', 'rejected', 'aborted')}),
+        ('ydl_instances', 'counter', 'yt-dlp instances built (prewarmed or on demand) and checkouts served by an idle one',
+         {(('pool', name), ('source', source)): stats[key] for name, stats in pools.items()
+          for source, key in (('built', 'created'), ('reused', 'reused'))}),
+        ('ydl_instances_idle', 'gauge', 'Prewarmed yt-dlp instances waiting to be used',
+         {(('pool', name),): stats['idle'] for name, stats in pools.items()}),
+        ('download_folder_bytes', 'gauge', 'Size of the download folder at the last janitor sweep', janitor['folder_bytes']),
+        ('download_folder_files', 'gauge', 'Files in the download folder at the last janitor sweep', janitor['files']),
+        ('janitor_deleted_files', 'counter', 'Files deleted from the download folder, by retention policy',
+         {(('reason', reason),): count for reason, count in janitor['deleted_files'].items()}),
+        ('janitor_deleted_bytes', 'counter', 'Bytes deleted from the download folder', janitor['deleted_bytes']),
+        ('janitor_sweep_seconds', 'gauge', 'Duration of the last janitor sweep', janitor['last_sweep_seconds']),
+        ('transcodes', 'gauge', 'ffmpeg conversions by state', {(('state', 'running'),): transcodes['running'],
+                                                               (('state', 'waiting'),): transcodes['waiting']}),
+        ('transcode_slots', 'gauge', 'ffmpeg processes allowed at once', transcodes['max_processes']),
+        ('transcode_results', 'counter', 'Finished conversions: run through ffmpeg, already in the target format, or failed',
+         {(('result', result),): transcodes[result] for result in ('converted', 'skipped', 'failed')}),
+    ]
+
+def record_served(route, nbytes, seconds):
+    served_bytes.labels(route).inc(nbytes)
+    if nbytes >= 1024 * 1024 and seconds > 0:
+        serve_throughput.labels(route).observe(nbytes / seconds)
+
+def counted_chunks(route, chunks):
+    # For responses of unknown length: counts what was actually sent
+    start = time.perf_counter()
+    sent = 0
+    try:
+        for data in chunks:
+            sent += len(data)
+            yield data
+    finally:
+        record_served(route, sent, time.perf_counter() - start)
+
+# --- yt-dlp Helpers (run on blocking_executor worker threads) ---
+def extract_video_info(url, **ydl_opts):
+    with info_ydl_pool.acquire(**ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    # Same cleanup as --load-info-json: JSON-safe and without the previous
+    # format selection, so the download path can re-process it
+    return yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+
+
+# --- Google Account ---
+google_auth = GoogleAuth(
+    Config.GOOGLE_CLIENT_ID,
+    Config.GOOGLE_CLIENT_SECRET,
+    Config.GOOGLE_REDIRECT_URI,
+    Config.CREDENTIALS_FILE,
+    TokenStore(Config.GOOGLE_TOKEN_FILE),
+)
+
 
 # --- Routes ---
+@app.before_request
+def before_request():
+    resume_journaled_jobs()
+    hub_lag_monitor.start()
+    info_ydl_pool.start()
+    download_ydl_pool.start()
+    disk_janitor.start()
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # Without sticky sessions, long-polling requests of one client could reach different processes
+    return render_template('index.html', websocket_only=bool(Config.SOCKETIO_MESSAGE_QUEUE),
+                           presets=list(PRESETS.values()) if transcoder.available else [])
 
-@app.route('/get_video_info', methods=['POST'])
-def get_video_info():
-    data = request.json
-    url = data.get('url')
+@app.route('/login')
+def login():
+    return render_template('auth.html')
 
-    if not url:
-        return jsonify({'error': 'URL is required'}), 400
+@app.route('/authenticate')
+def authenticate():
+    try:
+        authorization_url, state = google_auth.authorization_url()
+    except Exception as e:
+        app_logger.error(f"Could not start Google sign-in: {e}")
+        flash('Google sign-in is not configured on this server.', 'danger')
+        return redirect(url_for('login'))
+    session['oauth_state'] = state
+    return redirect(authorization_url)
 
+@app.route('/callback')
+def oauth_callback():
     try:
+        account = google_auth.fetch_token(request.url, session.pop('oauth_state', None))
+    except Exception as e:
+        app_logger.error(f"OAuth callback error: {e}")
+        flash('Sign-in failed. Please try again.', 'danger')
+        return redirect(url_for('login'))
+    # Kept per user: their downloads are uploaded to their own Drive. Only the ID; the token stays on the server
+    session['google_account'] = account
+    session['authenticated'] = True
+    return redirect(url_for('index'))
+
+@app.route('/logout', methods=['POST'])
+def logout():
+    account = session.get('google_account')
+    drive_uploader.reset(account)  # Its pooled clients carry the account's credentials
+    google_auth.sign_out(account)
+    session.clear()
+    return redirect(url_for('login'))
+
+def preview_info(url):
+    """The info dict behind the preview endpoints, extracted only on a metadata cache miss."""
+    info = metadata_cache.get(url)
+    if info is None:
         ydl_opts = {
             'format': 'bestvideo+bestaudio/best', # Fetch best video and audio, then mux
-            'no_warnings': True,
-            'quiet': True, # Suppress most console output from yt-dlp itself
             'extract_flat': True, # Handle playlists by extracting info for each item (no download)
-            'force_generic_extractor': False,
-            'dump_single_json': True, # Get full info as JSON
         }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            title = info.get('title', 'N/A')
-            thumbnail = info.get('thumbnail', '')
-            channel = info.get('channel', 'N/A')
-            duration = info.get('duration', 0)
-            view_count = info.get('view_count', 0)
-            description = info.get('description', 'No description available.')
-            uploader = info.get('uploader', 'N/A')
-            upload_date = info.get('upload_date', 'N/A') # YYYYMMDD
-            webpage_url = info.get('webpage_url', url)
-
-            formats = []
-            for f in info.get('formats', []):
-                # We need both video (vcodec != 'none') and audio (acodec != 'none') streams
-                # or combined formats. Check for proper URL and at least one codec.
-                if 'url' in f and (f.get('vcodec') != 'none' or f.get('acodec') != 'none'):
-                    height = f.get('height')
-                    
-                    # Determine a user-friendly resolution string
-                    resolution_str = f"{height}p" if height else (f.get('resolution') or 'N/A')
-
-                    # If it's an audio-only stream (no video codec, no height), explicitly mark it
-                    if f.get('acodec') != 'none' and f.get('vcodec') == 'none' and height is None:
-                        resolution_str = "Audio"
-                    elif height is None and not f.get('acodec'):
-                        # Skip if it's neither video nor audio (e.g., subtitles, metadata)
-                        continue 
-
-                    formats.append({
-                        'format_id': f.get('format_id'),
-                        'ext': f.get('ext'),
-                        'quality': f.get('format_note') or resolution_str or 'N/A', # Use height for quality
-                        'resolution': resolution_str, # Use height for resolution display
-                        'width': f.get('width'), # Include width and height for client-side filtering
-                        'height': height,
-                        'filesize': f.get('filesize'),
-                        'url': f.get('url'),
-                        'vcodec': f.get('vcodec'),
-                        'acodec': f.get('acodec')
-                    })
-            
-            # Sort formats primarily by height (descending), then by filesize (descending)
-            # This ensures higher quality video appears first, then audio
-            formats.sort(key=lambda x: (
-                x['height'] if x['height'] is not None else (-1 if x.get('resolution') == 'Audio' else -2), # -1 for Audio, -2 for unknown
-                x['filesize'] if x['filesize'] is not None else 0
-            ), reverse=True)
-
-            return jsonify({
-                'title': title,
-                'thumbnail': thumbnail,
-                'channel': channel,
-                'duration': duration,
-                'view_count': view_count,
-                'description': description,
-                'formats': formats,
-                'original_url': url,
-                'uploader': uploader,
-                'upload_date': upload_date,
-                'webpage_url': webpage_url
-            })
-
-    except yt_dlp.utils.DownloadError as e:
-        app_logger.error(f"yt-dlp Download Error while getting info: {e}")
-        return jsonify({'error': f'Failed to get video info: {str(e)}'}), 500
-    except Exception as e:
-        app_logger.error(f"An unexpected error occurred while fetching video information: {e}", exc_info=True)
-        return jsonify({'error': 'An unexpected error occurred while fetching video information.'}), 500
+        with extract_latency.labels('preview').time():
+            info = blocking_executor.call(extract_video_info, url, **ydl_opts)
+        metadata_cache.put(url, info)
+    return info
+
+def int_param(params, name, default):
+    try:
+        return int(params.get(name) or default)
+    except (TypeError, ValueError):
+        return default
+
+def preview_endpoint(view):
+    """
+    Calls view(url, info, params) with the parameters of a GET (query string,
+    so responses can be revalidated with their ETag) or of a POST (JSON
+    body), and turns extraction errors into JSON errors.
+    """
+    @functools.wraps(view)
+    def wrapper():
+        params = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
+        url = params.get('url')
+        if not url:
+            return jsonify({'error': 'URL is required'}), 400
+        try:
+            return view(url, preview_info(url), params)
+        except yt_dlp.utils.DownloadError as e:
+            app_logger.error(f"yt-dlp Download Error while getting info: {e}")
+            return jsonify({'error': f'Failed to get video info: {str(e)}'}), 500
+        except Exception as e:
+            app_logger.error(f"An unexpected error occurred while fetching video information: {e}", exc_info=True)
+            return jsonify({'error': 'An unexpected error occurred while fetching video information.'}), 500
+    return wrapper
+
+@app.route('/get_video_info', methods=['GET', 'POST'])
+@preview_endpoint
+def get_video_info(url, info, params):
+    """
+    Video metadata and formats for the preview. With `compact` set, formats
+    are collapsed to a ladder without URLs and the description is cut short;
+    /get_video_formats and /get_video_description return the rest.
+    """
+    formats = all_formats(info)
+    payload = {
+        'title': info.get('title', 'N/A'),
+        'thumbnail': info.get('thumbnail', ''),
+        'channel': info.get('channel', 'N/A'),
+        'duration': info.get('duration', 0),
+        'view_count': info.get('view_count', 0),
+        'description': info.get('description', 'No description available.'),
+        'formats': formats,
+        'original_url': url,
+        'uploader': info.get('uploader', 'N/A'),
+        'upload_date': info.get('upload_date', 'N/A'), # YYYYMMDD
+        'webpage_url': info.get('webpage_url', url),
+        # Playlists have no formats of their own and are downloaded as a batch
+        'is_playlist': info.get('_type') == 'playlist',
+        'playlist_count': info.get('playlist_count') or len(info.get('entries') or [])
+    }
+    if params.get('compact') in (True, 1, '1', 'true', 'yes'):
+        description, truncated = truncate_text(payload['description'], Config.PREVIEW_DESCRIPTION_LENGTH)
+        payload.update(
+            formats=format_ladder(formats),
+            formats_total=len(formats),
+            description=description,
+            description_truncated=truncated,
+        )
+    return send_json(request, payload)
+
+@app.route('/get_video_formats', methods=['GET', 'POST'])
+@preview_endpoint
+def get_video_formats(url, info, params):
+    """
+    Full details, signed URLs included, of the formats listed in `format_id`
+    (comma-separated), or else one `page` of all formats.
+    """
+    formats = all_formats(info)
+    if params.get('format_id'):
+        wanted = set(str(params['format_id']).split(','))
+        return send_json(request, {'formats': [f for f in formats if f['format_id'] in wanted]})
+    per_page = min(max(1, int_param(params, 'per_page', Config.PREVIEW_FORMATS_PAGE_SIZE)), Config.PREVIEW_FORMATS_PAGE_SIZE)
+    page, meta = paginate(formats, int_param(params, 'page', 1), per_page)
+    return send_json(request, dict(meta, formats=page))
+
+@app.route('/get_video_description', methods=['GET', 'POST'])
+@preview_endpoint
+def get_video_description(url, info, params):
+    return send_json(request, {'description': info.get('description') or ''})
 
 @app.route('/summarize_video', methods=['POST'])
 def summarize_video():
@@ -190,17 +451,183 @@ def summarize_video():
 
     return jsonify({'summary': summary_text})
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({'metadata': metadata_cache.stats(), 'progress': progress_aggregator.stats()})
+
 
 # --- SocketIO Event Handlers ---
 @socketio.on('connect')
 def test_connect():
     app_logger.info(f"Client connected: {request.sid}")
+    if session.get('google_account'):
+        join_room(drive_room(session['google_account']))
+    # Socket.IO requests bypass before_request
+    resume_journaled_jobs()
+    hub_lag_monitor.start()
+    info_ydl_pool.start()
+    download_ydl_pool.start()
+    disk_janitor.start()
     # Original JS expects 'status_update' for initial connection
     emit('status_update', {'message': 'Connected to server!'})
 
 @socketio.on('disconnect')
 def test_disconnect():
     app_logger.info(f"Client disconnected: {request.sid}")
+    # Stop batches first so cancelled items do not pull in new ones
+    for batch in list(active_batches.values()):
+        if batch.session_id == request.sid:
+            batch.cancel()
+            active_batches.pop(batch.batch_id, None)
+    for job in download_queue.jobs():
+        if request.sid not in job.subscribers:
+            continue
+        if not download_queue.unsubscribe(job, request.sid):
+            socketio.start_background_task(cancel_if_unattended, job)
+
+def cancel_if_unattended(job):
+    # A reconnecting client gets a new sid, so give it time to re-attach by job ID
+    time.sleep(Config.JOB_REATTACH_GRACE)
+    job = download_queue.refresh(download_queue.get_job(job.job_id) or job)
+    if not job.subscribers and not job.done:
+        # Nobody is left to receive the file, so free the queue slot or worker
+        download_queue.cancel(job.job_id)
+        app_logger.info(f"Cancelled job {job.job_id}: no client re-attached within {Config.JOB_REATTACH_GRACE:.0f}s")
+
+def track_job(job):
+    """Registers a submitted job with the download store and the job journal."""
+    media_store.begin(job.store_key, job)
+    # Released by run_download_job, unless another process ran the job
+    job.add_done_callback(lambda j: media_store.finish(j.store_key, j))
+    if not isinstance(download_queue, SharedJobQueue):
+        # The shared job store outlives this process already
+        job_journal.record(job)
+        job.add_done_callback(job_journal.finish)
+    # Charge the quotas what was actually transferred instead of the estimate
+    job.add_done_callback(lambda j: admission.settle(j.client_id, j.reserved_bytes, j.transferred_bytes))
+
+def store_format(format_id, preset):
+    # What an item is keyed by besides the video; audio presets pick their own source format
+    if preset is None:
+        return format_id
+    return preset if PRESETS[preset].audio_only else f'{format_id}>{preset}'
+
+def media_id(info, video_url):
+    # The video an item is of: extractor and ID once the info is known (IDs are only unique per
+    # extractor; YouTube's stay bare, as the store has always keyed them), until then the URL's cache key
+    if info and info.get('extractor_key') and info.get('id'):
+        return info['id'] if info['extractor_key'] == 'Youtube' else f"{info['extractor_key']}:{info['id']}"
+    return cache_key(video_url)
+
+def item_store_key(info, video_url, format_id, preset):
+    return MediaStore.make_key(media_id(info, video_url), store_format(format_id, preset))
+
+def rekey_job(job, store_key):
+    """
+    Moves a job queued under the key of what was requested (the URL, when it
+    was not previewed, and the requested format) to the key of what it will
+    actually download, and its store pin with it. Returns the store entry
+    if that item is stored already.
+    """
+    if store_key == job.store_key:
+        return None
+    entry = media_store.lookup(store_key)
+    if entry is None and download_queue.rekey(job, store_key) is not job:
+        # Another job is writing the same item to the same file; download this one apart from it
+        store_key = MediaStore.make_key(store_key, job.job_id)
+        download_queue.rekey(job, store_key)
+    pinned = media_store.in_flight(job.store_key) is job
+    if pinned:
+        media_store.finish(job.store_key, job)
+    job.store_key = store_key
+    if pinned:
+        media_store.begin(store_key, job)
+    return entry
+
+def parse_preset(data):
+    preset = data.get('preset') or None
+    if preset is not None and preset not in PRESETS:
+        return None, f"Unknown conversion '{preset}'."
+    if preset is not None and Config.RUN_DOWNLOAD_WORKERS and not transcoder.available:
+        return None, 'Converting downloads is not available on this server.'
+    return preset, None
+
+def request_download(session_id, video_url, format_id, video_title, preset=None, drive_account=None, client_id=None):
+    """
+    Starts the download of one item for a client, or attaches the client to
+    an identical download that is already queued or running.
+    Returns (job, None), or (None, entry) when the item is already in the
+    download store. Raises QueueFullError when the queue is full and
+    AdmissionError when the download is over a size, format or quota limit.
+    With a `preset` (see downloads/transcode.py) the file is converted once
+    it has downloaded; audio presets download only an audio format.
+    With a `drive_account` (see GoogleAuth) a new job is also uploaded to
+    that account's Drive. Byte quotas are charged to `client_id` (see
+    client_identity()), or to the session without one.
+    """
+    # With the preview's info at hand the limits apply before anything is queued;
+    # otherwise the job applies them once it has extracted the info itself
+    info = metadata_cache.peek(video_url)
+    plan = None
+    if info is not None and info.get('_type', 'video') == 'video':
+        if preset is not None and PRESETS[preset].audio_only:
+            format_id = choose_audio_source(info, PRESETS[preset])
+        plan = admission.plan(info, format_id)
+        format_id = plan.format_id
+
+    # Without the info, keyed by URL and requested format until the job has extracted it (see rekey_job)
+    store_key = item_store_key(info, video_url, format_id, preset)
+    entry = media_store.lookup(store_key)
+    store_lookups.labels('hit' if entry is not None else 'miss').inc()
+    if entry is not None:
+        app_logger.info(f"Serving {video_url} ({format_id}) from the download store: {entry['filename']}")
+        return None, entry
+
+    job = download_queue.in_flight(store_key)
+    if job is not None:
+        # Same item is already queued or downloading: share its events instead of a second transfer
+        return attach_client(session_id, job), None
+
+    job = DownloadJob(session_id, video_url, format_id, video_title or cache_key(video_url), store_key=store_key,
+                      preset=preset)
+    job.drive_account = drive_account
+    job.client_id = client_id or session_id
+    if plan is not None:
+        job.reserved_bytes = admission.reserve(job.client_id, plan.estimated_bytes)
+        job.admission_note = plan.note
+        job.admitted = True
+    socketio.server.enter_room(session_id, job.room, namespace='/')
+    try:
+        owner = download_queue.submit(job)
+    except QueueFullError:
+        socketio.server.leave_room(session_id, job.room, namespace='/')
+        admission.settle(job.client_id, job.reserved_bytes, 0)
+        raise
+    if owner is not job:
+        # Another process queued the same item first
+        socketio.server.leave_room(session_id, job.room, namespace='/')
+        admission.settle(job.client_id, job.reserved_bytes, 0)
+        return attach_client(session_id, owner), None
+    track_job(job)
+    return job, None
+
+def client_identity():
+    """
+    Who a request's byte quotas and bandwidth are charged to: the client's
+    address, which (unlike its Socket.IO sid) survives reconnecting. Behind
+    reverse proxies, set TRUSTED_PROXIES so it is not the proxy's address.
+    """
+    return request.remote_addr or request.sid
+
+def attach_client(session_id, job):
+    socketio.server.enter_room(session_id, job.room, namespace='/')
+    download_queue.subscribe(job, session_id)
+    app_logger.info(f"Attached client {session_id} to in-flight job {job.job_id}")
+    return job
 
 @socketio.on('start_download')
 def handle_start_download(data):
@@ -208,30 +635,228 @@ def handle_start_download(data):
     format_id = data['format_id']
     video_title = data['video_title']
     session_id = request.sid
+    preset, error = parse_preset(data)
+    if error:
+        emit('download_error', {'message': error}, room=session_id)
+        return
+
+    app_logger.info(f"Received download request for {video_url} with format {format_id}"
+                    f"{f', converting to {preset}' if preset else ''}")
+
+    try:
+        job, entry = request_download(session_id, video_url, format_id, video_title, preset,
+                                      drive_account=session.get('google_account'), client_id=client_identity())
+    except (QueueFullError, AdmissionError) as e:
+        app_logger.warning(f"Rejected download request for {video_url}: {e}")
+        emit('download_error', {'message': str(e)}, room=session_id)
+        return
+
+    if entry is not None:
+        emit('download_complete', download_complete_payload(None, entry), room=session_id)
+    elif job.session_id != session_id:
+        emit('download_queued', download_queued_payload(job, 'Joining a download already in progress...'), room=session_id)
+    else:
+        message = f'Download queued... {job.admission_note}' if job.admission_note else 'Download queued...'
+        emit('download_queued', download_queued_payload(job, message), room=session_id)
+
+@socketio.on('cancel_download')
+def handle_cancel_download(data):
+    job_id = data.get('job_id')
+    job = download_queue.get_job(job_id)
+    if job is None or job.done or request.sid not in job.subscribers:
+        emit('download_error', {'job_id': job_id, 'message': 'Download not found or already finished.'}, room=request.sid)
+        return
+
+    if len(job.subscribers) > 1:
+        # Other clients still want this item; only detach the caller
+        download_queue.unsubscribe(job, request.sid)
+        leave_room(job.room)
+        emit('download_cancelled', {'job_id': job_id, 'message': 'Download cancelled.'}, room=request.sid)
+        return
+
+    app_logger.info(f"Cancellation requested for job {job_id} ({job.video_url})")
+    download_queue.cancel(job_id)
+    if job.status == 'cancelled':
+        # Still queued, so it never started; a running job reports back from its task
+        emit('download_cancelled', {'job_id': job_id, 'message': 'Download cancelled.'}, room=job.room)
+
+
+@socketio.on('attach_job')
+def handle_attach_job(data):
+    """
+    Re-attaches a client to a job by its ID, e.g. after reconnecting with a
+    new sid or after the server restarted mid-download.
+    """
+    job_id = data.get('job_id')
+    job = download_queue.get_job(job_id)
+    if job is not None and not job.done and not job.cancelled:
+        join_room(job.room)
+        download_queue.subscribe(job, request.sid)
+        app_logger.info(f"Client {request.sid} re-attached to job {job_id}")
+        emit('download_queued', download_queued_payload(job, 'Re-attached to your download...'), room=request.sid)
+        return
+
+    # No longer queued or running: report how it ended
+    row = job_journal.get(job_id)
+    if row is None and job is not None:
+        row = {'status': job.status, 'store_key': job.store_key}  # Finished jobs stay in the shared store for a while
+    entry = media_store.lookup(row['store_key']) if row and row['status'] == 'finished' and row['store_key'] else None
+    if entry is not None:
+        emit('download_complete', download_complete_payload(job_id, entry), room=request.sid)
+    elif row is not None and row['status'] == 'cancelled':
+        emit('download_cancelled', {'job_id': job_id, 'message': 'Download cancelled.'}, room=request.sid)
+    else:
+        emit('download_error', {'job_id': job_id, 'message': 'The download did not complete. Please start it again.'}, room=request.sid)
+
+
+# --- Batch and Playlist Downloads ---
+def extract_playlist_flat(url):
+    # No context manager: the lazy 'entries' generator keeps using this instance
+    ydl = yt_dlp.YoutubeDL({
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'quiet': True,
+        'no_warnings': True,
+    })
+    return ydl.extract_info(url, download=False, process=False)
+
+def is_single_video(url):
+    # Plain YouTube video links need no extraction to be queued; watch?v=...&list=... is a playlist
+    return is_youtube_url(url) and extract_video_id(url) is not None and 'list=' not in url
+
+def emit_batch_progress(batch):
+    state = batch.to_dict()
+    finished = batch.completed + batch.failed
+    state['message'] = (
+        f"{finished} of {batch.discovered}{'' if batch.exhausted else '+'} items done"
+        f"{f' ({batch.failed} failed)' if batch.failed else ''}"
+    )
+    socketio.emit('batch_progress', state, room=batch.session_id)
+    if batch.done:
+        active_batches.pop(batch.batch_id, None)
+        socketio.emit('batch_complete', state, room=batch.session_id)
+        app_logger.info(f"Batch {batch.batch_id} done: {batch.completed} completed, {batch.failed} failed")
+
+def start_batch(session_id, urls, format_id, preset=None, drive_account=None, client_id=None):
+    def submit(url, title):
+        job, entry = request_download(session_id, url, format_id, title, preset, drive_account, client_id)
+        if entry is not None:
+            socketio.emit('download_complete', download_complete_payload(None, entry), room=session_id)
+        return job
 
-    app_logger.info(f"Received download request for {video_url} with format {format_id}")
-    # Use 'progress_update' as per your original JS
-    emit('progress_update', {'progress': 0, 'message': 'Starting download...', 'status': 'preparing'}, room=session_id)
+    items = iter_batch_items(urls, extract_playlist_flat, is_single_video)
+    batch = BatchDownload(
+        session_id,
+        items,
+        submit,
+        emit_batch_progress,
+        concurrency=min(Config.BATCH_CONCURRENCY, Config.MAX_JOBS_PER_SESSION),
+        # Expanding the next playlist page is network I/O, so it runs off the hub
+        next_item=lambda iterator: blocking_executor.call(next, iterator, None),
+        spawn=socketio.start_background_task,
+    )
+    active_batches[batch.batch_id] = batch
+    socketio.start_background_task(batch.start)
+    app_logger.info(f"Started batch {batch.batch_id} for {session_id} from {len(urls)} URL(s) with format {format_id}")
+    return batch
 
-    socketio.start_background_task(download_video_task, app, socketio, video_url, format_id, video_title, session_id)
+def parse_batch_request(data):
+    urls = data.get('urls') or ([data['url']] if data.get('url') else [])
+    urls = [url.strip() for url in urls if isinstance(url, str) and url.strip()]
+    if not urls:
+        return None, 'At least one URL is required.'
+    if len(urls) > Config.MAX_BATCH_URLS:
+        return None, f'A batch can contain at most {Config.MAX_BATCH_URLS} URLs.'
+    return urls, None
+
+@socketio.on('start_batch')
+def handle_start_batch(data):
+    urls, error = parse_batch_request(data or {})
+    if not error:
+        preset, error = parse_preset(data)
+    if error:
+        emit('download_error', {'message': error}, room=request.sid)
+        return
+    batch = start_batch(request.sid, urls, data.get('format_id') or 'best', preset, session.get('google_account'),
+                        client_identity())
+    emit('batch_started', batch.to_dict(), room=request.sid)
+
+@socketio.on('cancel_batch')
+def handle_cancel_batch(data):
+    batch = active_batches.get(data.get('batch_id'))
+    if batch is None or batch.session_id != request.sid:
+        return
+    for job in batch.cancel():
+        if not download_queue.unsubscribe(job, request.sid):
+            download_queue.cancel(job.job_id)
+    active_batches.pop(batch.batch_id, None)
+    emit('batch_complete', dict(batch.to_dict(), message='Batch cancelled.'), room=request.sid)
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    data = request.json or {}
+    urls, error = parse_batch_request(data)
+    if not error:
+        preset, error = parse_preset(data)
+    if error:
+        return jsonify({'error': error}), 400
+
+    # Progress is only delivered over Socket.IO, so the caller names its connected session
+    session_id = data.get('sid')
+    if not session_id or not socketio.server.manager.is_connected(session_id, '/'):
+        return jsonify({'error': 'A connected Socket.IO session id (sid) is required to receive batch progress.'}), 400
+
+    batch = start_batch(session_id, urls, data.get('format_id') or 'best', preset, session.get('google_account'),
+                        client_identity())
+    return jsonify(batch.to_dict()), 202
 
 
 # --- Background Task for Download ---
-def download_video_task(app_instance, socketio_instance, video_url, format_id, video_title, session_id):
+def clean_title_for_filename(video_title):
+    # Clean title for filename: remove invalid chars, replace spaces with underscores
+    clean_title = re.sub(r'[^\w\s.-]', '', video_title).strip().replace(' ', '_')
+    # Ensure it's not empty after cleaning
+    if not clean_title:
+        clean_title = "downloaded_video"
+
+    # Limit filename length to prevent issues with OS file systems
+    if len(clean_title) > 100:
+        clean_title = clean_title[:100]
+    return clean_title
+
+def download_queued_payload(job, message):
+    payload = {'job_id': job.job_id, 'message': message}
+    if is_streamable(job.format_id) and not job.preset:
+        # Lets the client start saving the file before the download has finished
+        payload['stream_url'] = f'/stream/{job.job_id}'
+    return payload
+
+def download_complete_payload(job_id, entry):
+    return {
+        'job_id': job_id,
+        'filename': entry['download_name'],
+        'file_url': f"/downloads/{entry['filename']}",
+        'message': 'Download completed successfully!'
+    }
+
+def download_video_task(app_instance, socketio_instance, video_url, format_id, video_title, room, job=None):
+    job_id = job.job_id if job else None
+    # Every client following the job gets its progress, including ones that attach later
+    progress_rooms = job.subscribers if job else (room,)
     with app_instance.app_context():
         try:
-            # Clean title for filename: remove invalid chars, replace spaces with underscores
-            clean_title = re.sub(r'[^\w\s.-]', '', video_title).strip().replace(' ', '_')
-            # Ensure it's not empty after cleaning
-            if not clean_title:
-                clean_title = "downloaded_video"
+            clean_title = clean_title_for_filename(video_title)
+            final_paths = []
 
-            # Limit filename length to prevent issues with OS file systems
-            if len(clean_title) > 100:
-                clean_title = clean_title[:100]
+            def handle_progress(d):
+                if job is not None and d.get('filename'):
+                    # Tracked for /stream/<job_id> and journaled for resuming after a restart
+                    job.partial_path = d.get('tmpfilename')
+                    job.output_path = d['filename']
+                    job.downloaded_bytes = d.get('downloaded_bytes')
+                    job.total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
+                    job_journal.update_progress(job, force=d['status'] == 'finished')
 
-
-            def progress_hook(d):
                 with app_instance.app_context():
                     if d['status'] == 'downloading':
                         total_bytes = d.get('total_bytes')
@@ -263,71 +888,524 @@ def download_video_task(app_instance, socketio_instance, video_url, format_id, v
                             message = " ".join(message_parts)
                             percent = d.get('progress', 0) # Use a generic 'progress' if available
 
-                        # Emit to 'progress_update' as per your original JS
-                        socketio_instance.emit('progress_update', {'progress': percent, 'message': message, 'status': 'downloading'}, room=session_id)
-                        app_logger.info(f"Download Progress: {percent:.1f}% - {message}")
+                        progress_aggregator.update(job_id, {'progress': percent, 'message': message, 'status': 'downloading'}, progress_rooms)
+                        if log_sampler.allow(('progress', job_id)):
+                            skipped = log_sampler.suppressed(('progress', job_id))
+                            app_logger.info(
+                                f"Download Progress: {percent:.1f}% - {message}"
+                                f"{f' ({skipped} updates not logged)' if skipped else ''}"
+                            )
 
                     elif d['status'] == 'finished':
-                        filename = d['filename']
-                        # Ensure filename is just the basename, not the full path for client
-                        final_filename_basename = os.path.basename(filename)
-
-                        # Verify file exists on disk
-                        full_download_path = os.path.join(DOWNLOAD_FOLDER, final_filename_basename)
-                        if os.path.exists(full_download_path):
-                            app_logger.info(f"Verification: File '{full_download_path}' successfully found on disk.")
-                        else:
-                            app_logger.error(f"Verification ERROR: File '{full_download_path}' NOT FOUND on disk after download!")
-                            with app_instance.app_context():
-                                # Emit to 'download_error' as per your original JS expectations
-                                socketio_instance.emit('download_error', {'message': f'Download reported complete, but file not found: {final_filename_basename}'}, room=session_id)
-                            return
-
-                        # Emit to 'progress_update' and 'download_complete' as per your original JS
-                        socketio_instance.emit('progress_update', {'progress': 100, 'message': 'Download complete!', 'status': 'finished'}, room=session_id)
-                        socketio_instance.emit('download_complete', {
-                            'filename': final_filename_basename,
-                            'file_url': f'/downloads/{final_filename_basename}',
-                            'message': 'Download completed successfully!'
-                        }, room=session_id)
-                        app_logger.info(f"Download finished: {final_filename_basename}")
-
-            ydl_opts = {
-                'format': format_id,
-                'outtmpl': os.path.join(DOWNLOAD_FOLDER, f"{clean_title}.%(ext)s"),
-                'progress_hooks': [progress_hook],
-                'logger': YtDlpLogger(
-                    'yt_dlp_logger',
-                    socketio_instance=socketio_instance,
-                    session_id=session_id,
-                    app_instance=app_instance,
-                ),
-                'quiet': False, # Set to False to allow yt-dlp logger to work
-                'verbose': True, # Verbose will send more messages to logger
-                'no_warnings': False,
-            }
-
-            app_logger.info(f"Starting yt-dlp download with opts: {ydl_opts}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([video_url])
+                        # One stream is done; merged formats still have another stream and the mux ahead
+                        progress_aggregator.update(job_id, {'progress': 100, 'message': 'Download complete! Finalizing file...', 'status': 'finished'}, progress_rooms)
+                        app_logger.info(f"Stream finished: {os.path.basename(d['filename'])}")
+
+            ydl_logger = YtDlpLogger(
+                'yt_dlp_logger',
+                socketio_instance=socketio_instance,
+                session_id=room,
+                app_instance=app_instance,
+                job_id=job_id,
+                rooms=progress_rooms,
+            )
+
+            def handle_event(kind, payload):
+                # Runs on the hub, in the order the worker thread posted the events
+                if kind == 'progress':
+                    handle_progress(payload)
+                elif kind == 'log':
+                    ydl_logger.publish(*payload)
+                elif kind == 'filepath':
+                    final_paths.append(payload)
+                    if job is not None:
+                        job.output_path = payload
+
+            # Reuse the info dict from the preview instead of extracting again
+            cached_info = metadata_cache.peek(video_url)
+            if job is not None and not job.admitted:
+                # Not previewed (batch items, resumed jobs): extract now so the limits still apply before any download
+                if cached_info is None:
+                    with extract_latency.labels('download').time():
+                        cached_info = blocking_executor.call(extract_video_info, video_url)
+                    metadata_cache.put(video_url, cached_info)
+                if cached_info.get('_type', 'video') == 'video':
+                    if job.preset and PRESETS[job.preset].audio_only:
+                        format_id = choose_audio_source(cached_info, PRESETS[job.preset])
+                    plan = admission.plan(cached_info, format_id)
+                    job.reserved_bytes = admission.reserve(job.client_id, plan.estimated_bytes)
+                    format_id = job.format_id = plan.format_id
+                    if plan.note:
+                        progress_aggregator.update(job_id, {'progress': 0, 'message': plan.note, 'status': 'preparing'}, progress_rooms)
+                    entry = rekey_job(job, item_store_key(cached_info, video_url, format_id, job.preset))
+                    if entry is not None:
+                        job.admitted = True
+                        job.output_path = os.path.join(DOWNLOAD_FOLDER, entry['filename'])  # For /stream and Drive uploads following the job
+                        store_lookups.labels('hit').inc()
+                        progress_aggregator.discard(job_id)
+                        app_logger.info(f"Serving {video_url} ({format_id}) from the download store: {entry['filename']}")
+                        socketio_instance.emit('download_complete', download_complete_payload(job_id, entry), room=room)
+                        return
+                job.admitted = True
+            if cached_info is not None and cached_info.get('_type', 'video') != 'video':
+                cached_info = None  # Playlists are always re-extracted
+
+            # Stored items are named by key; the title is only used as the download name
+            store_key = job.store_key if job else None
+            if store_key:
+                outtmpl = media_store.output_template(store_key)
+            else:
+                outtmpl = os.path.join(DOWNLOAD_FOLDER, f"{clean_title}.%(ext)s")
+
+            def run_ydl(post):
+                # Runs on a blocking_executor thread: no Socket.IO or app_logger calls in here
+                file_bytes = {}  # filename -> bytes downloaded, for every stream of a merged format
+
+                def enforce_limits(d):
+                    downloaded = d.get('downloaded_bytes') or 0
+                    delta = downloaded - file_bytes.get(d.get('filename'), 0)
+                    file_bytes[d.get('filename')] = downloaded
+                    job.transferred_bytes = sum(file_bytes.values())
+                    # An exact Content-Length lets an oversized file be refused before its bytes arrive
+                    expected = job.transferred_bytes - downloaded + (d.get('total_bytes') or 0)
+                    if Config.MAX_FILE_SIZE and max(job.transferred_bytes, expected) > Config.MAX_FILE_SIZE:
+                        job.abort_reason = f'The file is larger than the {format_file_size(Config.MAX_FILE_SIZE)} limit.'
+                        raise yt_dlp.utils.DownloadCancelled(job.abort_reason)
+                    if delta > 0:
+                        download_bytes.inc(delta)
+                        # Pausing the hook pauses the download loop that called it
+                        wait = admission.throttle(job.client_id, delta)
+                        if wait > 0:
+                            blocking_sleep(wait)
+
+                def progress_hook(d):
+                    if job is not None and job.cancelled:
+                        # Raised inside yt-dlp's download loop, which aborts the transfer
+                        raise yt_dlp.utils.DownloadCancelled('Download cancelled by user.')
+                    if job is not None:
+                        enforce_limits(d)
+                    # info_dict is large and keeps mutating on this thread, so it stays behind
+                    post('progress', {k: v for k, v in d.items() if k != 'info_dict'})
+
+                def summary(info):
+                    # What was downloaded, for the conversion step
+                    return {key: (info or {}).get(key) for key in ('vcodec', 'acodec', 'duration')}
+
+                postprocess_started = {}
+
+                def postprocessor_hook(d):
+                    if d['status'] == 'started':
+                        postprocess_started[d['postprocessor']] = time.perf_counter()
+                    elif d['status'] == 'finished' and d['postprocessor'] in postprocess_started:
+                        elapsed = time.perf_counter() - postprocess_started.pop(d['postprocessor'])
+                        postprocess_latency.labels(d['postprocessor']).observe(elapsed)
+
+                ydl_logger.event_sink = post
+                ydl_opts = {
+                    'format': format_id,
+                    'outtmpl': outtmpl,
+                    # Store output names are deterministic, so a job resumed after a restart picks up its .part file
+                    'continuedl': True,
+                    'progress_hooks': [progress_hook],
+                    'postprocessor_hooks': [postprocessor_hook],
+                    # Called with the final path once merging/post-processing is done
+                    'post_hooks': [lambda path: post('filepath', path)],
+                    'logger': ydl_logger,
+                    # DASH/HLS fragments are fetched in parallel
+                    'concurrent_fragment_downloads': Config.FRAGMENT_CONCURRENCY,
+                    'quiet': False, # Set to False to allow yt-dlp logger to work
+                    'verbose': True, # Verbose will send more messages to logger
+                    'no_warnings': False,
+                }
+                with download_ydl_pool.acquire(**ydl_opts) as ydl:
+                    if cached_info is not None:
+                        try:
+                            return summary(ydl.process_ie_result(copy.deepcopy(cached_info), download=True))
+                        except (yt_dlp.utils.DownloadError, yt_dlp.utils.ReExtractInfo) as e:
+                            # Usually expired format URLs; fall back to a fresh extraction
+                            post('log', (logging.WARNING, f'Cached video info failed ({e}), extracting again'))
+                    return summary(ydl.extract_info(video_url, download=True))
+
+            app_logger.info(
+                f"Starting yt-dlp download of {video_url} (format {format_id}) as '{clean_title}'"
+                f"{' using cached video info' if cached_info is not None else ''}"
+            )
+            downloaded = blocking_executor.call_with_events(run_ydl, handle_event)
             app_logger.info(f"yt-dlp download process completed for {video_url}.")
 
+            # Verify file exists on disk
+            final_path = final_paths[-1] if final_paths else None
+            if not final_path or not os.path.exists(final_path):
+                app_logger.error(f"Verification ERROR: File '{final_path}' NOT FOUND on disk after download!")
+                progress_aggregator.discard(job_id)
+                if job is not None:
+                    job.status = 'failed'
+                # Emit to 'download_error' as per your original JS expectations
+                socketio_instance.emit('download_error', {'job_id': job_id, 'message': 'Download reported complete, but the file was not found.'}, room=room)
+                return
+            app_logger.info(f"Verification: File '{final_path}' successfully found on disk.")
+
+            if job is not None and job.preset:
+                final_path = convert_download(job, final_path, downloaded, progress_rooms)
+
+            # Nothing still pending for this job may arrive after its final event
+            progress_aggregator.discard(job_id)
+
+            if store_key:
+                entry = media_store.add(store_key, final_path, media_id(cached_info, video_url),
+                                        store_format(format_id, job.preset if job else None), clean_title)
+                disk_janitor.wake()  # The folder may be over its size budget now
+            else:
+                final_filename_basename = os.path.basename(final_path)
+                entry = {'filename': final_filename_basename, 'download_name': final_filename_basename}
+
+            # Emit to 'progress_update' and 'download_complete' as per your original JS
+            socketio_instance.emit('progress_update', {'job_id': job_id, 'progress': 100, 'message': 'Download complete!', 'status': 'finished'}, room=room)
+            socketio_instance.emit('download_complete', download_complete_payload(job_id, entry), room=room)
+            app_logger.info(f"Download finished: {entry['filename']}")
+
+        except (yt_dlp.utils.DownloadCancelled, TranscodeCancelled):
+            progress_aggregator.discard(job_id)
+            if job is not None and job.abort_reason:
+                # Stopped by the size limit, not by a user
+                app_logger.warning(f"Aborted download of {video_url}: {job.abort_reason}")
+                admission.aborted += 1
+                job.status = 'failed'
+                if job.partial_path:
+                    try:
+                        os.remove(job.partial_path)
+                    except OSError:
+                        pass  # Never written, or already cleaned up by yt-dlp
+                with app_instance.app_context():
+                    socketio_instance.emit('download_error', {'job_id': job_id, 'message': job.abort_reason}, room=room)
+                return
+            app_logger.info(f"Download cancelled for {video_url}.")
+            with app_instance.app_context():
+                socketio_instance.emit('download_cancelled', {'job_id': job_id, 'message': 'Download cancelled.'}, room=room)
+        except AdmissionError as e:
+            app_logger.warning(f"Refused download of {video_url}: {e}")
+            progress_aggregator.discard(job_id)
+            if job is not None:
+                job.status = 'failed'
+            with app_instance.app_context():
+                socketio_instance.emit('download_error', {'job_id': job_id, 'message': str(e)}, room=room)
+        except TranscodeError as e:
+            app_logger.error(f"Could not convert {video_url} to {job.preset}: {e}")
+            progress_aggregator.discard(job_id)
+            job.status = 'failed'
+            with app_instance.app_context():
+                socketio_instance.emit('download_error', {'job_id': job_id, 'message': f'Conversion failed: {e}'}, room=room)
         except yt_dlp.utils.DownloadError as e:
             app_logger.error(f"yt-dlp Download Error in task for {video_url}: {e}", exc_info=True)
+            progress_aggregator.discard(job_id)
+            if job is not None:
+                job.status = 'failed'
             with app_instance.app_context():
                 # Emit to 'download_error' as per your original JS expectations
-                socketio_instance.emit('download_error', {'message': f'Download failed: {str(e)}'}, room=session_id)
+                socketio_instance.emit('download_error', {'job_id': job_id, 'message': f'Download failed: {str(e)}'}, room=room)
         except Exception as e:
             app_logger.error(f"An unexpected error occurred during download for {video_url}: {e}", exc_info=True)
+            progress_aggregator.discard(job_id)
+            if job is not None:
+                job.status = 'failed'
             with app_instance.app_context():
                 # Emit to 'download_error' as per your original JS expectations
-                socketio_instance.emit('download_error', {'message': f'An unexpected error occurred during download: {str(e)}'}, room=session_id)
+                socketio_instance.emit('download_error', {'job_id': job_id, 'message': f'An unexpected error occurred during download: {str(e)}'}, room=room)
+
+def convert_download(job, path, downloaded, rooms):
+    """Converts a job's finished file with its preset; returns the new path."""
+    preset = PRESETS[job.preset]
+
+    def report(percent):
+        progress_aggregator.update(job.job_id, {'progress': percent, 'message': f'Converting to {preset.label}: {percent:.0f}%',
+                                                'status': 'converting'}, rooms)
+
+    report(0)
+    started = time.perf_counter()
+    path = transcoder.convert(preset, path, downloaded.get('vcodec'), downloaded.get('acodec'), downloaded.get('duration'),
+                              on_progress=report, cancelled=lambda: job.cancelled)
+    transcode_latency.labels(preset.name).observe(time.perf_counter() - started)
+    job.output_path = path
+    app_logger.info(f"Converted job {job.job_id} to {preset.name}: {os.path.basename(path)}")
+    return path
+
+
+# --- Download Queue ---
+def run_download_job(job):
+    """
+    Worker entry point for the download scheduler.
+    """
+    job_journal.set_status(job.job_id, 'running')
+    queue_wait.observe(max(0.0, time.time() - job.queued_at))
+    started = time.perf_counter()
+    if job.store_key and media_store.in_flight(job.store_key) is not job:
+        # Queued by another process (see worker.py): pin the item where its files are written
+        media_store.begin(job.store_key, job)
+    start_drive_upload(job)
+    try:
+        socketio.emit('progress_update', {'job_id': job.job_id, 'progress': 0, 'message': 'Starting download...', 'status': 'preparing'}, room=job.room)
+        download_video_task(app, socketio, job.video_url, job.format_id, job.video_title, job.room, job=job)
+    finally:
+        elapsed = time.perf_counter() - started
+        status = 'cancelled' if job.cancelled else ('finished' if job.status == 'running' else job.status)
+        download_duration.labels(status).observe(elapsed)
+        if status == 'finished' and job.transferred_bytes and elapsed > 0:
+            download_throughput.observe(job.transferred_bytes / elapsed)
+        if job.store_key:
+            media_store.finish(job.store_key, job)
+        log_sampler.forget(('progress', job.job_id))
+        log_sampler.forget(('yt-dlp', job.job_id))
+
+def emit_queue_position(job, position):
+    socketio.emit('queue_update', {
+        'job_id': job.job_id,
+        'position': position,
+        'message': f'Waiting in queue (position {position})...',
+        'status': 'queued'
+    }, room=job.room)
+
+if Config.JOB_QUEUE_URL:
+    # Multi-worker mode: web processes and worker.py processes share one queue
+    download_queue = SharedJobQueue(
+        connect_broker(Config.JOB_QUEUE_URL),
+        run_download_job,
+        max_workers=Config.MAX_CONCURRENT_DOWNLOADS if Config.RUN_DOWNLOAD_WORKERS else 0,
+        max_queue_size=Config.MAX_QUEUE_SIZE,
+        max_jobs_per_session=Config.MAX_JOBS_PER_SESSION,
+        on_queue_change=emit_queue_position,
+        spawn=socketio.start_background_task,
+        sync_interval=Config.JOB_SYNC_INTERVAL,
+        result_ttl=Config.JOB_JOURNAL_RETENTION,
+        worker_timeout=Config.JOB_WORKER_TIMEOUT,
+    )
+else:
+    download_queue = DownloadScheduler(
+        run_download_job,
+        max_workers=Config.MAX_CONCURRENT_DOWNLOADS,
+        max_queue_size=Config.MAX_QUEUE_SIZE,
+        max_jobs_per_session=Config.MAX_JOBS_PER_SESSION,
+        on_queue_change=emit_queue_position,
+        spawn=socketio.start_background_task,
+    )
+
+_journal_resumed = False
+
+def resume_journaled_jobs():
+    """
+    Re-queues the jobs that were queued or running when the previous process
+    stopped. They download to the same store paths, so yt-dlp continues from
+    the existing .part files instead of starting over. Their clients have new
+    sids and re-attach with 'attach_job'.
+
+    Runs once, on the first request rather than at import, so the debug
+    reloader's parent process does not resume anything.
+    """
+    global _journal_resumed
+    if _journal_resumed:
+        return
+    _journal_resumed = True
+    if isinstance(download_queue, SharedJobQueue):
+        return  # Jobs live in the shared store; orphaned ones are requeued by the workers
+
+    pruned = job_journal.prune(Config.JOB_JOURNAL_RETENTION)
+    if pruned:
+        app_logger.info(f"Pruned {pruned} old jobs from the job journal")
+
+    for row in job_journal.unfinished():
+        job = DownloadJob(row['session_id'], row['video_url'], row['format_id'], row['video_title'],
+                          store_key=row['store_key'], job_id=row['job_id'], preset=row['preset'])
+        job.client_id = row['client_id'] or row['session_id']
+        job.drive_account = row['drive_account']
+        job.subscribers.clear()  # Until a client re-attaches
+        job.downloaded_bytes = row['downloaded_bytes']
+        job.total_bytes = row['total_bytes']
+
+        if row['store_key'] and media_store.lookup(row['store_key']) is not None:
+            # Finished just before the restart, or by another job since
+            job.status = 'finished'
+            job_journal.finish(job)
+            if Config.DRIVE_UPLOAD_ENABLED and job.drive_account:
+                upload_finished_job(job)  # Its upload ran after the download, so it was cut short at best
+            continue
+        if not row['store_key'] or time.time() - row['updated'] > Config.JOB_RESUME_MAX_AGE:
+            job.status = 'failed'
+            job_journal.finish(job)
+            if row['partial_path'] and os.path.exists(row['partial_path']):
+                os.remove(row['partial_path'])
+            app_logger.info(f"Dropped journaled job {job.job_id} ({job.video_url}): too old to resume")
+            continue
+
+        try:
+            download_queue.submit(job)
+        except QueueFullError:
+            job.status = 'failed'
+            job_journal.finish(job)
+            app_logger.warning(f"Could not resume job {job.job_id} ({job.video_url}): the queue is full")
+            continue
+        track_job(job)
+        socketio.start_background_task(cancel_if_unattended, job)
+        app_logger.info(f"Resuming job {job.job_id} ({job.video_url}) from {job.downloaded_bytes or 0} bytes")
+
+
+# --- Google Drive Upload ---
+def drive_room(account):
+    # Every connection signed in to the account, so uploads of resumed jobs reach the user once they reconnect
+    return f'drive:{account}'
+
+def emit_upload_update(upload):
+    job = upload.context
+    if upload.status == 'failed' and job.status != 'finished':
+        return  # The download itself failed or was cancelled, which is reported already
+    payload = dict(upload.to_dict(), job_id=job.job_id)
+    # Only to the job's owner: the file went to their Drive, not to that of clients sharing the download
+    room = drive_room(job.drive_account)
+    if upload.status == 'finished':
+        socketio.emit('upload_complete', payload, room=room)
+    elif upload.status == 'failed':
+        socketio.emit('upload_error', payload, room=room)
+    else:
+        socketio.emit('upload_progress', payload, room=room)
+
+drive_uploader = DriveUploader(
+    google_auth.authorized_http,
+    folder_name=Config.DRIVE_FOLDER_NAME,
+    base_url=Config.DRIVE_API_BASE_URL,
+    chunk_size=Config.DRIVE_UPLOAD_CHUNK_SIZE,
+    max_workers=Config.DRIVE_UPLOAD_WORKERS,
+    max_retries=Config.DRIVE_UPLOAD_MAX_RETRIES,
+    on_update=emit_upload_update,
+    spawn=socketio.start_background_task,
+)
+
+def followed_download_chunks(job):
+    # The job's file as it is being written; the upload keeps pace with the download
+    sent = 0
+    for data in follow_download(job, chunk_size=Config.STREAM_CHUNK_SIZE, idle_timeout=Config.STREAM_IDLE_TIMEOUT):
+        sent += len(data)
+        yield data
+    if job.status != 'finished':
+        raise DriveUploadError(f'The download {job.status}.')
+    if not job.output_path or os.path.getsize(job.output_path) != sent:
+        raise SourceChanged()  # Rewritten after downloading, e.g. by an m4a fixup
+
+def upload_finished_job(job):
+    entry = media_store.lookup(job.store_key) if job.status == 'finished' and job.store_key else None
+    if entry is None:
+        return
+    path = os.path.join(DOWNLOAD_FOLDER, entry['filename'])
+    drive_uploader.submit(DriveUpload(
+        entry['download_name'],
+        mimetypes.guess_type(entry['download_name'])[0],
+        file_chunks(path, drive_uploader.chunk_size),
+        context=job,
+        account=job.drive_account,
+    ))
+
+def start_drive_upload(job):
+    """
+    Uploads a job's file to the Drive of the client that queued it, if they
+    signed in with Google (job.drive_account). Single-file formats are
+    uploaded while they download, so the upload finishes shortly after the
+    download does; merged formats only exist once they are muxed, and
+    converted ones once ffmpeg is done, and are uploaded when the job
+    finishes.
+    """
+    if not Config.DRIVE_UPLOAD_ENABLED or not job.drive_account:
+        return
+    if job.preset or not is_streamable(job.format_id):
+        job.add_done_callback(upload_finished_job)
+        return
+
+    download_name = job_download_name(job)
+    drive_uploader.submit(DriveUpload(
+        download_name,
+        mimetypes.guess_type(download_name)[0],
+        followed_download_chunks(job),
+        fallback=lambda: file_chunks(job.output_path, drive_uploader.chunk_size),
+        context=job,
+        account=job.drive_account,
+    ))
+
+
+# --- Streaming While Downloading ---
+def job_download_name(job):
+    # Needed before the first byte is written, so take the extension from the cached video info
+    ext = None
+    info = metadata_cache.peek(job.video_url) or {}
+    for f in info.get('formats') or []:
+        if f.get('format_id') == job.format_id:
+            ext = f.get('ext')
+    return clean_title_for_filename(job.video_title) + (f'.{ext}' if ext else '')
+
+@app.route('/stream/<job_id>')
+def stream_download(job_id):
+    job = download_queue.get_job(job_id)
+    if job is None:
+        abort(404)
+    if not is_streamable(job.format_id):
+        return jsonify({'error': 'This quality is merged from separate video and audio streams and can only be saved once the download has finished.'}), 409
+    if job.preset:
+        return jsonify({'error': 'This download is converted once it has finished and can only be saved then.'}), 409
+
+    download_name = job_download_name(job)
+    response = Response(
+        counted_chunks('stream', follow_download(job, chunk_size=Config.STREAM_CHUNK_SIZE,
+                                                 idle_timeout=Config.STREAM_IDLE_TIMEOUT,
+                                                 refresh=download_queue.refresh)),
+        mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+    )
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.headers['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the whole stream
+    if job.store_key:
+        # Keep the finished file from being evicted while its tail is still being sent
+        media_store.pin_response(response, job.store_key)
+    app_logger.info(f"Streaming job {job_id} to client while it downloads")
+    return response
 
 
 # --- File Serving for Downloads ---
+def read_media_chunk(fd, size, offset):
+    # Disk reads of multi-GB files go through the executor so they never stall the hub
+    return blocking_executor.call(os.pread, fd, size, offset)
+
 @app.route('/downloads/<path:filename>')
 def serve_downloaded_file(filename):
-    return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True)
+    if os.path.basename(filename).startswith('.'):
+        abort(404)  # The store index and other bookkeeping files are not downloads
+
+    key, entry = media_store.lookup_filename(filename)
+    if entry is None:
+        # Not in the store (e.g. downloaded before it existed); only hand out media files
+        if os.path.splitext(filename)[1].lstrip('.').lower() not in Config.ALLOWED_FORMATS:
+            abort(404)
+        return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True)
+
+    # Pin the file so eviction cannot delete it while it is being sent
+    media_store.acquire(key)
+    start = time.perf_counter()
+
+    def sent(nbytes):
+        media_store.release(key)
+        record_served('downloads', nbytes, time.perf_counter() - start)
+
+    try:
+        return send_media(
+            request,
+            os.path.join(DOWNLOAD_FOLDER, entry['filename']),
+            entry['download_name'],
+            # Stored files are content-addressed and never rewritten in place, so the index is enough to validate caches
+            etag=f"{key}-{entry['size']}-{int(entry['created'])}",
+            last_modified=entry['created'],
+            accel=Config.MEDIA_ACCEL,
+            accel_uri=Config.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + entry['filename'],
+            chunk_size=Config.MEDIA_CHUNK_SIZE,
+            read=read_media_chunk,
+            on_close=sent,
+        )
+    except BaseException:
+        # No response will be closed, e.g. the file was deleted since the lookup
+        media_store.release(key)
+        raise
 
 
 # --- Main Application Run Block ---
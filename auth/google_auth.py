@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import Flow
+
+logger = logging.getLogger(__name__)
+
+# Google adds 'openid' whenever the userinfo scopes are granted; requesting it
+# explicitly avoids oauthlib's "Scope has changed" error on the callback
+SCOPES = [
+    'openid',
+    'https://www.googleapis.com/auth/drive.file',
+    'https://www.googleapis.com/auth/userinfo.profile',
+    'https://www.googleapis.com/auth/userinfo.email',
+]
+
+
+class GoogleAuth:
+    """
+    OAuth2 sign-in for the Google accounts that downloads are uploaded to.
+
+    Tokens are kept in `tokens` (see auth/token_store.py): fetch_token()
+    returns the opaque account ID a user's token was stored under, which the
+    caller keeps per user (in the Flask session), and every other method
+    takes that ID.
+
+    Client settings come from `credentials_file` (the client secrets JSON
+    downloaded from the Cloud Console) when it exists, otherwise from the
+    client ID and secret.
+    """
+
+    def __init__(self, client_id, client_secret, redirect_uri, credentials_file, tokens):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.credentials_file = credentials_file
+        self.tokens = tokens
+
+        if redirect_uri.startswith(('http://localhost', 'http://127.0.0.1')):
+            # oauthlib refuses plain-HTTP callbacks unless told this is local development
+            os.environ.setdefault('OAUTHLIB_INSECURE_TRANSPORT', '1')
+
+    def _client_config(self):
+        if os.path.exists(self.credentials_file):
+            with open(self.credentials_file) as f:
+                return json.load(f)
+        return {
+            'web': {
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+                'token_uri': 'https://oauth2.googleapis.com/token',
+                'redirect_uris': [self.redirect_uri],
+            }
+        }
+
+    def _flow(self, state=None):
+        return Flow.from_client_config(self._client_config(), scopes=SCOPES, state=state,
+                                       redirect_uri=self.redirect_uri)
+
+    def authorization_url(self):
+        """Returns (url, state) to send the user to Google's consent screen."""
+        # offline + consent so a refresh token is issued every time
+        return self._flow().authorization_url(access_type='offline', prompt='consent', include_granted_scopes='true')
+
+    def fetch_token(self, authorization_response, state):
+        """Exchanges the callback URL's code for a token and returns the user's account ID."""
+        flow = self._flow(state=state)
+        flow.fetch_token(authorization_response=authorization_response)
+        logger.info("Google account authorised")
+        return self.tokens.add(self._serialize(flow.credentials))
+
+    def sign_out(self, account):
+        if account:
+            self.tokens.remove(account)
+
+    @staticmethod
+    def _serialize(credentials):
+        # The client secret is not part of it; it stays in the client config
+        return json.dumps({
+            'token': credentials.token,
+            'refresh_token': credentials.refresh_token,
+            'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
+        })
+
+    def credentials(self, account):
+        """
+        Returns valid credentials for an account ID, refreshing them if
+        needed, or None when there is no such account (or its token cannot
+        be used).
+        """
+        token = self.tokens.get(account)
+        if not token:
+            return None
+        try:
+            data = json.loads(token)
+            client = next(iter(self._client_config().values()))
+            credentials = Credentials(
+                data.get('token'),
+                refresh_token=data.get('refresh_token'),
+                token_uri=client.get('token_uri', 'https://oauth2.googleapis.com/token'),
+                client_id=client.get('client_id'),
+                client_secret=client.get('client_secret'),
+                scopes=SCOPES,
+                # google-auth compares expiry with naive UTC datetimes
+                expiry=datetime.fromisoformat(data['expiry']).replace(tzinfo=None) if data.get('expiry') else None,
+            )
+        except (ValueError, TypeError, KeyError, OSError, StopIteration, AttributeError) as e:
+            logger.error(f"Error loading credentials: {e}")
+            return None
+
+        if not credentials.valid and credentials.refresh_token:
+            try:
+                credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+            except Exception as e:
+                logger.error(f"Error refreshing credentials: {e}")
+                return None
+            self.tokens.update(account, self._serialize(credentials))
+        return credentials if credentials.valid else None
+
+    def is_authorized(self, account):
+        return self.credentials(account) is not None
+
+    def authorized_http(self, account, timeout=60):
+        """
+        Returns an httplib2 client that signs every request with the
+        account's credentials and refreshes the access token on a 401. Each one keeps its
+        own keep-alive connections, so callers should pool them rather than
+        create one per request.
+        """
+        credentials = self.credentials(account)
+        if credentials is None:
+            raise PermissionError('No Google account is authorised for Drive uploads.')
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))
@@ -0,0 +1,60 @@
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenStore:
+    """
+    Google tokens of signed-in users, kept server-side under an opaque,
+    random account ID. Only that ID goes into the Flask session (a signed
+    but readable cookie) and into job records (the shared queue, the job
+    journal), so neither gives access to anyone's Drive.
+
+    Backed by sqlite like the job journal, so the web processes and the
+    download workers (see worker.py) sharing the file see the same
+    accounts. The file is created readable by its owner only.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tokens (account_id TEXT PRIMARY KEY, token TEXT NOT NULL, updated REAL NOT NULL)'
+            )
+
+    def add(self, token):
+        """Stores a new token and returns the account ID to look it up by."""
+        account_id = secrets.token_urlsafe(32)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO tokens (account_id, token, updated) VALUES (?, ?, ?)',
+                               (account_id, token, time.time()))
+        return account_id
+
+    def get(self, account_id):
+        if not account_id:
+            return None
+        with self._lock:
+            row = self._conn.execute('SELECT token FROM tokens WHERE account_id = ?', (account_id,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, account_id, token):
+        """Replaces an account's token, e.g. after refreshing it."""
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE tokens SET token = ?, updated = ? WHERE account_id = ?',
+                               (token, time.time(), account_id))
+
+    def remove(self, account_id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM tokens WHERE account_id = ?', (account_id,))
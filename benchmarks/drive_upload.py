@@ -0,0 +1,139 @@
+"""
+Measures the Drive upload pipeline against benchmarks.fake_drive.
+
+Simulates --files downloads that each write --size bytes at --download-rate
+bytes/s, and uploads them through downloads.drive_uploader.DriveUploader
+to a fake Drive limited to --upload-rate bytes/s per request, in two modes:
+
+- sequential: each upload starts after its download has finished
+  (wall time ~ download + upload)
+- pipelined:  each upload follows its file while it is being written
+  (wall time ~ max(download, upload))
+
+Every uploaded file is checked against the bytes written. Reports JSON:
+
+    python benchmarks/drive_upload.py --files 3 --size 67108864 --fail-every 5
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httplib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.fake_drive import FakeDriveServer  # noqa: E402
+from downloads.drive_uploader import DriveUpload, DriveUploader, file_chunks  # noqa: E402
+from downloads.streaming import follow_download  # noqa: E402
+
+
+class FakeJob:
+    """What follow_download needs from a download job."""
+
+    def __init__(self, job_id, path):
+        self.job_id = job_id
+        self.partial_path = path + '.part'
+        self.output_path = path
+        self.status = 'running'
+
+
+def simulate_download(job, size, rate, block=256 * 1024):
+    # Written like yt-dlp: into <name>.part, renamed when complete
+    digest = hashlib.sha1()
+    written = 0
+    start = time.perf_counter()
+    with open(job.partial_path, 'wb') as f:
+        while written < size:
+            data = os.urandom(min(block, size - written))
+            f.write(data)
+            f.flush()
+            digest.update(data)
+            written += len(data)
+            ahead = written / rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+    os.replace(job.partial_path, job.output_path)
+    job.status = 'finished'
+    return digest.hexdigest()
+
+
+def run(mode, args, folder):
+    server = FakeDriveServer(fail_every=args.fail_every, bandwidth=args.upload_rate).start()
+    uploader = DriveUploader(
+        lambda account: httplib2.Http(timeout=60),
+        'YouTube Downloads',
+        base_url=server.url,
+        chunk_size=args.chunk_size,
+        max_workers=args.files,
+        backoff_base=0.05,
+    )
+    digests = {}
+    uploads = []
+
+    def pipeline(i):
+        job = FakeJob(f'{mode}-{i}', os.path.join(folder, f'{mode}-{i}.mp4'))
+        if mode == 'pipelined':
+            upload = DriveUpload(os.path.basename(job.output_path), 'video/mp4',
+                                 follow_download(job, chunk_size=args.chunk_size, poll_interval=0.05))
+            uploader_thread = threading.Thread(target=uploader.upload, args=(upload,))
+            uploader_thread.start()
+            digests[upload.name] = simulate_download(job, args.size, args.download_rate)
+            uploader_thread.join()
+        else:
+            digests[os.path.basename(job.output_path)] = simulate_download(job, args.size, args.download_rate)
+            upload = DriveUpload(os.path.basename(job.output_path), 'video/mp4',
+                                 file_chunks(job.output_path, args.chunk_size))
+            uploader.upload(upload)
+        uploads.append(upload)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=pipeline, args=(i,)) for i in range(args.files)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    stored = {f['name']: f['sha1'] for f in server.files.values()}
+    if any(upload.status != 'finished' for upload in uploads) or stored != digests:
+        sys.exit(f'{mode}: uploaded files do not match what was downloaded')
+    return {
+        'wall_seconds': round(elapsed, 2),
+        'aggregate_upload_mb_per_s': round(args.files * args.size / elapsed / 1e6, 1),
+        'requests': server.requests,
+        'connections': server.connections,
+        'injected_failures': server.failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--size', type=int, default=64 * 1024 * 1024)
+    parser.add_argument('--chunk-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--download-rate', type=float, default=32e6, help='Bytes/s written per download')
+    parser.add_argument('--upload-rate', type=float, default=32e6, help='Bytes/s accepted per upload request')
+    parser.add_argument('--fail-every', type=int, default=0, help='Fail every Nth chunk with a 503')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        report = {
+            'files': args.files,
+            'size_bytes': args.size,
+            'chunk_size': args.chunk_size,
+            'download_seconds_each': round(args.size / args.download_rate, 2),
+            'upload_seconds_each': round(args.size / args.upload_rate, 2),
+            'sequential': run('sequential', args, folder),
+            'pipelined': run('pipelined', args, folder),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Minimal in-process fake of the Drive v3 endpoints used by
+downloads.drive_uploader: folder lookup/creation and resumable uploads.
+
+    server = FakeDriveServer(fail_every=7, bandwidth=20e6).start()
+    uploader = DriveUploader(httplib2.Http, 'YouTube Downloads', base_url=server.url)
+    ...
+    server.stop()
+
+`fail_every=N` answers every Nth chunk PUT with a 503 after storing only
+half of it, to exercise retries and partial commits. `bandwidth` (bytes/s
+per request) and `latency` (seconds per request) simulate the network.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+GRANULARITY = 256 * 1024
+_RANGE_RE = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)')
+
+
+class FakeDriveServer:
+    def __init__(self, fail_every=0, bandwidth=None, latency=0.0):
+        self.fail_every = fail_every
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.folders = {}   # id -> name
+        self.files = {}     # id -> {'name', 'parents', 'size', 'sha1'}
+        self.sessions = {}  # session id -> {'metadata', 'data': bytearray}
+        self.connections = 0
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._httpd.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                data = bytearray()
+                start = time.perf_counter()
+                while len(data) < length:
+                    block = self.rfile.read(min(64 * 1024, length - len(data)))
+                    if not block:
+                        break
+                    data += block
+                    if server.bandwidth:
+                        ahead = len(data) / server.bandwidth - (time.perf_counter() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                return bytes(data)
+
+            def _reply(self, status, body=None, headers=None):
+                payload = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if body is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _start(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                return urlparse(self.path)
+
+            def do_GET(self):
+                url = self._start()
+                if url.path != '/drive/v3/files':
+                    return self._reply(404, {'error': 'not found'})
+                q = parse_qs(url.query).get('q', [''])[0]
+                name = re.search(r"name = '((?:[^'\\]|\\.)*)'", q)
+                name = name.group(1).replace("\\'", "'").replace('\\\\', '\\') if name else None
+                files = [{'id': fid} for fid, fname in server.folders.items() if fname == name]
+                self._reply(200, {'files': files})
+
+            def do_POST(self):
+                url = self._start()
+                metadata = json.loads(self._body() or b'{}')
+                if url.path == '/drive/v3/files':
+                    folder_id = uuid.uuid4().hex
+                    server.folders[folder_id] = metadata['name']
+                    return self._reply(200, {'id': folder_id})
+                if url.path == '/upload/drive/v3/files' and 'uploadType=resumable' in url.query:
+                    session_id = uuid.uuid4().hex
+                    server.sessions[session_id] = {'metadata': metadata, 'data': bytearray()}
+                    host = self.headers.get('Host')
+                    return self._reply(200, headers={'Location': f'http://{host}/upload/session/{session_id}'})
+                self._reply(404, {'error': 'not found'})
+
+            def do_DELETE(self):
+                url = self._start()
+                server.sessions.pop(url.path.rsplit('/', 1)[-1], None)
+                self._reply(204)
+
+            def do_PUT(self):
+                url = self._start()
+                session = server.sessions.get(url.path.rsplit('/', 1)[-1])
+                data = self._body()
+                if session is None:
+                    return self._reply(404, {'error': 'session not found'})
+                match = _RANGE_RE.fullmatch(self.headers.get('Content-Range', ''))
+                if not match:
+                    return self._reply(400, {'error': 'bad Content-Range'})
+                start, _, total = match.groups()
+                stored = session['data']
+
+                if start is not None:
+                    start = int(start)
+                    if start != len(stored):
+                        return self._reply(400, {'error': f'expected offset {len(stored)}, got {start}'})
+                    with server._lock:
+                        server._puts += 1
+                        fail = server.fail_every and server._puts % server.fail_every == 0
+                    if fail:
+                        # Store part of the chunk, then fail, like a dropped connection would
+                        server.failures += 1
+                        stored += data[:(len(data) // 2) // GRANULARITY * GRANULARITY]
+                        return self._reply(503, {'error': 'backend error'})
+                    if total == '*' and len(data) % GRANULARITY:
+                        return self._reply(400, {'error': 'chunk size must be a multiple of 256 KiB'})
+                    stored += data
+
+                if total != '*' and len(stored) == int(total):
+                    file_id = uuid.uuid4().hex
+                    server.files[file_id] = {
+                        'name': session['metadata'].get('name'),
+                        'parents': session['metadata'].get('parents'),
+                        'size': len(stored),
+                        'sha1': hashlib.sha1(stored).hexdigest(),
+                    }
+                    del server.sessions[url.path.rsplit('/', 1)[-1]]
+                    return self._reply(200, {
+                        'id': file_id,
+                        'name': server.files[file_id]['name'],
+                        'size': str(len(stored)),
+                        'webViewLink': f'https://drive.google.com/file/d/{file_id}/view',
+                    })
+                headers = {'Range': f'bytes=0-{len(stored) - 1}'} if stored else {}
+                self._reply(308, headers=headers)
+
+        return Handler
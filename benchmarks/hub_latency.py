@@ -0,0 +1,92 @@
+"""
+Measures how responsive the server stays while downloads are running.
+
+Starts N downloads over Socket.IO, then repeatedly times GET / and
+POST /get_video_info and reports p50/p99 latency as JSON. Run it against a
+server started with `python app.py`, once per revision you want to compare:
+
+    python benchmarks/hub_latency.py --video-url https://youtu.be/<id> --downloads 4
+
+Requires the Socket.IO client: pip install "python-socketio[client]"
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import urllib.request
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 2) if samples else None,
+        'mean_ms': round(statistics.mean(samples) * 1000, 2) if samples else None,
+    }
+
+
+def timed_request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def start_downloads(base_url, video_url, format_id, count):
+    try:
+        import socketio
+    except ImportError:
+        sys.exit('python-socketio[client] is required: pip install "python-socketio[client]"')
+
+    clients = []
+    for _ in range(count):
+        # One client per download so the per-session queue limit does not apply
+        client = socketio.Client()
+        client.connect(base_url, transports=['websocket'])
+        client.emit('start_download', {'video_url': video_url, 'format_id': format_id, 'video_title': 'benchmark'})
+        clients.append(client)
+    return clients
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--video-url', required=True, help='Video to download and look up')
+    parser.add_argument('--format-id', default='best')
+    parser.add_argument('--downloads', type=int, default=4, help='Concurrent downloads to keep running')
+    parser.add_argument('--samples', type=int, default=50, help='Requests per endpoint')
+    args = parser.parse_args()
+
+    clients = start_downloads(args.base_url, args.video_url, args.format_id, args.downloads)
+    time.sleep(2)  # Let the downloads get past extraction
+
+    index_samples, info_samples = [], []
+    try:
+        for _ in range(args.samples):
+            index_samples.append(timed_request(f'{args.base_url}/'))
+        for _ in range(max(1, args.samples // 10)):
+            info_samples.append(timed_request(f'{args.base_url}/get_video_info', {'url': args.video_url}))
+    finally:
+        for client in clients:
+            client.disconnect()
+
+    print(json.dumps({
+        'downloads': args.downloads,
+        'index': summarize(index_samples),
+        'get_video_info': summarize(info_samples),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Cost of keeping the download folder index current.
+
+Fills a scratch folder with --files files and compares, per refresh:
+
+- full:       os.scandir() and a stat() of every file (what a janitor
+              without an index would do on every sweep)
+- unchanged:  downloads.janitor.FolderIndex.refresh() when nothing changed
+- changed:    refresh() after --changes files were added and removed
+
+--partial of the files are .part files, which the index stats on every
+refresh because they can still be growing. Reports JSON:
+
+    python benchmarks/janitor_scan.py --files 20000 --changes 10
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.hub_latency import percentile  # noqa: E402
+from downloads.janitor import FolderIndex  # noqa: E402
+
+
+def full_scan(folder):
+    files = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            st = entry.stat(follow_symlinks=False)
+            files[entry.name] = (st.st_ino, st.st_size, st.st_mtime)
+    return files
+
+
+def timed(fn, rounds, before=None):
+    samples = []
+    for i in range(rounds):
+        if before is not None:
+            before(i)
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'p50_ms': round(percentile(samples, 50) * 1000, 3), 'p99_ms': round(percentile(samples, 99) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--partial', type=int, default=10, help='Of which .part files')
+    parser.add_argument('--changes', type=int, default=10, help='Files added and removed between refreshes')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix='janitor-scan-')
+    try:
+        for i in range(args.files):
+            name = f'{i:024x}.mp4' + ('.part' if i < args.partial else '')
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'\0' * 64)
+        index = FolderIndex(folder)
+        index.refresh()
+
+        def churn(round_number):
+            # Directory mtimes have nanosecond resolution on most filesystems, but not all
+            time.sleep(0.01)
+            for j in range(args.changes):
+                os.remove(os.path.join(folder, f'{args.partial + (round_number * args.changes + j) % (args.files - args.partial):024x}.mp4'))
+                with open(os.path.join(folder, f'new-{round_number}-{j}.mp4'), 'wb') as f:
+                    f.write(b'\0')
+
+        print(json.dumps({
+            'files': args.files,
+            'partial_files': args.partial,
+            'changes_per_refresh': args.changes,
+            'full': timed(lambda: full_scan(folder), args.rounds),
+            'unchanged': timed(index.refresh, args.rounds),
+            'changed': timed(index.refresh, args.rounds, before=churn),
+        }, indent=2))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
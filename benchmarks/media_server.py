@@ -0,0 +1,218 @@
+"""
+Local HTTP media server for offline benchmarks.
+
+Serves a synthetic catalog that the stub extractor in
+benchmarks/plugins/yt_dlp_plugins/extractor/offline_bench.py reads:
+
+    GET /bench/<video_id>                      watch page (what gets "extracted")
+    GET /bench/<video_id>/info.json            video metadata and formats
+    GET /media/<video_id>/<format>.<ext>       progressive file, with Range support
+    GET /media/<video_id>/<format>/seg-<n>.m4s DASH fragment n
+
+Every video has the same formats: 'p360' (progressive mp4), 'a128'
+(progressive m4a) and 'dash720' (mp4 split into `fragment_size` fragments).
+Sizes follow `size` (bytes of the largest format). Content is
+deterministic filler, so repeated runs transfer identical bytes.
+
+`bandwidth` (bytes/s per connection) and `latency` (seconds before each
+response) simulate the network. Can also be run on its own:
+
+    python benchmarks/media_server.py --port 8765 --bandwidth 20e6 --latency 0.05
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_BLOCK = hashlib.sha256(b'offline-bench').digest() * 2048  # 64KB of filler
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+_MEDIA_RE = re.compile(r'/media/([\w-]+)/(\w+)(?:\.(\w+)|/seg-(\d+)\.m4s)')
+
+# format_id -> (ext, share of `size`, vcodec, acodec, height)
+FORMATS = {
+    'dash720': ('mp4', 1.0, 'avc1.64001f', 'mp4a.40.2', 720),
+    'p360': ('mp4', 0.4, 'avc1.42001e', 'mp4a.40.2', 360),
+    'a128': ('m4a', 0.1, 'none', 'mp4a.40.2', None),
+}
+
+
+class MediaServer:
+    def __init__(self, size=32 * 1024 * 1024, fragment_size=1024 * 1024, duration=300,
+                 bandwidth=None, latency=0.0, host='127.0.0.1', port=0):
+        self.size = size
+        self.fragment_size = fragment_size
+        self.duration = duration
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def video_url(self, video_id):
+        return f'{self.url}/bench/{video_id}'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def format_size(self, format_id):
+        return int(self.size * FORMATS[format_id][1])
+
+    def info(self, video_id):
+        base = f'{self.url}/media/{video_id}'
+        formats = []
+        for format_id, (ext, _, vcodec, acodec, height) in FORMATS.items():
+            size = self.format_size(format_id)
+            f = {
+                'format_id': format_id,
+                'ext': ext,
+                'vcodec': vcodec,
+                'acodec': acodec,
+                'height': height,
+                'width': height * 16 // 9 if height else None,
+                'filesize': size,
+                'tbr': size * 8 / 1000 / self.duration,
+            }
+            if format_id.startswith('dash'):
+                count = -(-size // self.fragment_size)
+                f.update({
+                    'protocol': 'http_dash_segments',
+                    'url': f'{base}/{format_id}/manifest.mpd',
+                    'fragment_base_url': f'{base}/{format_id}/',
+                    'fragments': [{'path': f'seg-{n}.m4s', 'duration': self.duration / count} for n in range(count)],
+                })
+            else:
+                f.update({'protocol': 'http', 'url': f'{base}/{format_id}.{ext}'})
+            formats.append(f)
+        return {
+            'id': video_id,
+            'title': f'Offline benchmark video {video_id}',
+            'duration': self.duration,
+            'channel': 'Benchmarks',
+            'uploader': 'Benchmarks',
+            'thumbnail': f'{self.url}/bench/{video_id}/thumb.jpg',
+            'formats': formats,
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_bytes(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _send_filler(self, status, start, length, content_type, headers):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(length))
+                self.send_header('Accept-Ranges', 'bytes')
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command == 'HEAD':
+                    return
+                sent = 0
+                began = time.perf_counter()
+                while sent < length:
+                    offset = (start + sent) % len(_BLOCK)
+                    block = _BLOCK[offset:offset + min(len(_BLOCK) - offset, length - sent)]
+                    self.wfile.write(block)
+                    sent += len(block)
+                    if server.bandwidth:
+                        # Drift-free: sleep until the bytes sent so far are due
+                        ahead = sent / server.bandwidth - (time.perf_counter() - began)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                with server._lock:
+                    server.bytes_sent += sent
+
+            def do_HEAD(self):
+                self.do_GET()
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                path = self.path.split('?', 1)[0]
+                page = re.fullmatch(r'/bench/([\w-]+)(/info\.json)?', path)
+                if page:
+                    if page.group(2):
+                        return self._send_bytes(200, json.dumps(server.info(page.group(1))).encode(), 'application/json')
+                    html = f'<html><head><title>{page.group(1)}</title></head><body></body></html>'
+                    return self._send_bytes(200, html.encode(), 'text/html')
+
+                media = _MEDIA_RE.fullmatch(path)
+                if not media or media.group(2) not in FORMATS:
+                    return self._send_bytes(404, b'not found', 'text/plain')
+                _, format_id, ext, segment = media.groups()
+                size = server.format_size(format_id)
+                if segment is not None:
+                    start = int(segment) * server.fragment_size
+                    if start >= size:
+                        return self._send_bytes(404, b'no such fragment', 'text/plain')
+                    return self._send_filler(200, start, min(server.fragment_size, size - start), 'video/iso.segment', {})
+
+                content_type = 'audio/mp4' if ext == 'm4a' else 'video/mp4'
+                match = _RANGE_RE.fullmatch(self.headers.get('Range', ''))
+                if not match or match.groups() == ('', ''):
+                    return self._send_filler(200, 0, size, content_type, {})
+                first, last = match.groups()
+                if first == '':
+                    first, last = max(0, size - int(last)), size - 1  # Suffix range
+                first, last = int(first), min(int(last) if last else size - 1, size - 1)
+                if first >= size or first > last:
+                    return self._send_bytes(416, b'', content_type, {'Content-Range': f'bytes */{size}'})
+                return self._send_filler(206, first, last - first + 1, content_type,
+                                         {'Content-Range': f'bytes {first}-{last}/{size}'})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--size', type=int, default=32 * 1024 * 1024)
+    parser.add_argument('--fragment-size', type=int, default=1024 * 1024)
+    parser.add_argument('--bandwidth', type=float, default=None, help='Bytes/s per connection')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds before each response')
+    args = parser.parse_args()
+    server = MediaServer(size=args.size, fragment_size=args.fragment_size, bandwidth=args.bandwidth,
+                         latency=args.latency, port=args.port).start()
+    print(f'Serving the offline benchmark catalog at {server.url}/bench/<video_id>')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
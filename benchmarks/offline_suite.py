@@ -0,0 +1,326 @@
+"""
+Offline benchmark suite: runs the app against benchmarks.media_server and
+the stub extractor in benchmarks/plugins, so no network access is needed
+and every run transfers the same bytes.
+
+Starts the media server and `app.py` (in a scratch directory, with the
+plugin on PYTHONPATH), then, for every --concurrency level:
+
+- info:     POST /get_video_info for new videos (cache misses), then again
+            for the same videos (cache hits)
+- download: Socket.IO clients that each run one 'start_download' at a time
+            until --downloads jobs have completed
+- serve:    GET /downloads/<file> for the downloaded files
+
+and reports throughput, p50/p99 latency and the server's peak RSS as JSON:
+
+    python benchmarks/offline_suite.py --concurrency 1,4 --format dash720 --output run.json
+    python benchmarks/offline_suite.py --baseline run.json --tolerance 0.15
+
+With --baseline the run exits with status 1 when a throughput dropped, or
+a latency or the peak RSS grew, by more than --tolerance. Pass settings to
+the server with --server-env, e.g. --server-env MAX_CONCURRENT_DOWNLOADS=8.
+--preset converts every download (needs ffmpeg, or FFMPEG_PATH in
+--server-env).
+
+Requires the Socket.IO client: pip install "python-socketio[client]"
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.hub_latency import percentile  # noqa: E402
+from benchmarks.media_server import FORMATS, MediaServer  # noqa: E402
+
+PLUGIN_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'plugins')
+
+
+def latency_stats(samples, seconds, nbytes=None):
+    stats = {
+        'count': len(samples),
+        'per_second': round(len(samples) / seconds, 2) if seconds else None,
+        'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 2) if samples else None,
+    }
+    if nbytes is not None:
+        stats['mb_per_s'] = round(nbytes / seconds / 1e6, 2) if seconds else None
+    return stats
+
+
+class AppServer:
+    """`app.py` in a subprocess, with its downloads, journal and logs in a scratch directory."""
+
+    def __init__(self, workdir, port, env):
+        self.workdir = workdir
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}'
+        self.env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(REPO_ROOT), PLUGIN_DIR]), **env)
+        self.process = None
+
+    def start(self, timeout=60):
+        code = (f"import app; app.socketio.run(app.app, host='127.0.0.1', port={self.port}, "
+                "debug=False, use_reloader=False, log_output=False)")
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.process = subprocess.Popen([sys.executable, '-c', code], cwd=self.workdir, env=self.env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                sys.exit(f'The app exited during startup; see {self.log.name}')
+            try:
+                urllib.request.urlopen(self.url + '/', timeout=2).read()
+                return self
+            except OSError:
+                time.sleep(0.2)
+        sys.exit('The app did not start in time')
+
+    def peak_rss_mb(self):
+        # High-water mark of the server process (Linux); includes yt-dlp running on its threads
+        try:
+            with open(f'/proc/{self.process.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def post_json(url, body):
+    req = urllib.request.Request(url, data=json.dumps(body).encode(), headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=300) as resp:
+        return json.loads(resp.read())
+
+
+def run_timed(fn, items, concurrency):
+    """Runs fn(item) at `concurrency`; returns (per-item seconds, results, wall seconds)."""
+    def timed(item):
+        start = time.perf_counter()
+        result = fn(item)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(timed, items))
+    return [t for t, _ in outcomes], [r for _, r in outcomes], time.perf_counter() - start
+
+
+def bench_info(app_url, media, video_ids, concurrency):
+    def lookup(video_id):
+        info = post_json(app_url + '/get_video_info', {'url': media.video_url(video_id)})
+        if 'error' in info:
+            raise RuntimeError(info['error'])
+        return info
+
+    cold = run_timed(lookup, video_ids, concurrency)
+    warm = run_timed(lookup, video_ids, concurrency)
+    return {'cold': latency_stats(cold[0], cold[2]), 'warm': latency_stats(warm[0], warm[2])}
+
+
+def bench_download(app_url, media, video_ids, format_id, concurrency, timeout, preset=None):
+    import socketio
+
+    pending = list(video_ids)
+    lock = threading.Lock()
+    latencies, file_urls, errors = [], [], []
+
+    def client_loop():
+        client = socketio.Client()
+        done = threading.Event()
+        outcome = {}
+
+        @client.on('download_complete')
+        def on_complete(data):
+            outcome['file_url'] = data['file_url']
+            done.set()
+
+        @client.on('download_error')
+        def on_error(data):
+            outcome['error'] = data.get('message')
+            done.set()
+
+        client.connect(app_url)
+        try:
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    video_id = pending.pop()
+                done.clear()
+                outcome.clear()
+                start = time.perf_counter()
+                client.emit('start_download', {'video_url': media.video_url(video_id), 'format_id': format_id,
+                                               'video_title': video_id, 'preset': preset})
+                if not done.wait(timeout):
+                    outcome['error'] = 'timed out'
+                with lock:
+                    if 'file_url' in outcome:
+                        latencies.append(time.perf_counter() - start)
+                        file_urls.append(outcome['file_url'])
+                    else:
+                        errors.append(f"{video_id}: {outcome.get('error')}")
+        finally:
+            client.disconnect()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    stats = latency_stats(latencies, elapsed, nbytes=len(latencies) * media.format_size(format_id))
+    stats['errors'] = errors[:10]
+    return stats, file_urls
+
+
+def bench_serve(app_url, file_urls, requests, concurrency):
+    def fetch(file_url):
+        with urllib.request.urlopen(app_url + file_url, timeout=300) as resp:
+            size = 0
+            while True:
+                block = resp.read(1024 * 1024)
+                if not block:
+                    return size
+                size += len(block)
+
+    urls = [file_urls[i % len(file_urls)] for i in range(requests)]
+    latencies, sizes, elapsed = run_timed(fetch, urls, concurrency)
+    return latency_stats(latencies, elapsed, nbytes=sum(sizes))
+
+
+def flatten(report, prefix=''):
+    for key, value in report.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from flatten(value, path + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def regressions(report, baseline, tolerance):
+    """Compares the measurements (not the settings) of two reports."""
+    current = dict(flatten(report.get('results', {})))
+    found = []
+    for path, old in flatten(baseline.get('results', {})):
+        new = current.get(path)
+        if new is None or not old:
+            continue
+        name = path.rsplit('.', 1)[-1]
+        if name in ('per_second', 'mb_per_s') and new < old * (1 - tolerance):
+            found.append(f'{path}: {old} -> {new}')
+        elif (name.endswith('_ms') or name == 'peak_rss_mb') and new > old * (1 + tolerance):
+            found.append(f'{path}: {old} -> {new}')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4', help='Comma-separated client concurrency levels')
+    parser.add_argument('--videos', type=int, default=16, help='Videos looked up per level')
+    parser.add_argument('--downloads', type=int, default=8, help='Downloads per level')
+    parser.add_argument('--serve-requests', type=int, default=32, help='File requests per level')
+    parser.add_argument('--format', default='dash720', choices=sorted(FORMATS), help='Format to download')
+    parser.add_argument('--preset', help='Convert downloads with this preset (see downloads/transcode.py)')
+    parser.add_argument('--size', type=int, default=32 * 1024 * 1024, help='Bytes of the largest format')
+    parser.add_argument('--fragment-size', type=int, default=1024 * 1024, help='DASH fragment size')
+    parser.add_argument('--bandwidth', type=float, default=50e6, help='Media server bytes/s per connection')
+    parser.add_argument('--latency', type=float, default=0.02, help='Media server seconds per request')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE')
+    parser.add_argument('--download-timeout', type=float, default=600)
+    parser.add_argument('--output', help='Also write the report to this file')
+    parser.add_argument('--baseline', help='Report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+
+    try:
+        import socketio  # noqa: F401
+    except ImportError:
+        sys.exit('python-socketio[client] is required: pip install "python-socketio[client]"')
+
+    levels = [int(n) for n in args.concurrency.split(',')]
+    server_env = dict(item.split('=', 1) for item in args.server_env)
+    media = MediaServer(size=args.size, fragment_size=args.fragment_size, bandwidth=args.bandwidth,
+                        latency=args.latency).start()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        app_server = AppServer(workdir, args.port, server_env).start()
+        try:
+            run_id = uuid.uuid4().hex[:6]
+            for level in levels:
+                info_ids = [f'{run_id}-i{level}-{n}' for n in range(args.videos)]
+                download_ids = [f'{run_id}-d{level}-{n}' for n in range(args.downloads)]
+                download, file_urls = bench_download(app_server.url, media, download_ids, args.format, level,
+                                                     args.download_timeout, args.preset)
+                results[f'concurrency_{level}'] = {
+                    'info': bench_info(app_server.url, media, info_ids, level),
+                    'download': download,
+                    'serve': bench_serve(app_server.url, file_urls, args.serve_requests, level) if file_urls else None,
+                }
+            results['peak_rss_mb'] = app_server.peak_rss_mb()
+        finally:
+            app_server.stop()
+            media.stop()
+
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                  text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    report = {
+        'revision': revision,
+        'settings': {
+            'format': args.format,
+            'preset': args.preset,
+            'size_bytes': media.format_size(args.format),
+            'fragment_size': args.fragment_size,
+            'bandwidth': args.bandwidth,
+            'latency': args.latency,
+            'server_env': server_env,
+        },
+        'results': results,
+    }
+    if results.get('peak_rss_mb') is None:
+        # Not on Linux: the largest child process RSS (KB on Linux, bytes on macOS)
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        results['peak_rss_mb'] = round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        if found:
+            print('Regressions beyond {:.0%}:\n  '.format(args.tolerance) + '\n  '.join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""
+Stub extractor for the offline benchmarks: "extracts" the videos of
+benchmarks.media_server by fetching their info.json, so yt-dlp downloads
+from the local server instead of YouTube. yt-dlp loads it as a plugin
+when benchmarks/plugins is on PYTHONPATH.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class OfflineBenchIE(InfoExtractor):
+    IE_NAME = 'offline-bench'
+    _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost)(?::\d+)?/bench/(?P<id>[\w-]+)/?(?:$|[?#])'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return self._download_json(f'{url.split("?")[0].rstrip("/")}/info.json', video_id, note='Downloading benchmark info')
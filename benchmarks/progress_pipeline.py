@@ -0,0 +1,115 @@
+"""
+Compares the cost of progress reporting with and without coalescing.
+
+Simulates N concurrent downloads whose yt-dlp progress hooks fire at a given
+rate. The "direct" pipeline emits one Socket.IO message and writes one log
+line per callback (the original behaviour); the "coalesced" pipeline goes
+through downloads.progress.ProgressAggregator and LogSampler. Emitting is
+simulated by JSON-encoding the payload, which is what the Socket.IO server
+does for every message. Reports messages per second and CPU time as JSON:
+
+    python benchmarks/progress_pipeline.py --jobs 50 --callbacks-per-second 20
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from downloads.progress import LogSampler, ProgressAggregator  # noqa: E402
+
+
+def make_logger():
+    bench_logger = logging.getLogger('benchmark.progress')
+    bench_logger.propagate = False
+    bench_logger.setLevel(logging.INFO)
+    if not bench_logger.handlers:
+        bench_logger.addHandler(logging.FileHandler(os.devnull))
+    return bench_logger
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.messages = 0
+
+    def emit(self, event, data, room=None):
+        json.dumps([event, data])
+        self.messages += 1
+
+
+def progress_payload(job, tick):
+    percent = tick % 100
+    return {
+        'progress': percent,
+        'message': f'Downloading: {percent}MiB / 100MiB at 5.00MiB/s ETA 00:{100 - percent:02d}',
+        'status': 'downloading',
+    }
+
+
+def run_direct(jobs, callbacks_per_second, seconds, bench_logger):
+    sio = FakeSocketIO()
+    start = time.process_time()
+    for tick in range(int(callbacks_per_second * seconds)):
+        for job in range(jobs):
+            payload = progress_payload(job, tick)
+            sio.emit('progress_update', dict(payload, job_id=job), room=f'client-{job}')
+            bench_logger.info(f"Download Progress: {payload['progress']:.1f}% - {payload['message']}")
+    return sio.messages, time.process_time() - start
+
+
+def run_coalesced(jobs, callbacks_per_second, seconds, rate, bench_logger):
+    sio = FakeSocketIO()
+    aggregator = ProgressAggregator(sio.emit, rate=rate, spawn=lambda fn: None)
+    # The sampler runs on a simulated clock so the run does not depend on wall time
+    clock = [0.0]
+    sampler = LogSampler(interval=10.0, clock=lambda: clock[0])
+
+    rooms = [(f'client-{job}',) for job in range(jobs)]
+    callbacks_per_tick = max(1, int(callbacks_per_second / rate))
+    start = time.process_time()
+    for tick in range(int(callbacks_per_second * seconds)):
+        clock[0] = tick / callbacks_per_second
+        for job in range(jobs):
+            payload = progress_payload(job, tick)
+            aggregator.update(job, payload, rooms[job])
+            if sampler.allow(('progress', job)):
+                bench_logger.info(f"Download Progress: {payload['progress']:.1f}% - {payload['message']}")
+        if (tick + 1) % callbacks_per_tick == 0:
+            aggregator.flush()
+    aggregator.flush()
+    return sio.messages, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--callbacks-per-second', type=float, default=20)
+    parser.add_argument('--seconds', type=float, default=30, help='Simulated download time')
+    parser.add_argument('--rate', type=float, default=2, help='Coalesced updates per second per client')
+    args = parser.parse_args()
+
+    bench_logger = make_logger()
+    direct_messages, direct_cpu = run_direct(args.jobs, args.callbacks_per_second, args.seconds, bench_logger)
+    coalesced_messages, coalesced_cpu = run_coalesced(
+        args.jobs, args.callbacks_per_second, args.seconds, args.rate, bench_logger
+    )
+
+    print(json.dumps({
+        'jobs': args.jobs,
+        'callbacks_per_second': args.callbacks_per_second,
+        'direct': {
+            'messages_per_second': round(direct_messages / args.seconds, 1),
+            'cpu_seconds': round(direct_cpu, 3),
+        },
+        'coalesced': {
+            'messages_per_second': round(coalesced_messages / args.seconds, 1),
+            'cpu_seconds': round(coalesced_cpu, 3),
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
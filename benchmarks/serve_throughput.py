@@ -0,0 +1,149 @@
+"""
+Measures /downloads/ serving throughput and how it scales with concurrent
+readers, plus the latency of small Range requests (seeking in a player).
+
+Creates a file of --size bytes (1 GB by default) in the download store,
+starts the app on a free port (unless --base-url points at a running
+server, e.g. gunicorn or nginx in front of it) and reports JSON:
+
+    python benchmarks/serve_throughput.py --size 1073741824 --concurrency 1,2,4,8
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from benchmarks.hub_latency import summarize  # noqa: E402
+from config import Config  # noqa: E402
+from downloads.store import MediaStore  # noqa: E402
+
+BENCH_VIDEO_ID = 'benchmark-serve'
+
+
+def prepare_file(size):
+    store = MediaStore(os.path.join(ROOT, Config.DOWNLOAD_FOLDER))
+    key = MediaStore.make_key(BENCH_VIDEO_ID, str(size))
+    path = os.path.join(store.folder, f'{key}.mp4')
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+        block = os.urandom(1024 * 1024)
+        with open(path, 'wb') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+    store.add(key, path, BENCH_VIDEO_ID, str(size), 'benchmark')
+    return os.path.basename(path)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    code = f"import app; app.socketio.run(app.app, host='127.0.0.1', port={port}, log_output=False)"
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit('Server did not start')
+
+
+def fetch(base_url, path, headers=None):
+    parsed = urlparse(base_url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=300)
+    conn.request('GET', path, headers=headers or {})
+    resp = conn.getresponse()
+    received = 0
+    while True:
+        data = resp.read(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+    conn.close()
+    return resp.status, received
+
+
+def measure_concurrency(base_url, path, readers):
+    results = []
+
+    def reader():
+        results.append(fetch(base_url, path)[1])
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    total = sum(results)
+    return {
+        'readers': readers,
+        'seconds': round(elapsed, 3),
+        'aggregate_mb_per_s': round(total / elapsed / 1e6, 1),
+        'per_reader_mb_per_s': round(total / elapsed / 1e6 / readers, 1),
+    }
+
+
+def measure_ranges(base_url, path, size, count, length=1024 * 1024):
+    samples = []
+    for _ in range(count):
+        start = random.randrange(0, max(1, size - length))
+        begin = time.perf_counter()
+        status, received = fetch(base_url, path, {'Range': f'bytes={start}-{start + length - 1}'})
+        samples.append(time.perf_counter() - begin)
+        if status != 206 or received != min(length, size - start):
+            sys.exit(f'Unexpected range response: {status}, {received} bytes')
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024 * 1024 * 1024)
+    parser.add_argument('--concurrency', default='1,2,4,8')
+    parser.add_argument('--range-requests', type=int, default=50)
+    parser.add_argument('--base-url', help='Use a running server instead of starting one')
+    args = parser.parse_args()
+
+    filename = prepare_file(args.size)
+    proc = None
+    base_url = args.base_url
+    if not base_url:
+        port = free_port()
+        proc = start_server(port)
+        base_url = f'http://127.0.0.1:{port}'
+
+    path = f'/downloads/{filename}'
+    try:
+        report = {
+            'size_bytes': args.size,
+            'concurrency': [measure_concurrency(base_url, path, int(n)) for n in args.concurrency.split(',')],
+            'range_1mb': measure_ranges(base_url, path, args.size, args.range_requests),
+        }
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
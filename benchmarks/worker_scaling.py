@@ -0,0 +1,122 @@
+"""
+Load test for multi-worker mode: how download throughput scales with the
+number of worker processes sharing one job queue.
+
+A web node (no workers) submits --jobs jobs from --sessions clients to a
+downloads.shared_queue.SharedJobQueue; 1, 2, 4... worker nodes with --slots
+download slots each pull and run them. Every job simulates a network-bound
+download of --job-seconds. Reports JSON with the wall time, jobs/s and
+speedup per worker count, and how many jobs each worker ran:
+
+    python benchmarks/worker_scaling.py --workers 1,2,4 --jobs 48
+    python benchmarks/worker_scaling.py --broker redis://localhost:6379/15
+
+With the default memory:// broker the worker nodes are threads of this
+process; with a Redis URL they are separate processes.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from downloads.scheduler import DownloadJob  # noqa: E402
+from downloads.shared_queue import MemoryBroker, SharedJobQueue, connect_broker  # noqa: E402
+
+
+def simulated_download(seconds):
+    def run_job(job):
+        time.sleep(seconds)
+    return run_job
+
+
+def run_node(broker_url, prefix, slots, job_seconds):
+    # Worker node in its own process (Redis broker only)
+    queue = SharedJobQueue(connect_broker(broker_url), simulated_download(job_seconds), max_workers=slots,
+                           prefix=prefix, sync_interval=0.2)
+    queue.start()
+    while True:
+        time.sleep(3600)
+
+
+def run(workers, args):
+    prefix = f'bench-{uuid.uuid4().hex[:8]}'
+    if args.broker.startswith('memory://'):
+        broker = MemoryBroker()
+    else:
+        broker = connect_broker(args.broker)
+
+    processes = []
+    for _ in range(workers):
+        if isinstance(broker, MemoryBroker):
+            SharedJobQueue(broker, simulated_download(args.job_seconds), max_workers=args.slots,
+                           prefix=prefix, sync_interval=0.2).start()
+        else:
+            process = multiprocessing.Process(target=run_node, daemon=True,
+                                              args=(args.broker, prefix, args.slots, args.job_seconds))
+            process.start()
+            processes.append(process)
+
+    web = SharedJobQueue(broker, None, max_workers=0, max_queue_size=args.jobs,
+                         max_jobs_per_session=args.jobs, prefix=prefix, sync_interval=0.2)
+    done = threading.Semaphore(0)
+    jobs = []
+    start = time.perf_counter()
+    for i in range(args.jobs):
+        job = DownloadJob(f'client-{i % args.sessions}', f'https://example.com/{i}', 'best', f'Video {i}',
+                          store_key=f'{prefix}-{i}')
+        job.add_done_callback(lambda j: done.release())
+        jobs.append(web.submit(job))
+    for _ in jobs:
+        if not done.acquire(timeout=args.jobs * args.job_seconds + 60):
+            sys.exit(f'{workers} workers: timed out waiting for the jobs to finish')
+    elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.terminate()
+    if any(job.status != 'finished' for job in jobs):
+        sys.exit(f'{workers} workers: not every job finished')
+    per_worker = {}
+    for job in jobs:
+        worker = broker.hget(f'{prefix}:job:{job.job_id}', 'worker')
+        per_worker[worker] = per_worker.get(worker, 0) + 1
+    return {
+        'wall_seconds': round(elapsed, 2),
+        'jobs_per_second': round(args.jobs / elapsed, 2),
+        'jobs_per_worker': sorted(per_worker.values(), reverse=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--broker', default='memory://', help='memory:// or a Redis URL')
+    parser.add_argument('--workers', default='1,2,4', help='Worker counts to compare')
+    parser.add_argument('--slots', type=int, default=3, help='Concurrent downloads per worker')
+    parser.add_argument('--jobs', type=int, default=48)
+    parser.add_argument('--sessions', type=int, default=8, help='Clients the jobs are spread over')
+    parser.add_argument('--job-seconds', type=float, default=0.5, help='Simulated download time')
+    args = parser.parse_args()
+
+    results = {}
+    for workers in (int(n) for n in args.workers.split(',')):
+        results[workers] = run(workers, args)
+    baseline = results[min(results)]['wall_seconds']
+    for result in results.values():
+        result['speedup'] = round(baseline / result['wall_seconds'], 2)
+    print(json.dumps({
+        'broker': args.broker.split('@')[-1],
+        'jobs': args.jobs,
+        'slots_per_worker': args.slots,
+        'job_seconds': args.job_seconds,
+        'ideal_seconds_per_worker_count': {n: round(args.jobs * args.job_seconds / (n * args.slots), 2) for n in results},
+        'workers': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
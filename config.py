@@ -10,19 +10,101 @@ class Config:
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
     GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI') or 'http://localhost:5000/callback'
+    # Signed-in users' tokens (auth/token_store.py); worker.py processes must share it to upload
+    GOOGLE_TOKEN_FILE = os.environ.get('GOOGLE_TOKEN_FILE') or os.path.join('temp', 'google_tokens.sqlite')
     
     # Paths
     CREDENTIALS_FILE = 'auth/credentials.json'
-    TOKEN_FILE = 'token.json'  # Auto-generated after first login
+    DOWNLOAD_FOLDER = os.environ.get('DOWNLOAD_FOLDER') or 'media'  # Finished downloads; the janitor deletes from it
     TEMP_DIR = 'temp'
     LOG_DIR = 'logs'
     
     # Download settings
-    MAX_FILE_SIZE = 500 * 1024 * 1024  # 500MB
-    ALLOWED_FORMATS = ['mp4', 'webm', 'mkv', 'mp3', 'm4a']
+    MAX_FILE_SIZE = int(os.environ.get('MAX_FILE_SIZE') or 500 * 1024 * 1024)  # 500MB; larger downloads are downgraded, refused or aborted
+    ALLOWED_FORMATS = ['mp4', 'webm', 'mkv', 'mp3', 'm4a', 'opus']
+    ADMISSION_DOWNGRADE = (os.environ.get('ADMISSION_DOWNGRADE') or 'true').lower() in ('1', 'true', 'yes')  # Pick the best format that fits instead of refusing
+    # Byte quotas, refilled continuously over the window (0 = unlimited)
+    GLOBAL_DOWNLOAD_QUOTA = int(os.environ.get('GLOBAL_DOWNLOAD_QUOTA') or 100 * 1024 * 1024 * 1024)  # 100GB
+    SESSION_DOWNLOAD_QUOTA = int(os.environ.get('SESSION_DOWNLOAD_QUOTA') or 10 * 1024 * 1024 * 1024)  # 10GB per client address
+    DOWNLOAD_QUOTA_WINDOW = int(os.environ.get('DOWNLOAD_QUOTA_WINDOW') or 24 * 3600)  # Seconds
+    # Bandwidth ceilings in bytes/s (0 = unlimited)
+    MAX_DOWNLOAD_BANDWIDTH = int(os.environ.get('MAX_DOWNLOAD_BANDWIDTH') or 0)
+    SESSION_DOWNLOAD_BANDWIDTH = int(os.environ.get('SESSION_DOWNLOAD_BANDWIDTH') or 0)  # Per client address
+    # Reverse proxies in front of the app; their X-Forwarded-For gives the client address the limits are keyed by
+    TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES') or 0)
+    # Download folder retention (downloads/janitor.py). Above the max size, least-recently-used
+    # downloads are deleted until the folder is under the low watermark
+    DOWNLOAD_FOLDER_MAX_BYTES = int(os.environ.get('DOWNLOAD_FOLDER_MAX_BYTES') or 10 * 1024 * 1024 * 1024)  # 10GB
+    DOWNLOAD_FOLDER_LOW_WATERMARK = int(os.environ.get('DOWNLOAD_FOLDER_LOW_WATERMARK') or DOWNLOAD_FOLDER_MAX_BYTES * 8 // 10)
+    DOWNLOAD_MAX_AGE = int(os.environ.get('DOWNLOAD_MAX_AGE') or 0)  # Seconds after which finished downloads are deleted (0 = no limit)
+    DOWNLOAD_MAX_IDLE = int(os.environ.get('DOWNLOAD_MAX_IDLE') or 0)  # Seconds without a request after which they are deleted (0 = no limit)
+    PARTIAL_FILE_MAX_AGE = int(os.environ.get('PARTIAL_FILE_MAX_AGE') or 6 * 3600)  # .part/.ytdl files and unmerged streams of no running download, untouched this long
+    JANITOR_INTERVAL = float(os.environ.get('JANITOR_INTERVAL') or 60)  # Seconds between sweeps of the download folder
+    # Converting downloads (audio extraction, remuxing) with the presets in downloads/transcode.py
+    FFMPEG_PATH = os.environ.get('FFMPEG_PATH') or 'ffmpeg'
+    TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS') or 0)  # ffmpeg processes at once (0 = one per CPU core)
+
+    # Download scheduler
+    MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS') or 3)
+    MAX_QUEUE_SIZE = int(os.environ.get('MAX_QUEUE_SIZE') or 50)  # Queued jobs across all clients
+    MAX_JOBS_PER_SESSION = int(os.environ.get('MAX_JOBS_PER_SESSION') or 5)  # Queued + running per client
+    # Multi-worker mode: processes share the job queue through a broker, e.g. redis://localhost:6379/0
+    # (memory:// runs the shared queue in this process only). Empty = single-process queue
+    JOB_QUEUE_URL = os.environ.get('JOB_QUEUE_URL') or ''
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None  # Lets any process emit to any client
+    RUN_DOWNLOAD_WORKERS = (os.environ.get('RUN_DOWNLOAD_WORKERS') or 'true').lower() in ('1', 'true', 'yes')  # 'false' for web-only processes
+    JOB_SYNC_INTERVAL = float(os.environ.get('JOB_SYNC_INTERVAL') or 1.0)  # Seconds between shared progress/cancel syncs
+    JOB_WORKER_TIMEOUT = int(os.environ.get('JOB_WORKER_TIMEOUT') or 30)  # Jobs of a worker silent this long are requeued
+    WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT') or 0)  # worker.py serves /metrics here (0 = off)
+    HUB_LAG_INTERVAL = float(os.environ.get('HUB_LAG_INTERVAL') or 0.5)  # Seconds between eventlet hub lag samples (/metrics)
+    # OS threads for blocking yt-dlp work; must exceed MAX_CONCURRENT_DOWNLOADS
+    # so info lookups are not stuck behind running downloads
+    BLOCKING_POOL_SIZE = int(os.environ.get('BLOCKING_POOL_SIZE') or 10)
+    YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE') or 4)  # Prewarmed yt-dlp instances kept for extraction and for downloads each (0 = build one per use)
+
+    # Batch / playlist downloads
+    BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY') or 3)  # Items of one batch queued or running at once
+    MAX_BATCH_URLS = int(os.environ.get('MAX_BATCH_URLS') or 200)  # URLs per request; playlists count as one
+    FRAGMENT_CONCURRENCY = int(os.environ.get('FRAGMENT_CONCURRENCY') or 4)  # Parallel DASH/HLS fragments per download
+
+    # Serving finished downloads (/downloads/<filename>)
+    MEDIA_CHUNK_SIZE = int(os.environ.get('MEDIA_CHUNK_SIZE') or 256 * 1024)
+    # 'nginx' (X-Accel-Redirect) or 'sendfile' (Apache/lighttpd X-Sendfile) to let the front-end server send the bytes
+    MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL') or None
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX') or '/protected-downloads/'  # nginx 'internal' location aliasing DOWNLOAD_FOLDER
+
+    # Streaming while downloading (/stream/<job_id>)
+    STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE') or 256 * 1024)  # Bytes held in memory per stream
+    STREAM_IDLE_TIMEOUT = float(os.environ.get('STREAM_IDLE_TIMEOUT') or 120)  # Seconds without new data before giving up
+
+    # Progress reporting
+    PROGRESS_UPDATES_PER_SECOND = float(os.environ.get('PROGRESS_UPDATES_PER_SECOND') or 2)  # Per client
+    PROGRESS_LOG_INTERVAL = float(os.environ.get('PROGRESS_LOG_INTERVAL') or 10)  # Seconds between logged progress lines per job
+
+    # Video preview (/get_video_info with compact=1, /get_video_formats)
+    PREVIEW_DESCRIPTION_LENGTH = int(os.environ.get('PREVIEW_DESCRIPTION_LENGTH') or 500)  # Characters; /get_video_description has the rest
+    PREVIEW_FORMATS_PAGE_SIZE = int(os.environ.get('PREVIEW_FORMATS_PAGE_SIZE') or 50)  # Most formats per /get_video_formats page
+
+    # Video info cache
+    METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE') or 256)
+    METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL') or 1800)  # Seconds; signed URL expiry can shorten it
+    METADATA_CACHE_FILE = os.environ.get('METADATA_CACHE_FILE')  # e.g. temp/metadata_cache.sqlite to survive restarts
+
+    # Job journal (resuming downloads after a restart)
+    JOB_JOURNAL_FILE = os.environ.get('JOB_JOURNAL_FILE') or os.path.join('temp', 'jobs.sqlite')
+    JOURNAL_PROGRESS_INTERVAL = float(os.environ.get('JOURNAL_PROGRESS_INTERVAL') or 5)  # Seconds between progress writes per job
+    JOB_RESUME_MAX_AGE = int(os.environ.get('JOB_RESUME_MAX_AGE') or 24 * 3600)  # Older unfinished jobs are dropped, not resumed
+    JOB_JOURNAL_RETENTION = int(os.environ.get('JOB_JOURNAL_RETENTION') or 7 * 24 * 3600)  # Finished jobs stay re-attachable this long
+    JOB_REATTACH_GRACE = float(os.environ.get('JOB_REATTACH_GRACE') or 60)  # Seconds a job without clients waits for one to re-attach
     
     # Google Drive settings
     DRIVE_FOLDER_NAME = 'YouTube Downloads'
+    # Downloads are uploaded automatically once a Google account is authorised (/login)
+    DRIVE_UPLOAD_ENABLED = (os.environ.get('DRIVE_UPLOAD_ENABLED') or 'true').lower() in ('1', 'true', 'yes')
+    DRIVE_UPLOAD_CHUNK_SIZE = int(os.environ.get('DRIVE_UPLOAD_CHUNK_SIZE') or 8 * 1024 * 1024)  # Multiple of 256KB; larger is faster, smaller resends less after an error
+    DRIVE_UPLOAD_WORKERS = int(os.environ.get('DRIVE_UPLOAD_WORKERS') or 3)  # Parallel uploads (and pooled connections)
+    DRIVE_UPLOAD_MAX_RETRIES = int(os.environ.get('DRIVE_UPLOAD_MAX_RETRIES') or 5)  # Per request, with exponential backoff
+    DRIVE_API_BASE_URL = os.environ.get('DRIVE_API_BASE_URL') or 'https://www.googleapis.com'  # e.g. a local fake Drive server for testing
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
@@ -0,0 +1 @@
+# Lets the tests import the app's modules (downloads.*, utils) from the repository root
@@ -0,0 +1,356 @@
+import logging
+import re
+import time
+
+import yt_dlp
+
+from downloads.executor import thread_lock
+from utils import format_file_size
+
+logger = logging.getLogger(__name__)
+
+# Plain yt-dlp selectors such as 'best' or 'bestaudio' (as opposed to format IDs)
+_SELECTOR_RE = re.compile(r'^(best|worst)(video|audio)?$')
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a download is refused before it starts: the file would be
+    too large, its format is not allowed, or a byte quota is used up.
+    """
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens and refills at `rate` tokens per second.
+
+    consume() may take the balance below zero: bytes are often only known
+    after they were transferred, so they are charged as debt, which the
+    refill pays off before anything else is allowed. The lock is shared
+    with yt-dlp's worker threads (see executor.thread_lock).
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = thread_lock()
+
+    def _refill_locked(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        with self._lock:
+            self._refill_locked()
+            return self._tokens
+
+    @property
+    def full(self):
+        return self.tokens >= self.capacity
+
+    def try_consume(self, amount):
+        """Takes `amount` tokens if they are all available; returns whether it did."""
+        with self._lock:
+            self._refill_locked()
+            if self._tokens < amount:
+                return False
+            self._tokens -= amount
+            return True
+
+    def consume(self, amount):
+        """Takes `amount` tokens; returns the seconds until the balance is no longer negative."""
+        with self._lock:
+            self._refill_locked()
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def refund(self, amount):
+        with self._lock:
+            self._refill_locked()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def seconds_until(self, amount):
+        """Seconds until `amount` tokens will be available."""
+        missing = amount - self.tokens
+        return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+
+class Admission:
+    """The outcome of admitting a request: what will actually be downloaded."""
+
+    def __init__(self, format_id, estimated_bytes=None, ext=None, downgraded_from=None):
+        self.format_id = format_id
+        self.estimated_bytes = estimated_bytes
+        self.ext = ext
+        self.downgraded_from = downgraded_from
+
+    @property
+    def note(self):
+        if not self.downgraded_from:
+            return None
+        size = f', {format_file_size(self.estimated_bytes)}' if self.estimated_bytes else ''
+        return f'Switched to format {self.format_id} ({self.ext}{size}) to stay within the size and format limits.'
+
+
+def format_size(f, duration):
+    """Size of one format in bytes, estimated from its bitrate when yt-dlp does not know it."""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if not size and f.get('tbr') and duration:
+        size = f['tbr'] * 1000 / 8 * duration  # tbr is in kbit/s
+    return int(size) if size else None
+
+
+def merged_ext(parts):
+    """Extension of the file yt-dlp produces for one or more (merged) formats."""
+    if len(parts) == 1:
+        return parts[0].get('ext')
+    exts = {part.get('ext') for part in parts}
+    if exts <= {'mp4', 'm4a'}:
+        return 'mp4'
+    if exts == {'webm'}:
+        return 'webm'
+    return 'mkv'
+
+
+class AdmissionController:
+    """
+    Decides, before any bytes move, whether a download may start and in
+    which format, and keeps disk and network use within fixed limits:
+
+    - Formats whose (estimated) size exceeds `max_file_size`, or whose
+      output extension is not in `allowed_formats`, are replaced by the
+      best format that fits (`downgrade=True`) or rejected.
+    - Byte quotas: every admitted download reserves its estimated size from
+      a global and a per-client token bucket holding `global_quota` /
+      `client_quota` bytes that refill over `quota_window` seconds. The
+      reservation is corrected to the bytes actually transferred when the
+      job ends (settle()).
+    - Bandwidth ceilings: throttle() charges transferred bytes to a global
+      and a per-client bucket refilling at `global_bandwidth` /
+      `client_bandwidth` bytes per second and returns how long the
+      transfer has to pause.
+
+    Clients are identified by a `client_id` that outlives their Socket.IO
+    connection (the app uses their address), so reconnecting does not
+    start them on fresh buckets. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_file_size, allowed_formats, downgrade=True, global_quota=0, client_quota=0,
+                 quota_window=24 * 3600, global_bandwidth=0, client_bandwidth=0, clock=time.monotonic):
+        self.max_file_size = max_file_size
+        self.allowed_formats = {ext.lower() for ext in allowed_formats}
+        self.downgrade = downgrade
+        self.client_quota = client_quota
+        self.quota_window = quota_window
+        self.client_bandwidth = client_bandwidth
+        self.clock = clock
+        self.global_quota = TokenBucket(global_quota / quota_window, global_quota, clock) if global_quota else None
+        self.global_bandwidth = TokenBucket(global_bandwidth, global_bandwidth, clock) if global_bandwidth else None
+        self._client_quotas = {}     # client_id -> TokenBucket
+        self._client_bandwidth = {}  # client_id -> TokenBucket
+        self._lock = thread_lock()
+        self._ydl = None  # Only used to resolve format selectors, created on first use
+        self.admitted = 0
+        self.downgraded = 0
+        self.rejected = 0
+        self.aborted = 0
+
+    # --- Format and size ---
+    def plan(self, info, format_id):
+        """
+        Returns the Admission for downloading `format_id` of a video's info
+        dict, downgrading it if allowed. `format_id` may also be a yt-dlp
+        format selector ('bestvideo[height<=720]+bestaudio'); it is resolved
+        against the info's formats the way yt-dlp would, so the limits apply
+        to the formats it picks. Raises AdmissionError.
+        """
+        formats = {f.get('format_id'): f for f in info.get('formats') or []}
+        if not formats:
+            if _SELECTOR_RE.match(format_id):
+                # yt-dlp picks the format; let it only pick ones that fit
+                return Admission(self._filtered_selector(format_id))
+            return Admission(format_id)  # Nothing to check against; the mid-download check still applies
+
+        if not all(part in formats for part in format_id.split('+')):
+            format_id = self._select(info['formats'], format_id)
+        parts = [formats[part] for part in format_id.split('+')]
+
+        duration = info.get('duration')
+        sizes = [format_size(part, duration) for part in parts]
+        size = None if None in sizes else sum(sizes)
+        ext = merged_ext(parts)
+
+        if ext and self.allowed_formats and ext.lower() not in self.allowed_formats:
+            problem = f'produces a .{ext} file, which is not allowed'
+        elif self.max_file_size and size is not None and size > self.max_file_size:
+            problem = f'is about {format_file_size(size)}, over the {format_file_size(self.max_file_size)} limit'
+        else:
+            return Admission(format_id, size, ext)
+
+        if self.downgrade:
+            alternative = self._best_fitting(info, parts, duration)
+            if alternative is not None:
+                self.downgraded += 1
+                return Admission(*alternative, downgraded_from=format_id)
+        self.rejected += 1
+        raise AdmissionError(f'The selected quality {problem}. Please choose a smaller one.')
+
+    def _select(self, formats, selector):
+        """The format_id ('a+b' when merged) yt-dlp would download for a selector."""
+        if self._ydl is None:
+            self._ydl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True})
+        try:
+            select = self._ydl.build_format_selector(selector)
+            chosen = next(iter(select({
+                'formats': formats,
+                'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+                'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                       or all(f.get('acodec') == 'none' for f in formats)),
+            })), None)
+        except (SyntaxError, ValueError, yt_dlp.utils.YoutubeDLError) as e:
+            self.rejected += 1
+            raise AdmissionError(f'Invalid format {selector!r}: {e}')
+        if chosen is None or not chosen.get('format_id'):
+            self.rejected += 1
+            raise AdmissionError(f'The format {selector!r} is not available for this video.')
+        return chosen['format_id']
+
+    def _filtered_selector(self, selector):
+        filters = ''
+        if self.max_file_size:
+            # '<?' also accepts formats of unknown size; those are checked while downloading
+            filters += f'[filesize<?{self.max_file_size}][filesize_approx<?{self.max_file_size}]'
+        if self.allowed_formats:
+            filters += f"[ext~='^({'|'.join(sorted(self.allowed_formats))})$']"
+        return selector + filters
+
+    def _fits(self, ext, size):
+        return (ext or '').lower() in self.allowed_formats and size is not None and (
+            not self.max_file_size or size <= self.max_file_size)
+
+    def _best_fitting(self, info, parts, duration):
+        """
+        Highest-resolution (then largest) format, or video+audio pair for a
+        merged request, of the same kind that is allowed and fits the limit.
+        Returns (format_id, size, ext) or None.
+        """
+        formats = info.get('formats') or []
+        max_height = max((part.get('height') or 0 for part in parts), default=0) or float('inf')
+        candidates = []
+
+        if len(parts) > 1:
+            videos = [f for f in formats if f.get('vcodec') not in (None, 'none') and f.get('acodec') == 'none']
+            audios = [f for f in formats if f.get('acodec') not in (None, 'none') and f.get('vcodec') == 'none']
+            for video in videos:
+                if (video.get('height') or 0) > max_height:
+                    continue
+                for audio in audios:
+                    sizes = (format_size(video, duration), format_size(audio, duration))
+                    size = None if None in sizes else sum(sizes)
+                    ext = merged_ext([video, audio])
+                    if self._fits(ext, size):
+                        candidates.append(((video.get('height') or 0, size),
+                                           (f"{video['format_id']}+{audio['format_id']}", size, ext)))
+        else:
+            has_video = parts[0].get('vcodec') not in (None, 'none')
+            for f in formats:
+                if has_video and (f.get('vcodec') in (None, 'none') or f.get('acodec') in (None, 'none')):
+                    continue  # A single video format must keep its audio
+                if not has_video and (f.get('acodec') in (None, 'none') or f.get('vcodec') not in (None, 'none')):
+                    continue
+                if (f.get('height') or 0) > max_height:
+                    continue
+                size = format_size(f, duration)
+                if self._fits(f.get('ext'), size):
+                    candidates.append(((f.get('height') or 0, size), (f['format_id'], size, f.get('ext'))))
+
+        if not candidates:
+            return None
+        return max(candidates, key=lambda candidate: candidate[0])[1]
+
+    # --- Quotas ---
+    def reserve(self, client_id, nbytes):
+        """
+        Reserves `nbytes` (the estimated size, 0 if unknown) from the global
+        and the client's quota. Raises AdmissionError if either is used up.
+        """
+        nbytes = nbytes or 0
+        client_bucket = self._client_bucket(self._client_quotas, client_id, self.client_quota,
+                                            self.client_quota / self.quota_window)
+        if client_bucket is not None and not client_bucket.try_consume(nbytes):
+            self.rejected += 1
+            raise AdmissionError(
+                f'Your download quota is used up. Please try again in '
+                f'{_minutes(client_bucket.seconds_until(nbytes))}.'
+            )
+        if self.global_quota is not None and not self.global_quota.try_consume(nbytes):
+            if client_bucket is not None:
+                client_bucket.refund(nbytes)
+            self.rejected += 1
+            raise AdmissionError(
+                f'The server has reached its download quota. Please try again in '
+                f'{_minutes(self.global_quota.seconds_until(nbytes))}.'
+            )
+        self.admitted += 1
+        return nbytes
+
+    def settle(self, client_id, reserved, transferred):
+        """Corrects a reservation to the bytes actually transferred."""
+        difference = (transferred or 0) - (reserved or 0)
+        if not difference:
+            return
+        buckets = [self.global_quota, self._client_quotas.get(client_id)]
+        for bucket in buckets:
+            if bucket is None:
+                continue
+            if difference > 0:
+                bucket.consume(difference)
+            else:
+                bucket.refund(-difference)
+
+    # --- Bandwidth ---
+    def throttle(self, client_id, nbytes):
+        """
+        Charges `nbytes` just transferred for a client and returns the
+        seconds the transfer should pause to stay under the ceilings.
+        Called from yt-dlp progress hooks on worker threads.
+        """
+        wait = 0.0
+        if self.global_bandwidth is not None:
+            wait = self.global_bandwidth.consume(nbytes)
+        client_bucket = self._client_bucket(self._client_bandwidth, client_id, self.client_bandwidth,
+                                            self.client_bandwidth)
+        if client_bucket is not None:
+            wait = max(wait, client_bucket.consume(nbytes))
+        return wait
+
+    def _client_bucket(self, buckets, client_id, capacity, rate):
+        if not capacity:
+            return None
+        with self._lock:
+            bucket = buckets.get(client_id)
+            if bucket is None:
+                # Refilled buckets carry no state, so they can be dropped
+                for key in [key for key, b in buckets.items() if b.full]:
+                    del buckets[key]
+                bucket = buckets[client_id] = TokenBucket(rate, capacity, self.clock)
+            return bucket
+
+    def stats(self):
+        return {
+            'admitted': self.admitted,
+            'downgraded': self.downgraded,
+            'rejected': self.rejected,
+            'aborted': self.aborted,
+            'global_quota_remaining': int(self.global_quota.tokens) if self.global_quota else None,
+            'clients_tracked': len(self._client_quotas),
+        }
+
+
+def _minutes(seconds):
+    return f'{max(1, round(seconds / 60))} minute(s)'
@@ -0,0 +1,207 @@
+import functools
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from downloads.scheduler import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+def iter_batch_items(urls, extract_flat, is_single_video):
+    """
+    Lazily expands a list of URLs into (url, title) download items.
+
+    Playlist and channel URLs are expanded with `extract_flat(url)`, which
+    must return a yt-dlp info dict extracted with process=False so that
+    'entries' is a lazy generator; pages are therefore only fetched as the
+    batch consumes them and a large playlist is never materialised.
+    Single-video URLs (`is_single_video(url)`) are passed through without
+    any extraction.
+    """
+    for url in urls:
+        if is_single_video(url):
+            yield url, None
+            continue
+
+        info = extract_flat(url)
+        if info.get('_type') not in ('playlist', 'multi_video', 'url', 'url_transparent'):
+            yield info.get('webpage_url') or url, info.get('title')
+            continue
+        if info.get('_type') in ('url', 'url_transparent'):
+            # A redirect to a single item (e.g. youtu.be short links)
+            yield info.get('url') or url, info.get('title')
+            continue
+
+        for entry in info.get('entries') or ():
+            if not entry:
+                continue
+            entry_url = entry.get('webpage_url') or entry.get('url')
+            if entry_url:
+                yield entry_url, entry.get('title')
+
+
+class BatchDownload:
+    """
+    Downloads a (possibly very long) sequence of items for one client with
+    bounded concurrency.
+
+    At most `concurrency` of the batch's items are queued or running at any
+    time; the next item is only pulled from `items` when one finishes, so a
+    lazy `items` iterator is consumed at the pace of the downloads.
+
+    `submit(url, title)` starts one item and returns its DownloadJob, or None
+    if the item was already complete (e.g. found in the download store). It
+    may raise QueueFullError, in which case the item is retried later.
+    `next_item()` pulls from `items`; pass a function that does so off the
+    eventlet hub, since expanding a playlist page is network I/O.
+    `on_update(batch)` is called whenever the batch's counters change.
+    """
+
+    retry_interval = 5.0
+
+    def __init__(self, session_id, items, submit, on_update, concurrency=3, next_item=None, spawn=None):
+        self.batch_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.items = iter(items)
+        self.submit = submit
+        self.on_update = on_update
+        self.concurrency = max(1, concurrency)
+        self.next_item = next_item or (lambda iterator: next(iterator, None))
+        self.spawn = spawn
+
+        # Item number -> job of items queued or running; items that join the same
+        # download (e.g. a video listed twice) share a job but each hold a slot
+        self.active = {}
+        self.discovered = 0    # Items pulled from the iterator so far
+        self.completed = 0
+        self.failed = 0
+        self.exhausted = False
+        self.cancelled = False
+
+        self._lock = threading.Lock()
+        self._filling = False
+        self._refill = False
+        self._held_item = None  # Item refused by a full queue, retried first
+        self._retry_scheduled = False
+        self._item_numbers = itertools.count()
+
+    @property
+    def done(self):
+        return self.cancelled or (self.exhausted and not self.active and self._held_item is None)
+
+    def start(self):
+        self.fill()
+
+    def fill(self):
+        """
+        Submits items until the batch has `concurrency` active jobs or the
+        iterator is exhausted. Safe to call from several green threads; only
+        one of them does the filling.
+        """
+        with self._lock:
+            if self._filling:
+                self._refill = True
+                return
+            self._filling = True
+
+        try:
+            while True:
+                self._fill_once()
+                with self._lock:
+                    if not self._refill:
+                        self._filling = False
+                        break
+                    self._refill = False
+        except Exception:
+            with self._lock:
+                self._filling = False
+            raise
+        self._notify()
+
+    def cancel(self):
+        self.cancelled = True
+        return list({job.job_id: job for job in self.active.values()}.values())
+
+    def to_dict(self):
+        return {
+            'batch_id': self.batch_id,
+            'discovered': self.discovered,
+            'completed': self.completed,
+            'failed': self.failed,
+            'active': len(self.active),
+            'exhausted': self.exhausted,
+            'done': self.done,
+        }
+
+    # --- Internals ---
+    def _fill_once(self):
+        while not self.cancelled and len(self.active) < self.concurrency:
+            item = self._held_item
+            self._held_item = None
+            if item is None:
+                if self.exhausted:
+                    return
+                try:
+                    item = self.next_item(self.items)
+                except Exception as e:
+                    logger.error(f"Batch {self.batch_id}: could not expand the next item: {e}")
+                    self.failed += 1
+                    item = None
+                    self.exhausted = True
+                if item is None:
+                    self.exhausted = True
+                    return
+                self.discovered += 1
+
+            url, title = item
+            try:
+                job = self.submit(url, title)
+            except QueueFullError:
+                # The scheduler is saturated; try again once something frees up
+                self._held_item = item
+                self._schedule_retry()
+                return
+            except Exception as e:
+                logger.error(f"Batch {self.batch_id}: could not start {url}: {e}")
+                self.failed += 1
+                continue
+
+            if job is None:
+                self.completed += 1
+                continue
+            number = next(self._item_numbers)
+            self.active[number] = job
+            job.add_done_callback(functools.partial(self._item_finished, number))
+
+    def _item_finished(self, number, job):
+        if self.active.pop(number, None) is None:
+            return
+        if job.status == 'finished':
+            self.completed += 1
+        else:
+            self.failed += 1
+        if self.cancelled:
+            self._notify()
+            return
+        self.fill()
+
+    def _schedule_retry(self):
+        if self.active or self._retry_scheduled or self.spawn is None:
+            return  # A finishing item will trigger the retry
+        self._retry_scheduled = True
+
+        def retry():
+            time.sleep(self.retry_interval)
+            self._retry_scheduled = False
+            self.fill()
+
+        self.spawn(retry)
+
+    def _notify(self):
+        try:
+            self.on_update(self)
+        except Exception:
+            logger.exception(f"Batch {self.batch_id}: update callback failed")
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+from utils import extract_video_id, is_youtube_url
+
+logger = logging.getLogger(__name__)
+
+# googlevideo.com URLs carry their expiry as ?expire=<unix time>; DASH/HLS
+# manifest URLs carry it as a path segment (/expire/<unix time>/)
+_EXPIRE_PATH_RE = re.compile(r'/expire/(\d+)')
+
+
+def cache_key(url):
+    """
+    Canonical cache key for a video URL. On YouTube hosts it is the video ID,
+    so watch?v=, youtu.be/, shorts/ and embed/ links share an entry, plus the
+    playlist ID when the link has a list= (yt-dlp extracts those as the
+    playlist, not as the video). Any other URL is its own key: other sites'
+    IDs are only unique per extractor, which is not known before extraction.
+    """
+    url = url.strip()
+    if not is_youtube_url(url):
+        return url
+    playlist_id = parse_qs(urlparse(url).query).get('list', [None])[0]
+    video_id = extract_video_id(url)
+    if playlist_id:
+        return f"{video_id or ''}&list={playlist_id}"
+    return video_id or url
+
+
+def signed_url_expiry(info):
+    """
+    Returns the earliest expiry (unix time) of the signed media URLs in an
+    info dict, or None if none of them carry one.
+    """
+    urls = [info.get('url'), info.get('manifest_url')]
+    for f in info.get('formats') or []:
+        urls.append(f.get('url'))
+        urls.append(f.get('manifest_url'))
+
+    earliest = None
+    for url in urls:
+        if not url:
+            continue
+        expire = parse_qs(urlparse(url).query).get('expire', [None])[0]
+        if expire is None:
+            match = _EXPIRE_PATH_RE.search(url)
+            expire = match.group(1) if match else None
+        try:
+            expire = float(expire)
+        except (TypeError, ValueError):
+            continue
+        if earliest is None or expire < earliest:
+            earliest = expire
+    return earliest
+
+
+class SqliteMetadataStore:
+    """
+    On-disk backend for MetadataCache so entries survive restarts.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata '
+                '(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, info TEXT NOT NULL)'
+            )
+            self._conn.execute('DELETE FROM metadata WHERE expires_at <= ?', (time.time(),))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT expires_at, info FROM metadata WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, key, expires_at, info):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata (key, expires_at, info) VALUES (?, ?, ?)',
+                (key, expires_at, json.dumps(info)),
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM metadata WHERE key = ?', (key,))
+
+
+class MetadataCache:
+    """
+    Size-bounded LRU cache of yt-dlp info dicts keyed by cache_key(url).
+
+    Entries live for `ttl` seconds, but never past the expiry of the signed
+    format URLs they contain (minus `expiry_margin`), since a download that
+    reuses an entry needs those URLs to still work. Info dicts must be
+    JSON-serialisable (see YoutubeDL.sanitize_info) and must not be mutated
+    by callers.
+    """
+
+    def __init__(self, max_entries=256, ttl=1800, expiry_margin=300, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.expiry_margin = expiry_margin
+        self.store = store
+        self._entries = OrderedDict()  # key -> (expires_at, info), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        """Returns the cached info dict for a URL, or None; counted in stats() as a hit or miss."""
+        info = self.peek(url)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return info
+
+    def peek(self, url):
+        """Like get(), but not counted: for internal lookups of info a preview may have cached."""
+        key = cache_key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        if self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None and entry[0] > now:
+                with self._lock:
+                    self._remember(key, entry)
+                return entry[1]
+            if entry is not None:
+                self.store.delete(key)
+        return None
+
+    def put(self, url, info):
+        now = time.time()
+        expires_at = now + self.ttl
+        url_expiry = signed_url_expiry(info)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - self.expiry_margin)
+        if expires_at <= now:
+            return  # Would be stale before anyone could use it
+
+        key = cache_key(url)
+        with self._lock:
+            self._remember(key, (expires_at, info))
+        if self.store is not None:
+            try:
+                self.store.put(key, expires_at, info)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.warning(f"Could not persist metadata for {key}: {e}")
+
+    def invalidate(self, url):
+        key = cache_key(url)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'persistent': self.store is not None,
+            }
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,446 @@
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+# Every chunk but the last must be a multiple of this (Drive API requirement)
+CHUNK_GRANULARITY = 256 * 1024
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Dropped connections, timeouts and truncated responses
+RETRYABLE_ERRORS = (OSError, http.client.HTTPException)
+# OSErrors that no retry will fix, e.g. the account's credentials are gone (see GoogleAuth.authorized_http)
+NON_RETRYABLE_ERRORS = (PermissionError, FileNotFoundError)
+
+
+class DriveUploadError(Exception):
+    """
+    Raised when an upload fails for good (non-retryable response, retries
+    exhausted or the upload session expired).
+    """
+
+
+class SourceChanged(Exception):
+    """
+    Raised by an upload's chunk source when the bytes it already produced no
+    longer match the file (e.g. yt-dlp rewrote it in a fixup step). The
+    upload starts over from its `fallback` source.
+    """
+
+
+def file_chunks(path, chunk_size):
+    """Yields a finished file in chunk_size blocks."""
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+
+class HttpPool:
+    """
+    Pool of HTTP clients (e.g. authorised httplib2.Http objects).
+
+    An httplib2.Http must not be used by two requests at once, but it keeps
+    its TLS connection alive between requests; pooling them lets concurrent
+    uploads reuse warm connections instead of handshaking for every chunk.
+    At most `size` clients exist; a client is dropped rather than returned
+    when a request on it raised, since its connection state is unknown.
+    """
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()  # Most recently used first: its connection is most likely still open
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                http = self.factory()
+            yield http
+            self._idle.put(http)
+        finally:
+            self._slots.release()
+
+    def clear(self):
+        """Drops idle clients."""
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                return
+
+
+class DriveUpload:
+    """
+    One file to upload. `chunks` is an iterable of bytes of any size; it may
+    block while the file is still being written, in which case the upload
+    follows the download instead of waiting for it. `fallback()` returns a
+    fresh chunk iterable to restart from if `chunks` raises SourceChanged.
+    `account` is handed to the uploader's http_factory and says whose Drive
+    the file goes to. `context` is left for the caller (e.g. the download job).
+    """
+
+    def __init__(self, name, mimetype, chunks, fallback=None, context=None, account=None):
+        self.upload_id = uuid.uuid4().hex
+        self.name = name
+        self.mimetype = mimetype or 'application/octet-stream'
+        self.chunks = chunks
+        self.fallback = fallback
+        self.context = context
+        self.account = account
+        self.status = 'queued'  # queued -> uploading -> finished / failed
+        self.uploaded_bytes = 0
+        self.total_bytes = None  # Known once the source is exhausted
+        self.file = None         # Drive file resource once finished
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'name': self.name,
+            'status': self.status,
+            'uploaded_bytes': self.uploaded_bytes,
+            'total_bytes': self.total_bytes,
+            'file_id': self.file.get('id') if self.file else None,
+            'web_view_link': self.file.get('webViewLink') if self.file else None,
+            'error': self.error,
+        }
+
+
+class DriveUploader:
+    """
+    Uploads files to a Drive folder with resumable, chunked uploads.
+
+    - Up to `max_workers` uploads run in parallel. Uploads to the same
+      account share a pool of `http_factory(account)` clients (see
+      HttpPool); the pools of the `max_accounts` most recently used
+      accounts are kept.
+    - Each file is sent in `chunk_size` pieces through one resumable upload
+      session. The total size is only declared with the last chunk, so an
+      upload can start while the file is still being downloaded.
+    - 429/5xx responses and connection errors are retried with exponential
+      backoff (with jitter) up to `max_retries` times in a row; after an
+      error the session is asked how much it committed and the upload
+      continues from there, so a failed chunk never restarts the file.
+    - The folder named `folder_name` is looked up (or created) once per
+      account and its ID cached.
+
+    `base_url` can point at a local fake Drive server for testing.
+    `on_update(upload)` is called after every committed chunk and when an
+    upload finishes or fails. `spawn(fn)` starts a worker loop.
+    """
+
+    def __init__(self, http_factory, folder_name, base_url='https://www.googleapis.com', chunk_size=8 * 1024 * 1024,
+                 max_workers=3, max_retries=5, backoff_base=1.0, backoff_max=32.0, on_update=None, spawn=None,
+                 sleep=time.sleep, max_accounts=32):
+        if chunk_size % CHUNK_GRANULARITY:
+            raise ValueError(f'chunk_size must be a multiple of {CHUNK_GRANULARITY} bytes')
+        self.http_factory = http_factory
+        self.folder_name = folder_name
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_update = on_update
+        self.spawn = spawn or self._spawn_thread
+        self.sleep = sleep
+        self.max_accounts = max(1, max_accounts)
+
+        self._queue = queue.Queue()
+        # account -> (HttpPool, [folder ID], lock for the folder lookup), least recently used first
+        self._accounts = OrderedDict()
+        self._accounts_lock = threading.Lock()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    @staticmethod
+    def _spawn_thread(fn):
+        thread = threading.Thread(target=fn, daemon=True)
+        thread.start()
+        return thread
+
+    def _make_http(self, account):
+        http = self.http_factory(account)
+        # httplib2 follows 308 as a redirect, but for an upload session it means
+        # "resume incomplete" (same workaround as googleapiclient.http.build_http)
+        if hasattr(http, 'redirect_codes'):
+            http.redirect_codes = http.redirect_codes - {308}
+        return http
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.max_workers):
+            self.spawn(self._worker_loop)
+        logger.info(f"Drive uploader started with {self.max_workers} workers.")
+
+    # --- Public API ---
+    def submit(self, upload):
+        self._ensure_started()
+        self._queue.put(upload)
+        return upload
+
+    def reset(self, account=None):
+        """Forgets an account's folder ID and pooled clients (e.g. when it signs out)."""
+        with self._accounts_lock:
+            state = self._accounts.pop(account, None)
+        if state is not None:
+            state[0].clear()
+
+    def folder_id(self, account=None):
+        _, folder, lock = self._account(account)
+        with lock:
+            if folder[0] is None:
+                folder[0] = self._find_or_create_folder(account)
+            return folder[0]
+
+    def upload(self, upload):
+        """Runs an upload on the calling thread. Returns the Drive file resource."""
+        upload.status = 'uploading'
+        upload.started = time.time()
+        try:
+            try:
+                upload.file = self._upload_chunks(upload, upload.chunks)
+            except SourceChanged:
+                if upload.fallback is None:
+                    raise DriveUploadError('The file changed while it was being uploaded.')
+                logger.info(f"Upload of {upload.name}: file changed after download, uploading it again")
+                upload.uploaded_bytes = 0
+                upload.total_bytes = None
+                upload.file = self._upload_chunks(upload, upload.fallback())
+        except Exception as e:
+            upload.status = 'failed'
+            upload.error = str(e)
+            upload.finished = time.time()
+            self._notify(upload)
+            raise
+        upload.status = 'finished'
+        upload.finished = time.time()
+        self._notify(upload)
+        return upload.file
+
+    # --- Internals ---
+    def _account(self, account):
+        with self._accounts_lock:
+            state = self._accounts.get(account)
+            if state is None:
+                pool = HttpPool(lambda: self._make_http(account), self.max_workers)
+                state = self._accounts[account] = (pool, [None], threading.Lock())
+                while len(self._accounts) > self.max_accounts:
+                    self._accounts.popitem(last=False)  # Uploads still using its pool keep it alive
+            self._accounts.move_to_end(account)
+            return state
+
+    def _worker_loop(self):
+        while True:
+            upload = self._queue.get()
+            try:
+                self.upload(upload)
+                seconds = upload.finished - upload.started
+                logger.info(
+                    f"Uploaded {upload.name} to Drive ({upload.total_bytes} bytes in {seconds:.1f}s, "
+                    f"{upload.total_bytes / max(seconds, 0.001) / 1e6:.1f} MB/s)"
+                )
+            except Exception as e:
+                logger.error(f"Drive upload of {upload.name} failed: {e}")
+
+    def _notify(self, upload):
+        if not self.on_update:
+            return
+        try:
+            self.on_update(upload)
+        except Exception:
+            logger.exception(f"Upload update callback failed for {upload.name}")
+
+    def _upload_chunks(self, upload, chunks):
+        account = upload.account
+        session_uri = self._start_session(upload)
+        buffer = bytearray()
+        offset = 0  # Bytes committed by Drive; buffer holds everything after that
+        try:
+            for data in chunks:
+                buffer += data
+                while len(buffer) >= self.chunk_size:
+                    committed, _ = self._send(account, session_uri, buffer[:self.chunk_size], offset, None)
+                    del buffer[:committed - offset]
+                    offset = committed
+                    upload.uploaded_bytes = offset
+                    self._notify(upload)
+
+            # Last piece: declaring the total size completes the upload
+            total = offset + len(buffer)
+            upload.total_bytes = total
+            while True:
+                committed, file = self._send(account, session_uri, buffer, offset, total)
+                if file is not None:
+                    upload.uploaded_bytes = total
+                    return file
+                del buffer[:committed - offset]
+                offset = committed
+        except BaseException:
+            self._cancel_session(account, session_uri)
+            raise
+
+    def _start_session(self, upload):
+        query = urlencode({'uploadType': 'resumable', 'fields': 'id,name,size,webViewLink'})
+        metadata = {'name': upload.name, 'parents': [self.folder_id(upload.account)]}
+        response, _ = self._request(
+            upload.account, 'POST', f'{self.base_url}/upload/drive/v3/files?{query}',
+            body=json.dumps(metadata),
+            headers={'Content-Type': 'application/json; charset=UTF-8', 'X-Upload-Content-Type': upload.mimetype},
+        )
+        session_uri = response.get('location')
+        if not session_uri:
+            raise DriveUploadError('Drive did not return an upload session URL.')
+        return session_uri
+
+    def _send(self, account, session_uri, data, offset, total):
+        """
+        PUTs data (starting at byte `offset`) to the session. Returns
+        (committed_bytes, None) while the upload is incomplete, or
+        (total, file_resource) once Drive has the whole file.
+        """
+        failures = 0
+        while True:
+            end = offset + len(data)
+            if data:
+                content_range = f"bytes {offset}-{end - 1}/{total if total is not None else '*'}"
+            else:
+                content_range = f'bytes */{total}'  # Nothing left to send, only the total
+            try:
+                response, content = self._raw_request(account, 'PUT', session_uri, body=bytes(data), headers={
+                    'Content-Length': str(len(data)),
+                    'Content-Range': content_range,
+                })
+                status = response.status
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except RETRYABLE_ERRORS as e:
+                status, content = None, str(e)
+
+            if status in (200, 201):
+                return end, json.loads(content)
+            if status == 308:
+                return self._committed(response), None
+            if status in (404, 410):
+                raise DriveUploadError('The upload session expired.')
+            if status is not None and status not in RETRYABLE_STATUSES:
+                raise DriveUploadError(f'Drive rejected the upload ({status}): {content[:200]!r}')
+
+            failures += 1
+            if failures > self.max_retries:
+                raise DriveUploadError(f'Upload failed after {self.max_retries} retries: {status or content}')
+            self._backoff(failures)
+            # Part of the chunk may have been stored before the error
+            committed = self._query_committed(account, session_uri, total)
+            if isinstance(committed, dict):
+                return end, committed
+            if committed is not None and committed > offset:
+                data = data[committed - offset:]
+                offset = committed
+
+    def _query_committed(self, account, session_uri, total):
+        # Empty PUT with an unknown range asks the session for its state
+        try:
+            response, content = self._raw_request(account, 'PUT', session_uri, body=b'', headers={
+                'Content-Length': '0',
+                'Content-Range': f"bytes */{total if total is not None else '*'}",
+            })
+        except NON_RETRYABLE_ERRORS:
+            raise
+        except RETRYABLE_ERRORS:
+            return None
+        if response.status in (200, 201):
+            return json.loads(content)
+        if response.status == 308:
+            return self._committed(response)
+        return None
+
+    @staticmethod
+    def _committed(response):
+        # 'Range: bytes=0-<last byte>' or no header when nothing was stored yet
+        byte_range = response.get('range')
+        if not byte_range:
+            return 0
+        return int(byte_range.rsplit('-', 1)[1]) + 1
+
+    def _cancel_session(self, account, session_uri):
+        try:
+            self._raw_request(account, 'DELETE', session_uri)
+        except Exception:
+            pass  # Unfinished sessions expire on their own after a week
+
+    def _find_or_create_folder(self, account):
+        name = self.folder_name.replace('\\', '\\\\').replace("'", "\\'")
+        query = urlencode({
+            'q': f"name = '{name}' and mimeType = '{FOLDER_MIMETYPE}' and trashed = false",
+            'spaces': 'drive',
+            'fields': 'files(id)',
+        })
+        _, content = self._request(account, 'GET', f'{self.base_url}/drive/v3/files?{query}')
+        files = json.loads(content).get('files') or []
+        if files:
+            return files[0]['id']
+
+        _, content = self._request(
+            account, 'POST', f'{self.base_url}/drive/v3/files?fields=id',
+            body=json.dumps({'name': self.folder_name, 'mimeType': FOLDER_MIMETYPE}),
+            headers={'Content-Type': 'application/json; charset=UTF-8'},
+        )
+        folder_id = json.loads(content)['id']
+        logger.info(f"Created Drive folder '{self.folder_name}' ({folder_id})")
+        return folder_id
+
+    def _request(self, account, method, url, body=None, headers=None):
+        """Metadata request with retries; returns (response, content) on 2xx."""
+        failures = 0
+        while True:
+            try:
+                response, content = self._raw_request(account, method, url, body=body, headers=headers)
+                status = response.status
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except RETRYABLE_ERRORS as e:
+                status, content = None, str(e)
+            if status is not None and 200 <= status < 300:
+                return response, content
+            if status is not None and status not in RETRYABLE_STATUSES:
+                raise DriveUploadError(f'Drive request failed ({status}): {content[:200]!r}')
+            failures += 1
+            if failures > self.max_retries:
+                raise DriveUploadError(f'Drive request failed after {self.max_retries} retries: {status or content}')
+            self._backoff(failures)
+
+    def _raw_request(self, account, method, url, body=None, headers=None):
+        with self._account(account)[0].connection() as http:
+            response, content = http.request(url, method=method, body=body, headers=headers or {})
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        return response, content
+
+    def _backoff(self, failures):
+        # Full jitter keeps parallel uploads from retrying in lockstep
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+        self.sleep(random.uniform(0, delay))
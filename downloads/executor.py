@@ -0,0 +1,131 @@
+import importlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import eventlet
+    from eventlet import patcher, tpool
+except ImportError:  # Plain threads (e.g. scripts and tests without eventlet)
+    eventlet = None
+
+logger = logging.getLogger(__name__)
+
+
+def _original(module_name):
+    # The unpatched module, even after eventlet.monkey_patch(). Needed for
+    # anything shared between a real OS thread and the eventlet hub.
+    if eventlet is not None:
+        return patcher.original(module_name)
+    return importlib.import_module(module_name)
+
+
+_real_queue = _original('queue')
+_real_time = _original('time')
+
+
+def thread_lock():
+    """
+    A lock that can be shared between executor threads and the hub. Only
+    hold it for short, non-blocking critical sections: while a real OS
+    thread holds it, a green thread waiting for it blocks the whole hub.
+    """
+    return _original('threading').Lock()
+
+
+def blocking_sleep(seconds):
+    """
+    Sleeps the current OS thread. Use this (not time.sleep) inside work that
+    runs on the executor, where the monkey-patched time.sleep would try to
+    switch greenlets on a thread that has no business running the hub.
+    """
+    _real_time.sleep(seconds)
+
+
+def _unshare_thread_pool_lock():
+    """
+    yt-dlp downloads DASH/HLS fragments with a concurrent.futures
+    ThreadPoolExecutor, which under monkey_patch() runs green threads on the
+    hub of the executor thread that created it. Each pool is private to its
+    thread, except for the module-wide lock every submit() takes: a green
+    lock shared by several executor threads deadlocks ("Cannot switch to a
+    different thread") as soon as two fragment downloads run at once.
+    """
+    import concurrent.futures.thread
+
+    concurrent.futures.thread._global_shutdown_lock = thread_lock()
+
+
+class BlockingExecutor:
+    """
+    Runs blocking, CPU-heavy calls (yt-dlp extraction, downloads, ffmpeg
+    muxing) outside the eventlet hub so they cannot freeze Socket.IO and HTTP
+    handling for the whole process.
+
+    Under eventlet the work goes to eventlet.tpool (a pool of real OS
+    threads); otherwise a ThreadPoolExecutor is used. A ProcessPoolExecutor
+    is not an option here because yt-dlp progress hooks and loggers are
+    closures that cannot be pickled.
+    """
+
+    def __init__(self, max_workers=20, poll_interval=0.1):
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._use_tpool = eventlet is not None and patcher.is_monkey_patched('thread')
+        if self._use_tpool:
+            tpool.set_num_threads(max_workers)
+            self._pool = None
+            _unshare_thread_pool_lock()
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='blocking')
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on a worker thread and returns its result
+        (or re-raises its exception). Only the calling green thread waits.
+        """
+        if self._use_tpool:
+            return tpool.execute(fn, *args, **kwargs)
+        return self._pool.submit(fn, *args, **kwargs).result()
+
+    def call_with_events(self, fn, handler, *args, **kwargs):
+        """
+        Like call(), but fn is invoked as fn(post, *args, **kwargs). Every
+        post(kind, payload) made on the worker thread is delivered, in order,
+        as handler(kind, payload) on the calling thread (i.e. on the hub),
+        which is the only place it is safe to emit Socket.IO messages or take
+        green locks.
+        """
+        events = _real_queue.SimpleQueue()
+
+        def post(kind, payload):
+            events.put((kind, payload))
+
+        if self._use_tpool:
+            waiter = eventlet.spawn(tpool.execute, fn, post, *args, **kwargs)
+            is_done, get_result = (lambda: waiter.dead), waiter.wait
+        else:
+            future = self._pool.submit(fn, post, *args, **kwargs)
+            is_done, get_result = future.done, future.result
+
+        while True:
+            finished = is_done()
+            self._drain(events, handler)
+            if finished:
+                break
+            # Green sleep when monkey-patched: yields the hub between polls
+            time.sleep(self.poll_interval)
+
+        return get_result()
+
+    @staticmethod
+    def _drain(events, handler):
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except _real_queue.Empty:
+                return
+            try:
+                handler(kind, payload)
+            except Exception:
+                logger.exception(f"Error while handling '{kind}' event from worker thread")
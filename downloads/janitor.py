@@ -0,0 +1,277 @@
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Files yt-dlp only has while a download is running: <name>.part and its
+# .ytdl resume state, fragments of DASH/HLS downloads, the separate streams
+# of a merged format (<key>.f137.mp4) and FFmpeg's <key>.temp.mp4
+_TEMP_RE = re.compile(r'(\.part|\.ytdl|\.tmp|\.part-Frag\d+(\.part)?)$|\.temp\.\w+$|^[0-9a-f]{24}\.f[\w-]+\.\w+$')
+_TEMP_SUFFIX_RE = re.compile(r'(\.part|\.ytdl|\.tmp|\.part-Frag\d+(\.part)?)+$')
+# <key>.<ext>, as named by MediaStore.output_template()
+_STORE_NAME_RE = re.compile(r'^[0-9a-f]{24}\.\w+$')
+# What yt-dlp and the transcoder write, for files named otherwise (downloads from before the store)
+MEDIA_EXTENSIONS = frozenset({
+    'mp4', 'm4v', 'webm', 'mkv', 'mov', 'flv', '3gp', 'ts', 'avi',
+    'm4a', 'mp3', 'opus', 'ogg', 'oga', 'aac', 'flac', 'wav',
+})
+
+
+def is_temp_file(name):
+    return _TEMP_RE.search(name) is not None
+
+
+def is_media_file(name):
+    """
+    Whether a file in the download folder is one the janitor may delete: a
+    store item, a download or a temporary file of one. Anything else (e.g.
+    a misconfigured folder's source files) is never touched.
+    """
+    name = _TEMP_SUFFIX_RE.sub('', name)
+    if _STORE_NAME_RE.match(name):
+        return True
+    return '.' in name and name.rsplit('.', 1)[1].lower() in MEDIA_EXTENSIONS
+
+
+class FolderIndex:
+    """
+    In-memory listing of one folder: name -> (inode, size, mtime).
+
+    refresh() diffs os.scandir() against the previous listing instead of
+    stat()ing everything again, and skips the listing altogether while the
+    folder's own mtime is unchanged (no file was created, renamed or
+    deleted). Files that can still grow (temporary download files) are
+    stat()ed on every refresh. Only the janitor uses it, one refresh at a
+    time.
+    """
+
+    def __init__(self, folder, is_volatile=is_temp_file):
+        self.folder = folder
+        self.is_volatile = is_volatile
+        self.files = {}
+        self.listings = 0
+        self.volatile = set()  # Names in `files` that is_volatile() matched
+        self._folder_mtime = None
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            self.files = {}
+            return self.files
+        if mtime != self._folder_mtime:
+            # Taken before listing, so changes made during the listing are picked up next time
+            self._folder_mtime = mtime
+            self._list()
+        else:
+            for name in list(self.volatile):
+                if not self._stat(name, self.files):
+                    self.volatile.discard(name)
+        return self.files
+
+    def forget(self, name):
+        self.files.pop(name, None)
+        self.volatile.discard(name)
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.files.values())
+
+    def _list(self):
+        files, volatile = {}, set()
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                name = entry.name
+                known = self.files.get(name)
+                if known is None:
+                    if self.is_volatile(name):
+                        volatile.add(name)
+                    self._stat(name, files)
+                # scandir already knows the inode: a file replaced under the same name is noticed
+                elif name in self.volatile or known[0] != entry.inode():
+                    if name in self.volatile:
+                        volatile.add(name)
+                    self._stat(name, files)
+                else:
+                    files[name] = known
+        self.files, self.volatile = files, volatile
+        self.listings += 1
+
+    def _stat(self, name, files):
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            files.pop(name, None)
+            return False
+        files[name] = (st.st_ino, st.st_size, st.st_mtime)
+        return True
+
+
+class DiskJanitor:
+    """
+    Keeps the download folder bounded. Every `interval` seconds (and on
+    wake()) it deletes:
+
+    - temporary files (see is_temp_file) of downloads that are not running
+      and have not been written to for `orphan_age` seconds
+    - items downloaded more than `max_age` seconds ago
+    - items not requested for `max_idle` seconds
+    - least recently used items, once the folder (temporary files included)
+      is over `high_watermark` bytes, until it is under `low_watermark`
+
+    Items the store has pinned (being downloaded or served) are never
+    deleted. Media files the store does not know (e.g. downloaded before it
+    existed) count as last used at their mtime. 0 turns a policy off.
+
+    Decisions are made on the calling green thread, since the store uses
+    green locks; listing and deleting go through `call(fn, *args)` (the
+    blocking executor) in batches of `batch_size` files, so a large sweep
+    never blocks the hub.
+    """
+
+    REASONS = ('orphaned', 'age', 'idle', 'size')
+
+    def __init__(self, folder, store, interval=60, orphan_age=6 * 3600, max_age=0, max_idle=0, high_watermark=0,
+                 low_watermark=None, batch_size=100, spawn=None, sleep=time.sleep, call=None, clock=time.time):
+        self.folder = folder
+        self.store = store
+        self.interval = interval
+        self.orphan_age = orphan_age
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.high_watermark = high_watermark
+        self.low_watermark = high_watermark if low_watermark is None else min(low_watermark, high_watermark)
+        self.batch_size = batch_size
+        self.spawn = spawn
+        self.sleep = sleep
+        self.call = call or (lambda fn, *args: fn(*args))
+        self.clock = clock
+        self.index = FolderIndex(folder)
+        self._started = False
+        self._sweeping = False
+        self.sweeps = 0
+        self.deleted_files = dict.fromkeys(self.REASONS, 0)
+        self.deleted_bytes = 0
+        self.folder_bytes = 0
+        self.last_sweep_seconds = None
+
+    def start(self):
+        if self._started or self.spawn is None:
+            return
+        self._started = True
+        self.spawn(self._loop)
+
+    def wake(self):
+        """Runs a sweep now, e.g. after a download finished, unless one is running."""
+        if self._started and not self._sweeping:
+            self.spawn(self.sweep)
+
+    def sweep(self):
+        if self._sweeping:
+            return
+        self._sweeping = True
+        start = time.perf_counter()
+        try:
+            files = dict(self.call(self.index.refresh))
+            victims = self._plan(files, set(self.index.volatile), self.clock())
+            self._delete(victims)
+            self.folder_bytes = self.index.total_bytes()
+        finally:
+            self._sweeping = False
+            self.sweeps += 1
+            self.last_sweep_seconds = time.perf_counter() - start
+
+    def stats(self):
+        return {
+            'folder_bytes': self.folder_bytes,
+            'files': len(self.index.files),
+            'sweeps': self.sweeps,
+            'listings': self.index.listings,
+            'deleted_files': dict(self.deleted_files),
+            'deleted_bytes': self.deleted_bytes,
+            'last_sweep_seconds': self.last_sweep_seconds,
+        }
+
+    def _loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Download folder sweep failed")
+            self.sleep(self.interval)
+
+    def _plan(self, files, temp_files, now):
+        """Returns [(filename, inode, size, reason, store key or None)] to delete."""
+        indexed = {entry['filename']: (key, entry) for key, entry in self.store.entries()}
+        victims = []
+        candidates = []  # (last used, filename, inode, size, key): deletable to get under the watermark
+        total = 0
+        for name, (inode, size, mtime) in files.items():
+            if name.startswith('.') or not is_media_file(name):
+                continue  # The store index and other bookkeeping, or not ours
+            total += size
+            if name in indexed:
+                key, entry = indexed[name]
+                if self.store.pinned(key):
+                    continue
+                created, last_used = entry['created'], entry['last_access']
+            elif name in temp_files:
+                # Store file names start with the item key; a pinned key is still downloading
+                if not self.store.pinned(name.split('.', 1)[0]) and now - mtime > self.orphan_age:
+                    victims.append((name, inode, size, 'orphaned', None))
+                continue
+            elif self.store.pinned(name.split('.', 1)[0]):
+                continue  # Downloaded but not indexed yet, e.g. while it is being converted
+            else:
+                key, created, last_used = None, mtime, mtime
+            if self.max_age and now - created > self.max_age:
+                victims.append((name, inode, size, 'age', key))
+            elif self.max_idle and now - last_used > self.max_idle:
+                victims.append((name, inode, size, 'idle', key))
+            else:
+                candidates.append((last_used, name, inode, size, key))
+
+        total -= sum(size for _, _, size, _, _ in victims)
+        if self.high_watermark and total > self.high_watermark:
+            for _, name, inode, size, key in sorted(candidates):
+                if total <= self.low_watermark:
+                    break
+                victims.append((name, inode, size, 'size', key))
+                total -= size
+        return victims
+
+    def _delete(self, victims):
+        for i in range(0, len(victims), self.batch_size):
+            batch = victims[i:i + self.batch_size]
+            # Out of the index first, so the files are no longer handed out; pinned since planning means keep
+            removed = self.store.remove([key for _, _, _, _, key in batch if key is not None])
+            batch = [victim for victim in batch if victim[4] is None or victim[4] in removed]
+            deleted, errors = self.call(self._unlink, batch)
+            for name, size, reason in deleted:
+                self.deleted_files[reason] += 1
+                self.deleted_bytes += size
+                logger.info(f"Deleted '{name}' ({size} bytes, {reason}) from the download folder.")
+            for name, error in errors:
+                logger.error(f"Could not delete '{name}': {error}")
+            self.sleep(0)  # Let other green threads run between batches
+
+    def _unlink(self, batch):
+        # Runs on the executor: results are logged by the caller
+        deleted, errors = [], []
+        for name, inode, size, reason, _ in batch:
+            path = os.path.join(self.folder, name)
+            try:
+                # A new download of the same item may have replaced the file since the listing
+                if os.stat(path).st_ino == inode:
+                    os.remove(path)
+                    deleted.append((name, size, reason))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append((name, e))
+                continue
+            self.index.forget(name)
+        return deleted, errors
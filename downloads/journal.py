@@ -0,0 +1,133 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = ('queued', 'running')
+
+_COLUMNS = (
+    'job_id', 'session_id', 'client_id', 'video_url', 'format_id', 'video_title', 'preset', 'store_key', 'status',
+    'downloaded_bytes', 'total_bytes', 'partial_path', 'output_path', 'drive_account', 'created', 'updated',
+)
+
+
+class JobJournal:
+    """
+    Persistent record of download jobs, so queued and running downloads
+    survive a restart (deploy, crash, the debug reloader) and clients can
+    re-attach to a job by its ID.
+
+    Backed by sqlite in WAL mode with synchronous=NORMAL: a write is an
+    append to the WAL without an fsync, which keeps journaling progress
+    cheap, and a crash loses at most the last few progress updates, never
+    the job itself. Progress writes are further limited to one per
+    `progress_interval` seconds per job; yt-dlp resumes from the actual
+    size of the .part file anyway, so the recorded byte count only needs to
+    be roughly current.
+    """
+
+    def __init__(self, path, progress_interval=5.0):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.progress_interval = progress_interval
+        self._last_progress = {}  # job_id -> monotonic time of the last progress write
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'job_id TEXT PRIMARY KEY, session_id TEXT, client_id TEXT, video_url TEXT NOT NULL, '
+                'format_id TEXT NOT NULL, video_title TEXT, preset TEXT, store_key TEXT, status TEXT NOT NULL, '
+                'downloaded_bytes INTEGER, total_bytes INTEGER, partial_path TEXT, output_path TEXT, '
+                'drive_account TEXT, created REAL NOT NULL, updated REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+            if 'preset' not in columns:
+                # Journals written before conversion presets existed
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN preset TEXT')
+            if 'client_id' not in columns:
+                # Journals written before quotas were keyed by client address
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN client_id TEXT')
+            if 'drive_account' not in columns:
+                # Journals written before resumed jobs kept their Drive upload
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN drive_account TEXT')
+
+    def record(self, job):
+        """Adds a newly submitted job."""
+        now = time.time()
+        self._write(
+            'INSERT OR REPLACE INTO jobs (job_id, session_id, client_id, video_url, format_id, video_title, preset, '
+            'store_key, status, downloaded_bytes, total_bytes, partial_path, output_path, drive_account, created, '
+            'updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job.job_id, job.session_id, job.client_id, job.video_url, job.format_id, job.video_title, job.preset, job.store_key,
+             job.status, job.downloaded_bytes, job.total_bytes, job.partial_path, job.output_path, job.drive_account,
+             now, now),
+        )
+
+    def set_status(self, job_id, status):
+        self._write('UPDATE jobs SET status = ?, updated = ? WHERE job_id = ?', (status, time.time(), job_id))
+
+    def update_progress(self, job, force=False):
+        """
+        Records the job's byte counts and paths (and its format and store
+        key, which admission may have changed), at most once every
+        `progress_interval` seconds unless `force` is set.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_progress.get(job.job_id, float('-inf')) < self.progress_interval:
+            return
+        self._last_progress[job.job_id] = now
+        self._write(
+            'UPDATE jobs SET format_id = ?, store_key = ?, downloaded_bytes = ?, total_bytes = ?, partial_path = ?, '
+            'output_path = ?, updated = ? WHERE job_id = ?',
+            (job.format_id, job.store_key, job.downloaded_bytes, job.total_bytes, job.partial_path, job.output_path,
+             time.time(), job.job_id),
+        )
+
+    def finish(self, job):
+        """Records a job's final status (finished, failed or cancelled)."""
+        self._last_progress.pop(job.job_id, None)
+        self._write(
+            'UPDATE jobs SET status = ?, format_id = ?, store_key = ?, downloaded_bytes = ?, total_bytes = ?, '
+            'output_path = ?, updated = ? WHERE job_id = ?',
+            (job.status, job.format_id, job.store_key, job.downloaded_bytes, job.total_bytes, job.output_path,
+             time.time(), job.job_id),
+        )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def unfinished(self):
+        """Returns jobs that were queued or running when the process stopped, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT {", ".join(_COLUMNS)} FROM jobs WHERE status IN (?, ?) ORDER BY created',
+                UNFINISHED_STATUSES,
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def prune(self, max_age):
+        """Forgets finished jobs last updated more than `max_age` seconds ago."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'DELETE FROM jobs WHERE status NOT IN (?, ?) AND updated < ?',
+                UNFINISHED_STATUSES + (time.time() - max_age,),
+            )
+        return cursor.rowcount
+
+    def _write(self, sql, params):
+        # A journal write must never fail the download it describes
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(sql, params)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update the job journal: {e}")
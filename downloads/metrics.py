@@ -0,0 +1,274 @@
+import bisect
+import logging
+import math
+import time
+
+from downloads.executor import thread_lock
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) for latencies from milliseconds to minutes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Upper bounds (bytes/s) for transfer rates from 64KB/s to 1GB/s
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 2 ** i for i in range(15))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    """
+    Base for metrics with optional labels. Unlabelled metrics are used
+    directly (counter.inc()); labelled ones through a child per label value
+    set (histogram.labels(route='stream').observe(1.2)).
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = thread_lock()  # Updated from yt-dlp worker threads as well as green threads
+        self._children = {}
+        # Unlabelled metrics skip the label lookup on every update, and are exported as 0 before the first one
+        self._default = self._new_child() if not self.labelnames else None
+        if self._default is not None:
+            self._children[()] = self._default
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self):
+        """Yields (suffix, label names, label values, extra labels, value)."""
+        for values, child in list(self._children.items()):
+            for suffix, extra, value in child.samples():
+                yield suffix, self.labelnames, values, extra, value
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = thread_lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield '_total', (), self.value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, fn):
+        """Reads the value from fn() at scrape time instead."""
+        self.function = fn
+
+    def samples(self):
+        yield '', (), self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def set_function(self, fn):
+        self._default.set_function(fn)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._lock = thread_lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield '_bucket', (('le', _format_value(float(bound))),), cumulative
+        yield '_sum', (), total
+        yield '_count', (), cumulative
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram with fixed buckets. observe() is a bisect and two
+    additions under an uncontended lock, so it is cheap enough for hot paths.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+
+class MetricsRegistry:
+    """
+    The metrics of one process, rendered in the Prometheus text format.
+
+    Values that other components already count (cache hits, queue sizes)
+    are not duplicated on their hot paths: collector(fn) registers a
+    function returning [(name, type, help, value or {labels: value})],
+    which is only called at scrape time.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self.prefix + name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def collector(self, fn):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            self._header(lines, metric.name, metric.type, metric.documentation)
+            for suffix, names, values, extra, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(names, values, extra)} {_format_value(value)}')
+        for fn in self._collectors:
+            try:
+                collected = fn()
+            except Exception:
+                logger.exception("Metrics collector failed")
+                continue
+            for name, kind, documentation, value in collected:
+                name = self.prefix + name
+                self._header(lines, name, kind, documentation)
+                items = value.items() if isinstance(value, dict) else [((), value)]
+                for labels, sample in items:
+                    if sample is None:
+                        continue
+                    suffix = '_total' if kind == 'counter' else ''
+                    lines.append(f'{name}{suffix}{_format_labels([k for k, _ in labels], [v for _, v in labels])} '
+                                 f'{_format_value(sample)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _header(lines, name, kind, documentation):
+        # Counter samples carry the _total suffix, and so do their HELP and TYPE lines
+        name += '_total' if kind == 'counter' else ''
+        lines.append(f'# HELP {name} {documentation}')
+        lines.append(f'# TYPE {name} {kind}')
+
+
+class HubLagMonitor:
+    """
+    Measures how late the eventlet hub wakes a green thread: a loop sleeps
+    `interval` seconds and records how much longer it actually took. High
+    lag means something is blocking the hub (and every client with it).
+    """
+
+    def __init__(self, histogram, gauge=None, interval=0.5, spawn=None, sleep=time.sleep):
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self.spawn = spawn
+        self.sleep = sleep
+        self._started = False
+
+    def start(self):
+        if self._started or self.spawn is None:
+            return
+        self._started = True
+        self.spawn(self._loop)
+
+    def _loop(self):
+        while True:
+            start = time.perf_counter()
+            self.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.histogram.observe(lag)
+            if self.gauge is not None:
+                self.gauge.set(lag)
@@ -0,0 +1,96 @@
+from downloads.transcode import codec_family
+
+# What the compact ladder keeps of each format; codecs are shortened to their family
+COMPACT_FIELDS = ('format_id', 'ext', 'quality', 'resolution', 'height', 'filesize', 'vcodec', 'acodec')
+
+
+def format_details(f):
+    """
+    The preview's description of one yt-dlp format, signed URL included, or
+    None for formats that are neither audio nor video (storyboards etc.).
+    """
+    if 'url' not in f or (f.get('vcodec') == 'none' and f.get('acodec') == 'none'):
+        return None
+    height = f.get('height')
+
+    # Determine a user-friendly resolution string
+    resolution = f"{height}p" if height else (f.get('resolution') or 'N/A')
+    if f.get('acodec') != 'none' and f.get('vcodec') == 'none' and height is None:
+        resolution = "Audio"
+    elif height is None and not f.get('acodec'):
+        return None
+
+    return {
+        'format_id': f.get('format_id'),
+        'ext': f.get('ext'),
+        'quality': f.get('format_note') or resolution or 'N/A',
+        'resolution': resolution,
+        'width': f.get('width'),
+        'height': height,
+        'fps': f.get('fps'),
+        'tbr': f.get('tbr'),
+        'abr': f.get('abr'),
+        'filesize': f.get('filesize') or f.get('filesize_approx'),
+        'url': f.get('url'),
+        'vcodec': f.get('vcodec'),
+        'acodec': f.get('acodec'),
+    }
+
+
+def sort_formats(details):
+    """Highest video first, then audio, then unknown; larger files first within each."""
+    details.sort(key=lambda d: (
+        d['height'] if d.get('height') is not None else (-1 if d['resolution'] == 'Audio' else -2),
+        d.get('filesize') or 0,
+    ), reverse=True)
+    return details
+
+
+def all_formats(info):
+    return sort_formats([d for d in map(format_details, info.get('formats') or []) if d is not None])
+
+
+def format_ladder(details):
+    """
+    The formats worth offering: the best (highest bitrate, then largest) of
+    every resolution and video codec, kept apart for formats with and without
+    audio, and the best of every audio codec. Entries carry only
+    COMPACT_FIELDS, without URLs; format_details() has the rest.
+    """
+    best = {}
+    for d in details:
+        if d['resolution'] == 'Audio':
+            key = ('audio', codec_family(d['acodec']))
+        else:
+            key = (d['height'], codec_family(d['vcodec']), codec_family(d['acodec']) is not None)
+        rank = (d['tbr'] or 0, d['filesize'] or 0)
+        if key not in best or rank > best[key][0]:
+            best[key] = (rank, d)
+
+    ladder = []
+    for _, d in best.values():
+        entry = {field: d[field] for field in COMPACT_FIELDS if d[field] is not None}
+        for field in ('vcodec', 'acodec'):
+            if field in entry:
+                entry[field] = codec_family(entry[field]) or 'none'
+        ladder.append(entry)
+    return sort_formats(ladder)
+
+
+def truncate_text(text, limit):
+    """Returns (text cut to at most `limit` characters at a word boundary, whether it was cut)."""
+    if not text or len(text) <= limit:
+        return text, False
+    cut = text[:limit - 1]
+    space = cut.rfind(' ')
+    if space > limit * 0.8:
+        cut = cut[:space]
+    return cut.rstrip() + '…', True
+
+
+def paginate(items, page, per_page):
+    """Returns (the items of 1-based `page`, the page metadata)."""
+    pages = max(1, -(-len(items) // per_page))
+    page = min(max(1, page), pages)
+    start = (page - 1) * per_page
+    return items[start:start + per_page], {'page': page, 'per_page': per_page, 'total': len(items), 'pages': pages}
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressAggregator:
+    """
+    Coalesces download progress into batched Socket.IO messages.
+
+    yt-dlp calls its progress hooks many times per second per download.
+    Instead of one message per callback, update() only records the latest
+    state of each job (older unsent states are dropped as stale) and a tick
+    loop sends at most `rate` messages per second to each client: a single
+    'progress_batch' event carrying the latest update of every job that
+    client follows.
+
+    `emit(event, data, room=...)` is normally socketio.emit; `spawn(fn)`
+    starts the tick loop (socketio.start_background_task).
+    """
+
+    def __init__(self, emit, rate=2.0, spawn=None, event='progress_batch'):
+        self.emit = emit
+        self.interval = 1.0 / rate
+        self.spawn = spawn or self._spawn_thread
+        self.event = event
+        self._lock = threading.Lock()
+        self._pending = {}  # job_id -> (rooms, latest payload)
+        self._started = False
+        # Counters for measuring the effect of coalescing
+        self.received = 0
+        self.dropped = 0
+        self.messages_sent = 0
+
+    @staticmethod
+    def _spawn_thread(fn):
+        thread = threading.Thread(target=fn, daemon=True)
+        thread.start()
+        return thread
+
+    def update(self, job_id, payload, rooms):
+        """
+        Records the latest state of a job. `rooms` is the collection of
+        rooms (client session IDs) to deliver it to; it is read at send
+        time, so clients that attach in the meantime are included.
+        """
+        with self._lock:
+            self.received += 1
+            previous = self._pending.get(job_id)
+            if previous is not None:
+                self.dropped += 1
+                if 'log' in previous[1] and 'log' not in payload:
+                    payload = dict(payload, log=previous[1]['log'])
+                elif 'log' in payload and 'progress' not in payload:
+                    # A log line only updates the log of the pending progress state
+                    payload = dict(previous[1], log=payload['log'])
+            self._pending[job_id] = (rooms, payload)
+            if not self._started:
+                self._started = True
+                self.spawn(self._run)
+
+    def discard(self, job_id):
+        """
+        Drops a job's unsent state, e.g. right before its completion or
+        error event so a stale percentage never arrives after it.
+        """
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        batches = {}
+        for job_id, (rooms, payload) in pending.items():
+            update = dict(payload, job_id=job_id)
+            for room in list(rooms):
+                batches.setdefault(room, []).append(update)
+
+        for room, updates in batches.items():
+            try:
+                self.emit(self.event, {'updates': updates}, room=room)
+            except Exception:
+                logger.exception(f"Failed to send progress batch to {room}")
+        with self._lock:
+            self.messages_sent += len(batches)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'updates_received': self.received,
+                'updates_dropped': self.dropped,
+                'messages_sent': self.messages_sent,
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+class LogSampler:
+    """
+    Rate-limits repetitive log lines: allow(key) is true at most once per
+    `interval` seconds per key. The number of lines suppressed since the last
+    allowed one is available from suppressed(key) so it can be reported.
+    """
+
+    def __init__(self, interval=10.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._last = {}        # key -> monotonic time of last allowed line
+        self._suppressed = {}  # key -> lines skipped since then
+
+    def allow(self, key):
+        now = self.clock()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return False
+            self._last[key] = now
+            return True
+
+    def suppressed(self, key):
+        """Returns and resets the count of suppressed lines for a key."""
+        with self._lock:
+            return self._suppressed.pop(key, 0)
+
+    def forget(self, key):
+        with self._lock:
+            self._last.pop(key, None)
+            self._suppressed.pop(key, None)
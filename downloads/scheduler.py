@@ -0,0 +1,330 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the scheduler refuses new work because its queue (or the
+    caller's share of it) is already full.
+    """
+
+
+class DownloadJob:
+    """
+    A single queued or running download request.
+    """
+
+    def __init__(self, session_id, video_url, format_id, video_title, store_key=None, job_id=None, preset=None):
+        self.job_id = job_id or uuid.uuid4().hex  # Given when a journaled job is resumed
+        self.session_id = session_id  # Owner; counted against its per-session limit
+        self.client_id = session_id   # Owner's lasting identity (e.g. address) that byte quotas are charged to
+        self.video_url = video_url
+        self.format_id = format_id
+        self.video_title = video_title
+        self.preset = preset  # Name of a downloads.transcode preset to convert the file with, or None
+        self.store_key = store_key
+        self.subscribers = {session_id}  # Every session receiving this job's events
+        self.status = 'queued'  # queued -> running -> finished / failed / cancelled
+        self.queued_at = time.time()
+        self.cancel_event = threading.Event()
+        # Where yt-dlp is writing (<name>.part) and the final output name, once known
+        self.partial_path = None
+        self.output_path = None
+        self.downloaded_bytes = None
+        self.total_bytes = None
+        # Admission control: bytes reserved from the quotas, bytes actually received
+        self.admitted = False
+        self.admission_note = None
+        self.reserved_bytes = 0
+        self.transferred_bytes = 0
+        self.abort_reason = None  # Set when a limit stops the download
+        # Google account ID (auth/token_store.py) of the client that queued it, for its Drive upload
+        self.drive_account = None
+        self._done_callbacks = []
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed', 'cancelled')
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(job) once the job has finished, failed or been cancelled
+        (immediately if it already has).
+        """
+        if self.done:
+            fn(self)
+        else:
+            self._done_callbacks.append(fn)
+
+    def _run_done_callbacks(self):
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception(f"Done callback failed for job {self.job_id}")
+
+    @property
+    def room(self):
+        """Socket.IO room that all subscribers of this job are joined to."""
+        return f'job-{self.job_id}'
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'video_url': self.video_url,
+            'format_id': self.format_id,
+            'video_title': self.video_title,
+            'preset': self.preset,
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+        }
+
+
+class DownloadScheduler:
+    """
+    Bounded worker pool for download jobs.
+
+    Jobs are kept in one FIFO deque per session and sessions are served
+    round-robin, so a client that queues twenty downloads cannot starve a
+    client that queues one. At most `max_workers` jobs run at the same time;
+    `submit` raises QueueFullError instead of queueing unbounded work.
+
+    `run_job(job)` is called from a worker for every dequeued job.
+    `on_queue_change(job, position)` is called for every queued job whenever
+    the queue order changes. `spawn(fn)` starts a worker loop; pass
+    `socketio.start_background_task` so workers are green threads.
+    """
+
+    def __init__(self, run_job, max_workers=3, max_queue_size=50, max_jobs_per_session=5,
+                 on_queue_change=None, spawn=None):
+        self.run_job = run_job
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_session = max_jobs_per_session
+        self.on_queue_change = on_queue_change
+        self.spawn = spawn or self._spawn_thread
+
+        self._cond = threading.Condition()
+        self._sessions = deque()  # Round-robin order of sessions that have queued jobs
+        self._pending = {}        # session_id -> deque of queued DownloadJob
+        self._running = {}        # job_id -> running DownloadJob
+        self._moved = {}          # Earlier store key -> unfinished job re-keyed away from it (see rekey())
+        self._queued_count = 0
+        self._started = False
+
+    @staticmethod
+    def _spawn_thread(fn):
+        thread = threading.Thread(target=fn, daemon=True)
+        thread.start()
+        return thread
+
+    def _ensure_started(self):
+        # Workers are started lazily so that importing the app (e.g. in the
+        # debug reloader's parent process) does not spawn anything.
+        if self._started:
+            return
+        self._started = True
+        for _ in range(self.max_workers):
+            self.spawn(self._worker_loop)
+        logger.info(f"Download scheduler started with {self.max_workers} workers.")
+
+    # --- Public API ---
+    def submit(self, job):
+        """
+        Queues a job. Raises QueueFullError when the global queue or the
+        job's session is at its limit.
+        """
+        with self._cond:
+            if self._queued_count >= self.max_queue_size:
+                raise QueueFullError('The download queue is full. Please try again in a moment.')
+
+            session_jobs = self._pending.get(job.session_id)
+            active = len(session_jobs) if session_jobs else 0
+            active += sum(1 for j in self._running.values() if j.session_id == job.session_id)
+            if active >= self.max_jobs_per_session:
+                raise QueueFullError(
+                    f'You already have {active} downloads queued or running. '
+                    'Please wait for one to finish.'
+                )
+
+            if session_jobs is None:
+                session_jobs = self._pending[job.session_id] = deque()
+                self._sessions.append(job.session_id)
+            session_jobs.append(job)
+            self._queued_count += 1
+            job.status = 'queued'
+
+            self._ensure_started()
+            self._cond.notify()
+
+        self._notify_positions()
+        return job
+
+    def cancel(self, job_id, session_id=None):
+        """
+        Cancels a queued or running job. Queued jobs are removed immediately;
+        running jobs have their cancel_event set and are expected to stop at
+        the next progress callback. Returns the job, or None if unknown.
+        """
+        with self._cond:
+            job = self._running.get(job_id) or self._find_queued_locked(job_id)
+            if job is None or (session_id is not None and job.session_id != session_id):
+                return None
+            was_queued = job.status == 'queued'
+            if was_queued:
+                self._remove_queued_locked(job)
+                job.status = 'cancelled'
+            job.cancel_event.set()
+
+        if was_queued:
+            job._run_done_callbacks()
+        self._notify_positions()
+        return job
+
+    def jobs(self):
+        """
+        Returns all running and queued jobs.
+        """
+        with self._cond:
+            return list(self._running.values()) + self._queue_order_locked()
+
+    def get_job(self, job_id):
+        with self._cond:
+            return self._running.get(job_id) or self._find_queued_locked(job_id)
+
+    def in_flight(self, store_key):
+        """Returns the queued or running job producing `store_key`, if any."""
+        for job in self.jobs():
+            if job.store_key == store_key and not job.cancelled:
+                return job
+        job = self._moved.get(store_key)
+        return job if job is not None and not job.done and not job.cancelled else None
+
+    def rekey(self, job, store_key):
+        """
+        Moves a job to another store key, once it turns out to produce a
+        different item than it was queued as. Returns the job producing
+        `store_key` afterwards: `job`, or another job that already was.
+        Requests for the earlier key still find `job` with in_flight().
+        """
+        with self._cond:
+            owner = self.in_flight(store_key)
+            if owner is not None and owner is not job:
+                return owner
+            self._moved = {key: moved for key, moved in self._moved.items() if not moved.done}
+            if job.store_key:
+                self._moved[job.store_key] = job
+            job.store_key = store_key
+            return job
+
+    def subscribe(self, job, session_id):
+        job.subscribers.add(session_id)
+
+    def unsubscribe(self, job, session_id):
+        """Removes a subscriber; returns how many are left."""
+        job.subscribers.discard(session_id)
+        return len(job.subscribers)
+
+    def refresh(self, job):
+        # Jobs are live objects in this process; kept for SharedJobQueue's interface
+        return job
+
+    def queue_order(self):
+        """
+        Returns queued jobs in the order workers will pick them up.
+        """
+        with self._cond:
+            return self._queue_order_locked()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': self._queued_count,
+                'max_queue_size': self.max_queue_size,
+            }
+
+    # --- Internals ---
+    def _queue_order_locked(self):
+        # Simulate the round-robin: the first job of every session in rotation
+        # order, then the second job of every session, and so on.
+        order = []
+        queues = [self._pending[sid] for sid in self._sessions]
+        depth = 0
+        while True:
+            round_jobs = [q[depth] for q in queues if len(q) > depth]
+            if not round_jobs:
+                return order
+            order.extend(round_jobs)
+            depth += 1
+
+    def _find_queued_locked(self, job_id):
+        for jobs in self._pending.values():
+            for job in jobs:
+                if job.job_id == job_id:
+                    return job
+        return None
+
+    def _remove_queued_locked(self, job):
+        jobs = self._pending[job.session_id]
+        jobs.remove(job)
+        self._queued_count -= 1
+        if not jobs:
+            del self._pending[job.session_id]
+            self._sessions.remove(job.session_id)
+
+    def _pop_next_locked(self):
+        session_id = self._sessions.popleft()
+        jobs = self._pending[session_id]
+        job = jobs.popleft()
+        self._queued_count -= 1
+        if jobs:
+            self._sessions.append(session_id)  # Back of the rotation
+        else:
+            del self._pending[session_id]
+        return job
+
+    def _notify_positions(self):
+        if not self.on_queue_change:
+            return
+        for position, job in enumerate(self.queue_order(), start=1):
+            try:
+                self.on_queue_change(job, position)
+            except Exception:
+                logger.exception(f"Queue position callback failed for job {job.job_id}")
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._sessions:
+                    self._cond.wait()
+                job = self._pop_next_locked()
+                job.status = 'running'
+                self._running[job.job_id] = job
+
+            self._notify_positions()
+            try:
+                self.run_job(job)
+            except Exception:
+                logger.exception(f"Download job {job.job_id} raised an unhandled error")
+                job.status = 'failed'
+            finally:
+                with self._cond:
+                    self._running.pop(job.job_id, None)
+                if job.cancelled:
+                    job.status = 'cancelled'
+                elif job.status == 'running':
+                    job.status = 'finished'
+                job._run_done_callbacks()
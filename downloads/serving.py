@@ -0,0 +1,170 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+from flask import Response
+from werkzeug.http import is_resource_modified
+
+
+def send_media(request, path, download_name, etag=None, last_modified=None, accel=None, accel_uri=None,
+               chunk_size=256 * 1024, read=os.pread, on_close=None):
+    """
+    Builds a response for a (potentially multi-GB) media file with HTTP
+    Range/resume support and conditional requests.
+
+    - `etag` / `last_modified` (unix time) normally come from the download
+      index, so nothing has to be hashed or re-stat'ed to validate a cache.
+    - `accel='nginx'` returns only an X-Accel-Redirect to `accel_uri`, and
+      `accel='sendfile'` only an X-Sendfile header, so the front-end server
+      sends the bytes (and handles ranges) itself.
+    - Otherwise the file is handed to the server's wsgi.file_wrapper when it
+      has one (gunicorn uses os.sendfile there, i.e. zero-copy), or streamed
+      in `chunk_size` blocks with `read(fd, size, offset)`; pass a read that
+      runs off the eventlet hub so disk reads cannot stall it.
+
+    `on_close(nbytes)` is called once the response is done, with the number
+    of body bytes this process sent. The body bypasses Werkzeug's
+    close callbacks (direct_passthrough), so use this instead of
+    response.call_on_close.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    modified = datetime.fromtimestamp(int(last_modified or stat.st_mtime), tz=timezone.utc)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    response = Response(mimetype=mimetype)
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    response.last_modified = modified
+    if etag:
+        response.set_etag(etag)
+
+    if on_close is not None:
+        # Responses without a body of ours; replaced below when there is one
+        response.call_on_close(lambda: on_close(0))
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=modified):
+        response.status_code = 304
+        return response
+
+    if accel == 'nginx':
+        response.headers['X-Accel-Redirect'] = accel_uri
+        return response
+    if accel == 'sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    response.accept_ranges = 'bytes'
+    start, stop = 0, size
+    # A Range request is only honoured if If-Range (when sent) still matches
+    if request.range is not None and ('If-Range' not in request.headers or not is_resource_modified(
+            request.environ, etag=etag, last_modified=modified, ignore_if_range=False)):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        start, stop = byte_range
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    if request.method == 'HEAD':
+        response.content_length = stop - start
+        return response
+
+    f = open(path, 'rb')
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # The server sends from the current offset and stops at Content-Length
+        f.seek(start)
+        response.response = file_wrapper(_ClosingFile(f, on_close, stop - start), chunk_size)
+    else:
+        response.response = _RangeBody(f, start, stop, chunk_size, read, on_close)
+    response.direct_passthrough = True
+    response.content_length = stop - start
+    return response
+
+
+def send_json(request, payload, status=200, gzip_min_size=1024, compresslevel=6):
+    """
+    Builds a JSON response that is serialised without whitespace, carries an
+    ETag of its content and is gzip-compressed for clients that accept it
+    once it is `gzip_min_size` bytes or more. A GET whose If-None-Match
+    still matches gets an empty 304 instead, before anything is compressed.
+    Clients revalidate every time (Cache-Control: no-cache), since the data
+    behind it expires on the server's schedule.
+    """
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    compress = len(body) >= gzip_min_size and bool(request.accept_encodings['gzip'])
+    response = Response(mimetype='application/json', status=status)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    if status == 200:
+        # Each encoding is a different representation, so it gets its own tag
+        etag = hashlib.sha1(body).hexdigest()[:20] + ('-gzip' if compress else '')
+        response.set_etag(etag)
+        if request.method == 'GET' and not is_resource_modified(request.environ, etag=etag):
+            response.status_code = 304
+            return response
+    if compress:
+        body = gzip.compress(body, compresslevel=compresslevel, mtime=0)
+        response.content_encoding = 'gzip'
+    response.set_data(body)
+    return response
+
+
+class _ClosingFile:
+    """
+    File proxy for wsgi.file_wrapper that reports the response as done when
+    the server closes it. The server still gets the real fileno() for
+    sendfile; since it sends the whole range, that is what is reported.
+    """
+
+    def __init__(self, f, on_close, nbytes):
+        self._f = f
+        self._on_close = on_close
+        self._nbytes = nbytes
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def close(self):
+        self._f.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close(self._nbytes)
+
+
+class _RangeBody:
+    """
+    Body sending bytes [start, stop) of a file in chunks. The response is
+    reported as done from close(), which the server calls even when the
+    client went away before the first chunk (a generator's finally would
+    not run then).
+    """
+
+    def __init__(self, f, start, stop, chunk_size, read, on_close=None):
+        self._f = f
+        self._start = start
+        self._offset = start
+        self._stop = stop
+        self._chunk_size = chunk_size
+        self._read = read
+        self._on_close = on_close
+
+    def __iter__(self):
+        fd = self._f.fileno()
+        while self._offset < self._stop:
+            data = self._read(fd, min(self._chunk_size, self._stop - self._offset), self._offset)
+            if not data:
+                break  # File was truncated underneath us
+            self._offset += len(data)
+            yield data
+
+    def close(self):
+        self._f.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close(self._offset - self._start)
@@ -0,0 +1,633 @@
+import logging
+import threading
+import time
+import uuid
+
+from downloads.scheduler import DownloadJob, QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# Job fields kept in the shared store, and how to read them back
+_INT_FIELDS = ('downloaded_bytes', 'total_bytes', 'transferred_bytes', 'reserved_bytes')
+_FLOAT_FIELDS = ('queued_at',)
+_STR_FIELDS = ('session_id', 'client_id', 'video_url', 'format_id', 'video_title', 'preset', 'store_key', 'status',
+               'partial_path', 'output_path', 'admission_note', 'drive_account')
+# Fields a running job's worker publishes for the other processes (e.g. /stream/<job_id>)
+_PROGRESS_FIELDS = ('status', 'partial_path', 'output_path', 'downloaded_bytes', 'total_bytes', 'transferred_bytes')
+
+
+def connect_broker(url):
+    """
+    Returns the broker for a JOB_QUEUE_URL: a redis.Redis client for
+    redis:// URLs, or the process-wide MemoryBroker for memory://.
+    """
+    if url.startswith('memory://'):
+        return MemoryBroker.instance()
+    import redis  # Only needed in multi-worker mode
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class MemoryBroker:
+    """
+    In-process stand-in for Redis implementing the commands SharedJobQueue
+    uses, with redis-py's signatures and return values. Lets the shared
+    queue run (and be load tested) without a Redis server; every queue in
+    the process sees the same data, but other processes do not.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._cond = threading.Condition()
+
+    def _get(self, name, factory=None):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.time():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        if name not in self._data and factory is not None:
+            self._data[name] = factory()
+        return self._data.get(name)
+
+    def _drop_if_empty(self, name):
+        if not self._data.get(name, True):
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+
+    # Strings and counters
+    def get(self, name):
+        with self._cond:
+            return self._get(name)
+
+    def set(self, name, value, nx=False, ex=None):
+        with self._cond:
+            if nx and self._get(name) is not None:
+                return None
+            self._data[name] = str(value)
+            self._expires.pop(name, None)
+            if ex:
+                self._expires[name] = time.time() + ex
+            return True
+
+    def incr(self, name, amount=1):
+        with self._cond:
+            value = int(self._get(name) or 0) + amount
+            self._data[name] = str(value)
+            return value
+
+    def decr(self, name, amount=1):
+        return self.incr(name, -amount)
+
+    def delete(self, *names):
+        with self._cond:
+            removed = 0
+            for name in names:
+                if self._get(name) is not None:
+                    removed += 1
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+            return removed
+
+    def expire(self, name, seconds):
+        with self._cond:
+            if self._get(name) is None:
+                return False
+            self._expires[name] = time.time() + seconds
+            return True
+
+    # Hashes
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._cond:
+            fields = self._get(name, dict)
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for k in items if k not in fields)
+            fields.update({k: str(v) for k, v in items.items()})
+            return added
+
+    def hget(self, name, key):
+        with self._cond:
+            return (self._get(name) or {}).get(key)
+
+    def hgetall(self, name):
+        with self._cond:
+            return dict(self._get(name) or {})
+
+    def hdel(self, name, *keys):
+        with self._cond:
+            fields = self._get(name) or {}
+            removed = sum(1 for key in keys if fields.pop(key, None) is not None)
+            self._drop_if_empty(name)
+            return removed
+
+    # Lists
+    def rpush(self, name, *values):
+        with self._cond:
+            items = self._get(name, list)
+            items.extend(str(v) for v in values)
+            self._cond.notify_all()
+            return len(items)
+
+    def lpop(self, name):
+        with self._cond:
+            items = self._get(name) or []
+            value = items.pop(0) if items else None
+            self._drop_if_empty(name)
+            return value
+
+    def blpop(self, keys, timeout=0):
+        if isinstance(keys, str):
+            keys = [keys]
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while True:
+                for name in keys:
+                    items = self._get(name)
+                    if items:
+                        value = items.pop(0)
+                        self._drop_if_empty(name)
+                        return name, value
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def llen(self, name):
+        with self._cond:
+            return len(self._get(name) or [])
+
+    def lrange(self, name, start, end):
+        with self._cond:
+            items = self._get(name) or []
+            return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def lrem(self, name, count, value):
+        with self._cond:
+            items = self._get(name) or []
+            matches = [i for i, item in enumerate(items) if item == value]
+            if count:
+                matches = matches[:count] if count > 0 else matches[count:]
+            for i in reversed(matches):
+                del items[i]
+            self._drop_if_empty(name)
+            return len(matches)
+
+    # Sets
+    def sadd(self, name, *values):
+        with self._cond:
+            members = self._get(name, set)
+            added = len({str(v) for v in values} - members)
+            members.update(str(v) for v in values)
+            return added
+
+    def srem(self, name, *values):
+        with self._cond:
+            members = self._get(name) or set()
+            removed = len(members & {str(v) for v in values})
+            members.difference_update(str(v) for v in values)
+            self._drop_if_empty(name)
+            return removed
+
+    def smembers(self, name):
+        with self._cond:
+            return set(self._get(name) or ())
+
+    def scard(self, name):
+        with self._cond:
+            return len(self._get(name) or ())
+
+
+class SharedJobQueue:
+    """
+    Download queue shared by several processes through a Redis-compatible
+    broker (see connect_broker), with the same interface as
+    DownloadScheduler so app.py can use either.
+
+    Any process can submit, cancel and look up jobs; processes started with
+    `max_workers > 0` also pull jobs and run them. Scheduling matches
+    DownloadScheduler: one FIFO list per session, sessions served
+    round-robin, and the queue size and per-session limits are global.
+
+    Jobs submitted or running in this process are live DownloadJob objects.
+    A sync loop publishes the progress of the jobs running here, picks up
+    cancellations and newly attached subscribers from other processes,
+    and runs the done callbacks of jobs submitted here once the process
+    that ran them reports them finished. Running jobs whose worker stops
+    sending heartbeats are queued again; yt-dlp continues from the .part
+    file when the download folder is shared.
+
+    `run_job`, `on_queue_change` and `spawn` are as for DownloadScheduler.
+    """
+
+    def __init__(self, broker, run_job, max_workers=3, max_queue_size=50, max_jobs_per_session=5,
+                 on_queue_change=None, spawn=None, prefix='ytdl', sync_interval=1.0, result_ttl=3600,
+                 worker_timeout=30):
+        self.broker = broker
+        self.run_job = run_job
+        self.max_workers = max(0, max_workers)
+        self.max_queue_size = max_queue_size
+        self.max_jobs_per_session = max_jobs_per_session
+        self.on_queue_change = on_queue_change
+        self.spawn = spawn or self._spawn_thread
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.result_ttl = result_ttl          # How long finished jobs can still be looked up
+        self.worker_timeout = worker_timeout  # Heartbeat age after which a worker's jobs are requeued
+        self.worker_id = uuid.uuid4().hex[:12]
+
+        self._lock = threading.Lock()
+        self._watched = {}  # job_id -> DownloadJob submitted here, until it is done
+        self._running = {}  # job_id -> DownloadJob running here
+        self._workers_started = False
+        self._sync_started = False
+        self.claimed = 0
+        self.requeued = 0
+
+    @staticmethod
+    def _spawn_thread(fn):
+        thread = threading.Thread(target=fn, daemon=True)
+        thread.start()
+        return thread
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def start(self):
+        """Starts this process's download workers (if it has any) and the sync loop."""
+        with self._lock:
+            start_workers = self.max_workers and not self._workers_started
+            self._workers_started = True
+        if start_workers:
+            # Announced before the first claim, so no other process takes its jobs for orphans
+            self.broker.hset(self._key('workers'), self.worker_id, time.time())
+            for _ in range(self.max_workers):
+                self.spawn(self._worker_loop)
+            logger.info(f"Shared download queue worker {self.worker_id} started with {self.max_workers} workers.")
+        self._ensure_sync()
+
+    def _ensure_sync(self):
+        with self._lock:
+            if self._sync_started:
+                return
+            self._sync_started = True
+        self.spawn(self._sync_loop)
+
+    # --- Public API (same as DownloadScheduler) ---
+    def submit(self, job):
+        """
+        Queues a job. Raises QueueFullError when the global queue or the
+        job's session is at its limit. Returns the job that will produce
+        the item, which is another process's job if it queued the same
+        store key first.
+        """
+        b = self.broker
+        if b.incr(self._key('queued')) > self.max_queue_size:
+            b.decr(self._key('queued'))
+            raise QueueFullError('The download queue is full. Please try again in a moment.')
+        active = b.incr(self._key('active', job.session_id))
+        if active > self.max_jobs_per_session:
+            b.decr(self._key('active', job.session_id))
+            b.decr(self._key('queued'))
+            raise QueueFullError(
+                f'You already have {active - 1} downloads queued or running. '
+                'Please wait for one to finish.'
+            )
+
+        if job.store_key and not b.set(self._key('inflight', job.store_key), job.job_id, nx=True):
+            owner = self.in_flight(job.store_key)
+            if owner is not None:
+                b.decr(self._key('active', job.session_id))
+                b.decr(self._key('queued'))
+                return owner
+            b.set(self._key('inflight', job.store_key), job.job_id)  # Left behind by a finished job
+
+        job.status = 'queued'
+        b.hset(self._key('job', job.job_id), mapping=self._fields(job, self._all_fields()))
+        b.sadd(self._key('job', job.job_id, 'subscribers'), *job.subscribers)
+        b.sadd(self._key('jobs'), job.job_id)
+        with self._lock:
+            self._watched[job.job_id] = job
+        self._enqueue(job.job_id, job.session_id)
+
+        self.start()
+        self._notify_positions()
+        return job
+
+    def cancel(self, job_id, session_id=None):
+        """
+        Cancels a queued or running job, wherever it runs. Queued jobs are
+        removed immediately; the process running a job stops it at the next
+        progress callback after its next sync. Returns the job, or None.
+        """
+        job = self.get_job(job_id)
+        if job is None or job.done or (session_id is not None and job.session_id != session_id):
+            return None
+        job.cancel_event.set()
+        if job.status == 'queued' and self.broker.lrem(self._key('queue', job.session_id), 1, job_id):
+            self.broker.decr(self._key('queued'))
+            job.status = 'cancelled'
+            self._finish(job)
+            job._run_done_callbacks()
+            self._notify_positions()
+        else:
+            # Running, or claimed by a worker in the meantime
+            self.broker.hset(self._key('job', job_id), 'cancel', '1')
+        return job
+
+    def jobs(self):
+        """Returns all running and queued jobs, in every process."""
+        jobs = (self.get_job(job_id) for job_id in self.broker.smembers(self._key('jobs')))
+        return [job for job in jobs if job is not None and not job.done]
+
+    def get_job(self, job_id):
+        """
+        Returns a job by ID: the live object if it was submitted or runs
+        here, otherwise a snapshot (see refresh()). Finished jobs can be
+        looked up for `result_ttl` seconds.
+        """
+        with self._lock:
+            job = self._running.get(job_id) or self._watched.get(job_id)
+        return job or self._load(job_id)
+
+    def refresh(self, job):
+        """Updates a snapshot from get_job() with its latest shared state."""
+        with self._lock:
+            if job.job_id in self._running:
+                return job  # The worker's own object is always current
+        fields = self.broker.hgetall(self._key('job', job.job_id))
+        if fields:
+            self._apply(job, fields, _PROGRESS_FIELDS)
+            if fields.get('cancel'):
+                job.cancel_event.set()
+        return job
+
+    def queue_order(self):
+        """Returns queued jobs, in every process, in the order workers will pick them up."""
+        sessions = list(dict.fromkeys(self.broker.lrange(self._key('sessions'), 0, -1)))
+        queues = [self.broker.lrange(self._key('queue', sid), 0, -1) for sid in sessions]
+        order = []
+        depth = 0
+        while True:
+            round_ids = [q[depth] for q in queues if len(q) > depth]
+            if not round_ids:
+                break
+            order.extend(round_ids)
+            depth += 1
+        jobs = (self.get_job(job_id) for job_id in order)
+        return [job for job in jobs if job is not None and job.status == 'queued']
+
+    def in_flight(self, store_key):
+        """Returns the queued or running job producing `store_key`, if any."""
+        job_id = self.broker.get(self._key('inflight', store_key))
+        job = self.get_job(job_id) if job_id else None
+        return job if job is not None and not job.done and not job.cancelled else None
+
+    def rekey(self, job, store_key):
+        """
+        Moves a job to another store key, once it turns out to produce a
+        different item than it was queued as. Returns the job producing
+        `store_key` afterwards: `job`, or another job that already was.
+        Requests for the earlier key still find `job` with in_flight().
+        """
+        b = self.broker
+        if not b.set(self._key('inflight', store_key), job.job_id, nx=True):
+            owner = self.in_flight(store_key)
+            if owner is not None and owner.job_id != job.job_id:
+                return owner
+            b.set(self._key('inflight', store_key), job.job_id)
+        if job.store_key:
+            # Left to _finish() for the new key; the earlier one only has to outlive the job
+            b.expire(self._key('inflight', job.store_key), self.result_ttl)
+        job.store_key = store_key
+        b.hset(self._key('job', job.job_id), mapping={'store_key': store_key, 'format_id': job.format_id})
+        return job
+
+    def subscribe(self, job, session_id):
+        job.subscribers.add(session_id)
+        self.broker.sadd(self._key('job', job.job_id, 'subscribers'), session_id)
+
+    def unsubscribe(self, job, session_id):
+        """Removes a subscriber; returns how many are left."""
+        job.subscribers.discard(session_id)
+        self.broker.srem(self._key('job', job.job_id, 'subscribers'), session_id)
+        return self.broker.scard(self._key('job', job.job_id, 'subscribers'))
+
+    def stats(self):
+        jobs = self.jobs()
+        return {
+            'workers': self.max_workers,
+            'running': sum(1 for job in jobs if job.status == 'running'),
+            'queued': sum(1 for job in jobs if job.status == 'queued'),
+            'max_queue_size': self.max_queue_size,
+            'worker_processes': len(self._live_workers()),
+            'claimed_here': self.claimed,
+            'requeued': self.requeued,
+        }
+
+    # --- Internals ---
+    @staticmethod
+    def _all_fields():
+        return _STR_FIELDS + _INT_FIELDS + _FLOAT_FIELDS + ('admitted',)
+
+    @staticmethod
+    def _fields(job, names):
+        fields = {}
+        for name in names:
+            value = getattr(job, name)
+            if name == 'admitted':
+                value = '1' if value else ''
+            fields[name] = '' if value is None else value
+        fields['updated'] = time.time()
+        return fields
+
+    @staticmethod
+    def _apply(job, fields, names):
+        for name in names:
+            if name not in fields:
+                continue
+            value = fields[name]
+            if name in _INT_FIELDS:
+                value = int(float(value)) if value else (0 if name in ('transferred_bytes', 'reserved_bytes') else None)
+            elif name in _FLOAT_FIELDS:
+                value = float(value) if value else time.time()
+            elif name == 'admitted':
+                value = bool(value)
+            else:
+                value = value or None
+            setattr(job, name, value)
+
+    def _load(self, job_id):
+        fields = self.broker.hgetall(self._key('job', job_id))
+        if not fields:
+            return None
+        job = DownloadJob(fields['session_id'], fields['video_url'], fields['format_id'], fields['video_title'],
+                          store_key=fields.get('store_key') or None, job_id=job_id,
+                          preset=fields.get('preset') or None)
+        self._apply(job, fields, self._all_fields())
+        job.subscribers.clear()
+        job.subscribers.update(self.broker.smembers(self._key('job', job_id, 'subscribers')))
+        if fields.get('cancel'):
+            job.cancel_event.set()
+        return job
+
+    def _enqueue(self, job_id, session_id):
+        # A session enters the rotation when its list goes from empty to non-empty
+        if self.broker.rpush(self._key('queue', session_id), job_id) == 1:
+            self.broker.rpush(self._key('sessions'), session_id)
+
+    def _claim(self):
+        """Pops the next job in round-robin order, or returns None after a timeout."""
+        popped = self.broker.blpop(self._key('sessions'), timeout=max(1, int(self.sync_interval)))
+        if popped is None:
+            return None
+        session_id = popped[1]
+        job_id = self.broker.lpop(self._key('queue', session_id))
+        if self.broker.llen(self._key('queue', session_id)):
+            self.broker.rpush(self._key('sessions'), session_id)  # Back of the rotation
+        if job_id is None:
+            return None  # Emptied by a cancel, or a duplicate rotation entry
+        self.broker.decr(self._key('queued'))
+
+        with self._lock:
+            job = self._watched.get(job_id)
+        job = job or self._load(job_id)
+        if job is None or job.cancelled:
+            if job is not None:
+                job.status = 'cancelled'
+                self._finish(job)
+                job._run_done_callbacks()
+            return None
+        job.status = 'running'
+        self.broker.hset(self._key('job', job_id), mapping={'status': 'running', 'worker': self.worker_id,
+                                                           'updated': time.time()})
+        with self._lock:
+            self._running[job_id] = job
+        self.claimed += 1
+        return job
+
+    def _finish(self, job):
+        """Records a job's final state and releases its queue slots."""
+        b = self.broker
+        b.hset(self._key('job', job.job_id), mapping=self._fields(job, _PROGRESS_FIELDS))
+        b.srem(self._key('jobs'), job.job_id)
+        b.decr(self._key('active', job.session_id))
+        if job.store_key and b.get(self._key('inflight', job.store_key)) == job.job_id:
+            b.delete(self._key('inflight', job.store_key))
+        b.expire(self._key('job', job.job_id), self.result_ttl)
+        b.expire(self._key('job', job.job_id, 'subscribers'), self.result_ttl)
+        with self._lock:
+            self._watched.pop(job.job_id, None)
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("Could not claim a job from the shared queue")
+                time.sleep(self.sync_interval)
+                continue
+            if job is None:
+                continue
+
+            self._notify_positions()
+            try:
+                self.run_job(job)
+            except Exception:
+                logger.exception(f"Download job {job.job_id} raised an unhandled error")
+                job.status = 'failed'
+            finally:
+                if job.cancelled:
+                    job.status = 'cancelled'
+                elif job.status == 'running':
+                    job.status = 'finished'
+                with self._lock:
+                    self._running.pop(job.job_id, None)
+                try:
+                    self._finish(job)
+                except Exception:
+                    logger.exception(f"Could not record the end of job {job.job_id}")
+                job._run_done_callbacks()
+
+    def _sync_loop(self):
+        last_reap = 0.0
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                if self.max_workers:
+                    self.broker.hset(self._key('workers'), self.worker_id, time.time())
+                self._sync_running()
+                self._sync_watched()
+                if self.max_workers and time.monotonic() - last_reap >= self.worker_timeout / 2:
+                    last_reap = time.monotonic()
+                    self._requeue_orphans()
+            except Exception:
+                logger.exception("Shared download queue sync failed")
+
+    def _sync_running(self):
+        with self._lock:
+            running = list(self._running.values())
+        for job in running:
+            key = self._key('job', job.job_id)
+            self.broker.hset(key, mapping=self._fields(job, _PROGRESS_FIELDS))
+            if self.broker.hget(key, 'cancel'):
+                job.cancel_event.set()
+            # Clients attached through other processes (progress is read from job.subscribers)
+            subscribers = self.broker.smembers(self._key('job', job.job_id, 'subscribers'))
+            job.subscribers.update(subscribers)
+            job.subscribers.intersection_update(subscribers)
+
+    def _sync_watched(self):
+        with self._lock:
+            watched = [job for job_id, job in self._watched.items() if job_id not in self._running]
+        for job in watched:
+            fields = self.broker.hgetall(self._key('job', job.job_id))
+            if not fields:
+                job.status = 'failed'  # Expired or lost with the broker
+            else:
+                self._apply(job, fields, _PROGRESS_FIELDS)
+            if job.done:
+                with self._lock:
+                    self._watched.pop(job.job_id, None)
+                job._run_done_callbacks()
+
+    def _live_workers(self):
+        heartbeats = self.broker.hgetall(self._key('workers'))
+        now = time.time()
+        return {wid for wid, seen in heartbeats.items() if now - float(seen) < self.worker_timeout}
+
+    def _requeue_orphans(self):
+        live = self._live_workers()
+        for worker_id in set(self.broker.hgetall(self._key('workers'))) - live:
+            self.broker.hdel(self._key('workers'), worker_id)
+        for job_id in self.broker.smembers(self._key('jobs')):
+            fields = self.broker.hgetall(self._key('job', job_id))
+            if fields.get('status') != 'running' or fields.get('worker') in live:
+                continue
+            # Only one process requeues a given orphan
+            if not self.broker.set(self._key('requeue', job_id), self.worker_id, nx=True, ex=int(self.worker_timeout)):
+                continue
+            self.broker.hset(self._key('job', job_id), mapping={'status': 'queued', 'worker': ''})
+            self.broker.incr(self._key('queued'))
+            self._enqueue(job_id, fields['session_id'])
+            self.requeued += 1
+            logger.warning(f"Requeued job {job_id}: worker {fields.get('worker')} stopped responding")
+
+    def _notify_positions(self):
+        if not self.on_queue_change:
+            return
+        for position, job in enumerate(self.queue_order(), start=1):
+            try:
+                self.on_queue_change(job, position)
+            except Exception:
+                logger.exception(f"Queue position callback failed for job {job.job_id}")
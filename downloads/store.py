@@ -0,0 +1,332 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the index is then only locked between threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class MediaStore:
+    """
+    Content-addressed index of finished downloads.
+
+    Every item is keyed by (video_id, format_id) and stored in the download
+    folder as `<key>.<ext>`, so identical requests map to the same file and
+    two videos with the same title can no longer overwrite each other. The
+    index (key -> filename, size, title, last access) is kept in a JSON file
+    next to the media. Processes sharing the folder (see worker.py) reload
+    it when it changes and take a lock file around every update, so one
+    process never overwrites what another just added. Last access times
+    are written in batches rather than on every lookup: at most every
+    `access_flush_interval` seconds, and whenever entries() is read (on
+    each janitor sweep).
+
+    Items in use (being downloaded or served) are reference-counted and are
+    never evicted; everything else is evicted least-recently-used first once
+    the folder grows past `max_bytes` (or by a DiskJanitor, see
+    downloads/janitor.py, through entries(), pinned() and remove()). While
+    a process uses an item it also holds a shared lock on a byte of the
+    lock file derived from the key, so pinned() sees the items every
+    process sharing the folder is using. Locks held by other processes
+    are never waited for inside lockf(), which would stall every green
+    thread of this one, but polled with (monkey-patched, so green) sleeps.
+    """
+
+    def __init__(self, folder, index_file='.index.json', max_bytes=None, lock_file='.index.lock',
+                 access_flush_interval=60):
+        self.folder = folder
+        self.index_path = os.path.join(folder, index_file)
+        self.max_bytes = max_bytes
+        self.access_flush_interval = access_flush_interval
+        self._lock = threading.RLock()
+        self._entries = {}     # key -> entry dict (persisted)
+        self._by_filename = {} # filename -> key
+        self._refcounts = {}   # key -> active users (in memory only)
+        self._in_flight = {}   # key -> job currently producing the item
+        self._accessed = {}    # key -> last access not written to the index yet
+        self._accesses_flushed = time.monotonic()
+        self._index_mtime = None
+        self._lock_file = None
+        self._index_lock_depth = 0
+        if fcntl is not None:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            self._lock_file = open(os.path.join(folder, lock_file), 'a+b')
+        self._load()
+
+    @staticmethod
+    def make_key(video_id, format_id):
+        digest = hashlib.sha1(f'{video_id}\0{format_id}'.encode('utf-8')).hexdigest()
+        return digest[:24]
+
+    def output_template(self, key):
+        """yt-dlp outtmpl for an item, so the final file lands at <key>.<ext>."""
+        return os.path.join(self.folder, f'{key}.%(ext)s')
+
+    # --- Finished items ---
+    def lookup(self, key):
+        """
+        Returns the index entry for a finished item, or None. Entries whose
+        file has disappeared from disk are dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._reload_if_changed_locked()
+                entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(os.path.join(self.folder, entry['filename'])):
+                with self._index_locked():
+                    entry = self._entries.get(key)
+                    if entry is not None and not os.path.exists(os.path.join(self.folder, entry['filename'])):
+                        logger.warning(f"Indexed file '{entry['filename']}' is missing; dropping it from the index.")
+                        self._drop_locked(key)
+                        self._save_locked()
+                return None
+            entry['last_access'] = self._accessed[key] = time.time()
+            if time.monotonic() - self._accesses_flushed >= self.access_flush_interval:
+                self._flush_accesses_locked()
+            return dict(entry)
+
+    def lookup_filename(self, filename):
+        with self._lock:
+            key = self._by_filename.get(filename)
+            if key is None:
+                self._reload_if_changed_locked()
+                key = self._by_filename.get(filename)
+        return (key, self.lookup(key)) if key else (None, None)
+
+    def add(self, key, path, video_id, format_id, title):
+        """
+        Records a finished download at `path` (inside the folder) and evicts
+        old items if the folder is now over budget.
+        """
+        filename = os.path.basename(path)
+        ext = os.path.splitext(filename)[1]
+        now = time.time()
+        entry = {
+            'filename': filename,
+            'size': os.path.getsize(path),
+            'video_id': video_id,
+            'format_id': format_id,
+            'download_name': f'{title}{ext}',
+            'created': now,
+            'last_access': now,
+        }
+        with self._index_locked():
+            old = self._entries.get(key)
+            if old is not None:
+                self._by_filename.pop(old['filename'], None)
+            self._entries[key] = entry
+            self._by_filename[filename] = key
+            self._evict_locked()
+            self._save_locked()
+        return dict(entry)
+
+    def acquire(self, key):
+        with self._lock:
+            count = self._refcounts.get(key, 0)
+            if not count and self._lock_file is not None:
+                self._lock_byte(fcntl.LOCK_SH, self._pin_offset(key))
+            self._refcounts[key] = count + 1
+
+    def release(self, key):
+        with self._lock:
+            count = self._refcounts.get(key, 0) - 1
+            if count > 0:
+                self._refcounts[key] = count
+            elif self._refcounts.pop(key, None) is not None and self._lock_file is not None:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, self._pin_offset(key))
+
+    def pin_response(self, response, key):
+        """
+        Pins `key` until the (Werkzeug) `response` is closed. The key is
+        bound now: a job's store_key can change while its stream is open.
+        """
+        self.acquire(key)
+        response.call_on_close(lambda: self.release(key))
+        return response
+
+    def pinned(self, key):
+        """True while the item is being downloaded or served, by this process or another."""
+        with self._lock:
+            if self._refcounts.get(key) or key in self._in_flight:
+                return True
+            if self._lock_file is None:
+                return False
+            # Taking the byte exclusively only fails while another process holds its shared lock
+            offset = self._pin_offset(key)
+            try:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            except OSError:
+                return True
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, offset)
+            return False
+
+    def entries(self):
+        """Snapshot of the index as [(key, entry)]."""
+        with self._lock:
+            self._reload_if_changed_locked()
+            if self._accessed:
+                self._flush_accesses_locked()
+            return [(key, dict(entry)) for key, entry in self._entries.items()]
+
+    def remove(self, keys):
+        """
+        Drops items from the index, except pinned ones, and returns the
+        removed entries by key. Deleting their files is up to the caller.
+        """
+        removed = {}
+        with self._index_locked():
+            for key in keys:
+                if not self.pinned(key):
+                    entry = self._drop_locked(key)
+                    if entry is not None:
+                        removed[key] = entry
+            if removed:
+                self._save_locked()
+        return removed
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(entry['size'] for entry in self._entries.values())
+
+    # --- In-flight items ---
+    def in_flight(self, key):
+        with self._lock:
+            return self._in_flight.get(key)
+
+    def begin(self, key, job):
+        """Marks `job` as the producer of `key`; pins the key until finish()."""
+        with self._lock:
+            self._in_flight[key] = job
+            self.acquire(key)
+
+    def finish(self, key, job):
+        with self._lock:
+            if self._in_flight.get(key) is job:
+                del self._in_flight[key]
+                self.release(key)
+
+    # --- Internals ---
+    @staticmethod
+    def _pin_offset(key):
+        # Byte 0 is the index lock (see _index_locked()); 48 bits keep collisions negligible
+        return 1 + int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:12], 16)
+
+    def _lock_byte(self, mode, offset, max_delay=0.05):
+        delay = 0.001
+        while True:
+            try:
+                fcntl.lockf(self._lock_file, mode | fcntl.LOCK_NB, 1, offset)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    @contextmanager
+    def _index_locked(self):
+        """
+        Holds the store's lock and, across processes, an exclusive lock on
+        byte 0 of the lock file, with the index freshly reloaded: for the
+        read-modify-write of an update.
+        """
+        with self._lock:
+            if self._lock_file is not None and not self._index_lock_depth:
+                self._lock_byte(fcntl.LOCK_EX, 0)
+            self._index_lock_depth += 1
+            try:
+                self._reload_if_changed_locked()
+                yield
+            finally:
+                self._index_lock_depth -= 1
+                if self._lock_file is not None and not self._index_lock_depth:
+                    fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, 0)
+
+    def _flush_accesses_locked(self):
+        with self._index_locked():
+            if self._accessed:
+                self._save_locked()  # The reload kept them
+        self._accesses_flushed = time.monotonic()
+
+    def _reload_if_changed_locked(self):
+        # In multi-worker mode other processes add items to the same folder and index
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._index_mtime:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read download index '{self.index_path}': {e}")
+            return
+        # Rebuilt from scratch: items another process removed must not linger here
+        self._entries = {}
+        self._by_filename = {}
+        for key, entry in entries.items():
+            if os.path.exists(os.path.join(self.folder, entry['filename'])):
+                if key in self._accessed:
+                    # Not written yet, and never older than what another process saved
+                    entry['last_access'] = max(entry['last_access'], self._accessed[key])
+                self._entries[key] = entry
+                self._by_filename[entry['filename']] = key
+        logger.info(f"Loaded {len(self._entries)} items from download index.")
+
+    def _save_locked(self):
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)  # Atomic, so a crash never leaves half an index
+            self._index_mtime = os.stat(self.index_path).st_mtime_ns
+            self._accessed.clear()  # Written along with everything else
+        except OSError as e:
+            logger.error(f"Could not write download index '{self.index_path}': {e}")
+
+    def _drop_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._by_filename.pop(entry['filename'], None)
+        return entry
+
+    def _evict_locked(self):
+        if not self.max_bytes:
+            return
+        total = sum(entry['size'] for entry in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if self.pinned(key):
+                continue
+            try:
+                os.remove(os.path.join(self.folder, entry['filename']))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Could not evict '{entry['filename']}': {e}")
+                continue
+            self._drop_locked(key)
+            total -= entry['size']
+            logger.info(f"Evicted '{entry['filename']}' ({entry['size']} bytes) to stay within the disk budget.")
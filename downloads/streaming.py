@@ -0,0 +1,72 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def is_streamable(format_id):
+    """
+    Whether a format selection produces a single file that is written front
+    to back, and can therefore be streamed while it downloads. Merged
+    selections (e.g. '137+140') are only muxed into one file at the very end.
+    """
+    return bool(format_id) and '+' not in format_id
+
+
+def follow_download(job, chunk_size=256 * 1024, poll_interval=0.25, idle_timeout=120, refresh=None):
+    """
+    Yields the bytes of a job's output file while yt-dlp is still writing it.
+
+    The file is reopened for every read instead of being held open, so
+    yt-dlp can still rename `<name>.part` to its final name (which fails on
+    Windows while another handle is open); reading simply continues from the
+    same offset in whichever of the two exists. At most one chunk is held in
+    memory, and since the WSGI server only asks for the next chunk once the
+    previous one was written to the socket, a slow client slows down the
+    reads instead of buffering the download.
+
+    `job` must expose `partial_path`, `output_path` (set from yt-dlp
+    progress events) and `status`. When the job runs in another process,
+    `refresh(job)` is called to update them whenever no data is available.
+    """
+    offset = 0
+    idle = 0.0
+    while True:
+        data = _read_at(job, offset, chunk_size)
+        if data:
+            offset += len(data)
+            idle = 0.0
+            yield data
+            continue
+
+        if refresh is not None:
+            refresh(job)
+        if job.status not in ('queued', 'running'):
+            # Writer is done; drain whatever was flushed after our last read
+            data = _read_at(job, offset, chunk_size)
+            while data:
+                offset += len(data)
+                yield data
+                data = _read_at(job, offset, chunk_size)
+            if job.status != 'finished':
+                logger.warning(f"Stream of job {job.job_id} ended early: job {job.status} after {offset} bytes")
+            return
+
+        if idle >= idle_timeout:
+            logger.warning(f"Stream of job {job.job_id} timed out waiting for data after {offset} bytes")
+            return
+        time.sleep(poll_interval)  # Green sleep under eventlet
+        idle += poll_interval
+
+
+def _read_at(job, offset, size):
+    for path in (job.partial_path, job.output_path):
+        if not path:
+            continue
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+        except FileNotFoundError:
+            continue  # Renamed between checks; try the other name
+    return b''
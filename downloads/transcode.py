@@ -0,0 +1,249 @@
+import logging
+import os
+import shutil
+import subprocess
+import threading
+
+from downloads.admission import format_size
+
+logger = logging.getLogger(__name__)
+
+# Containers ffmpeg can write these codecs into without re-encoding
+_MP4_VIDEO_CODECS = {'avc1', 'h264', 'hev1', 'hvc1', 'hevc', 'av01', 'vp09'}
+_MP4_AUDIO_CODECS = {'aac', 'mp3', 'opus', 'ac-3', 'ec-3', 'flac', 'alac'}
+# An audio source this far below a preset's bitrate still counts as good enough for it
+_BITRATE_SLACK = 0.9
+
+
+class TranscodeError(Exception):
+    """
+    Raised when a conversion cannot be done: ffmpeg is missing, the source
+    codecs do not fit the requested container, or ffmpeg failed.
+    """
+
+
+class TranscodeCancelled(TranscodeError):
+    """Raised when a conversion was stopped because its job was cancelled."""
+
+
+class Preset:
+    """
+    One output the client can ask for.
+
+    'audio' presets extract the first audio stream, re-encoding it to
+    `codec` at `bitrate` kbit/s unless the source is already in one of
+    `copy_codecs`. 'remux' presets only change the container and never
+    re-encode. Encoders are ffmpeg's software ones available in every build,
+    so the presets behave the same on any machine, with or without a GPU.
+    """
+
+    def __init__(self, name, label, kind, ext, codec=None, bitrate=None, copy_codecs=()):
+        self.name = name
+        self.label = label
+        self.kind = kind
+        self.ext = ext
+        self.codec = codec
+        self.bitrate = bitrate
+        self.copy_codecs = frozenset(copy_codecs)
+
+    @property
+    def audio_only(self):
+        return self.kind == 'audio'
+
+    def to_dict(self):
+        return {'name': self.name, 'label': self.label, 'kind': self.kind, 'ext': self.ext, 'bitrate': self.bitrate}
+
+
+PRESETS = {preset.name: preset for preset in (
+    Preset('mp3', 'MP3 (192 kbit/s)', 'audio', 'mp3', codec='libmp3lame', bitrate=192, copy_codecs={'mp3'}),
+    Preset('mp3-128', 'MP3 (128 kbit/s)', 'audio', 'mp3', codec='libmp3lame', bitrate=128, copy_codecs={'mp3'}),
+    Preset('mp3-320', 'MP3 (320 kbit/s)', 'audio', 'mp3', codec='libmp3lame', bitrate=320, copy_codecs={'mp3'}),
+    Preset('m4a', 'M4A / AAC (128 kbit/s)', 'audio', 'm4a', codec='aac', bitrate=128, copy_codecs={'aac'}),
+    Preset('opus', 'Opus (96 kbit/s)', 'audio', 'opus', codec='libopus', bitrate=96, copy_codecs={'opus'}),
+    Preset('mp4', 'MP4 (remux, no re-encode)', 'remux', 'mp4'),
+    Preset('mkv', 'MKV (remux, no re-encode)', 'remux', 'mkv'),
+)}
+
+
+def codec_family(codec):
+    """'mp4a.40.2' -> 'aac', 'avc1.64001f' -> 'avc1'; None for missing or 'none'."""
+    if not codec or codec == 'none':
+        return None
+    family = codec.split('.', 1)[0].lower()
+    return 'aac' if family == 'mp4a' else family
+
+
+def audio_bitrate(f, duration):
+    """A format's audio bitrate in kbit/s, estimated from its size when yt-dlp does not know it."""
+    if f.get('abr'):
+        return f['abr']
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size and duration:
+        return size * 8 / 1000 / duration
+    return f.get('tbr')
+
+
+def choose_audio_source(info, preset):
+    """
+    format_id to download for an audio preset. Of the audio-only formats
+    whose bitrate is (nearly) at least the preset's, the smallest one the
+    preset can stream-copy, else the smallest one; if none is good enough,
+    the best there is. Falls back to a selector when the video has no
+    separate audio formats.
+    """
+    duration = info.get('duration')
+    audios = [f for f in info.get('formats') or []
+              if f.get('format_id') and f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    if not audios:
+        return 'bestaudio/best'
+    good = [f for f in audios if (audio_bitrate(f, duration) or 0) >= preset.bitrate * _BITRATE_SLACK]
+    if not good:
+        return max(audios, key=lambda f: audio_bitrate(f, duration) or 0)['format_id']
+    return min(good, key=lambda f: (
+        codec_family(f.get('acodec')) not in preset.copy_codecs,
+        format_size(f, duration) or float('inf'),
+    ))['format_id']
+
+
+class Transcoder:
+    """
+    Converts finished downloads with ffmpeg.
+
+    At most `max_processes` ffmpeg processes (default: one per CPU core)
+    run at once; further conversions wait for a slot. Each process is
+    limited to one encoder thread, so the pool size is what bounds CPU use.
+    Stream copy is used whenever the source codecs allow it, and when the
+    source already is what the preset would produce, ffmpeg is not run at
+    all.
+
+    ffmpeg runs as a child process, so convert() only blocks its calling
+    (green) thread; progress is read from ffmpeg's -progress output.
+    """
+
+    def __init__(self, ffmpeg='ffmpeg', max_processes=None, popen=subprocess.Popen):
+        self.ffmpeg = shutil.which(ffmpeg)
+        self.max_processes = max_processes or os.cpu_count() or 1
+        self.popen = popen
+        self._slots = threading.BoundedSemaphore(self.max_processes)
+        self.running = 0
+        self.waiting = 0
+        self.converted = 0
+        self.skipped = 0
+        self.failed = 0
+
+    @property
+    def available(self):
+        return self.ffmpeg is not None
+
+    def stats(self):
+        return {
+            'available': self.available,
+            'max_processes': self.max_processes,
+            'running': self.running,
+            'waiting': self.waiting,
+            'converted': self.converted,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+
+    def output_path(self, preset, source):
+        return os.path.splitext(source)[0] + '.' + preset.ext
+
+    def command(self, preset, source, output, vcodec=None, acodec=None):
+        """
+        ffmpeg arguments that turn `source` (with the given yt-dlp codec
+        strings, if known) into `output`. Raises TranscodeError when the
+        codecs cannot go into the preset's container without re-encoding.
+        """
+        audio = codec_family(acodec)
+        video = codec_family(vcodec)
+        args = [self.ffmpeg or 'ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-y', '-i', source]
+        if preset.audio_only:
+            args += ['-map', '0:a:0', '-vn', '-sn', '-dn']
+            if audio in preset.copy_codecs:
+                args += ['-c:a', 'copy']
+            else:
+                args += ['-c:a', preset.codec, '-b:a', f'{preset.bitrate}k']
+        else:
+            if preset.ext == 'mp4' and ((video and video not in _MP4_VIDEO_CODECS) or
+                                        (audio and audio not in _MP4_AUDIO_CODECS)):
+                raise TranscodeError(f'{", ".join(filter(None, (vcodec, acodec)))} cannot be remuxed into MP4 '
+                                     f'without re-encoding. Choose MKV instead.')
+            args += ['-map', '0', '-c', 'copy']
+        if preset.ext in ('mp4', 'm4a'):
+            args += ['-movflags', '+faststart']  # Index first, so players can start before the file is complete
+        args += ['-threads', '1', '-progress', 'pipe:1', '-nostats', output]
+        return args
+
+    def needs_ffmpeg(self, preset, source, vcodec=None, acodec=None):
+        """False when `source` already is what the preset would produce."""
+        if os.path.splitext(source)[1].lstrip('.').lower() != preset.ext:
+            return True
+        if preset.audio_only:
+            return codec_family(vcodec) is not None or codec_family(acodec) not in preset.copy_codecs
+        return False
+
+    def convert(self, preset, source, vcodec=None, acodec=None, duration=None, on_progress=None, cancelled=None):
+        """
+        Converts `source` for `preset` and returns the output path
+        (<source name>.<preset ext>); the source is deleted once the output
+        is in place. `on_progress(percent)` is called as ffmpeg advances
+        (when `duration` is known), and `cancelled()` is polled to stop it.
+        Raises TranscodeError or TranscodeCancelled; the source is kept
+        then, so a retry does not have to download it again.
+        """
+        if not self.needs_ffmpeg(preset, source, vcodec, acodec):
+            self.skipped += 1
+            return source
+        if not self.available:
+            raise TranscodeError('Converting downloads is not available on this server (ffmpeg was not found).')
+
+        output = self.output_path(preset, source)
+        temp = os.path.splitext(source)[0] + '.temp.' + preset.ext
+        args = self.command(preset, source, temp, vcodec, acodec)
+        self.waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            if cancelled is not None and cancelled():
+                raise TranscodeCancelled('Conversion cancelled.')
+            self._run(args, duration, on_progress, cancelled)
+            os.replace(temp, output)
+        except BaseException:
+            self.failed += 1
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            raise
+        finally:
+            self.running -= 1
+            self._slots.release()
+        if output != source:
+            os.remove(source)
+        self.converted += 1
+        return output
+
+    def _run(self, args, duration, on_progress, cancelled):
+        process = self.popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            # -progress writes key=value lines about twice a second, ending each block with progress=...
+            for line in process.stdout:
+                if cancelled is not None and cancelled():
+                    raise TranscodeCancelled('Conversion cancelled.')
+                key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+                if key == 'out_time_us' and duration and on_progress is not None and value.isdigit():
+                    on_progress(min(100.0, int(value) / 1e6 / duration * 100))
+            # -loglevel error keeps stderr to a few lines, well within the pipe buffer
+            error = process.stderr.read().decode('utf-8', 'replace').strip()
+            if process.wait() != 0:
+                raise TranscodeError(f'ffmpeg failed: {error.splitlines()[-1] if error else f"exit status {process.returncode}"}')
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
@@ -0,0 +1,202 @@
+import contextlib
+import logging
+
+import yt_dlp
+
+from downloads.executor import thread_lock
+
+logger = logging.getLogger(__name__)
+
+# Reusing an instance means redoing parts of YoutubeDL.__init__ by hand (see
+# _configure()), which relies on yt-dlp internals. Only the releases it was
+# checked against are pooled (requirements.txt pins one); with any other,
+# every job gets a fresh instance.
+POOLABLE_VERSIONS = frozenset({'2023.10.13'})
+
+# Options that can differ per job. Everything else (headers, cookies,
+# proxies, timeouts...) is baked into an instance's request handlers when it
+# is built, so it belongs in the pool's base options.
+JOB_PARAMS = frozenset({
+    'format', 'outtmpl', 'extract_flat', 'continuedl', 'concurrent_fragment_downloads',
+    'progress_hooks', 'postprocessor_hooks', 'post_hooks', 'logger', 'quiet', 'verbose', 'no_warnings',
+})
+
+# Extractor state worth sharing between instances: YouTube keeps the player
+# JS and the signature functions parsed from it per extractor instance
+SHARED_IE_CACHES = {'Youtube': ('_code_cache', '_player_cache')}
+
+_HOOK_PARAMS = (
+    ('post_hooks', '_post_hooks', 'add_post_hook'),
+    ('progress_hooks', '_progress_hooks', 'add_progress_hook'),
+    ('postprocessor_hooks', '_postprocessor_hooks', 'add_postprocessor_hook'),
+)
+
+
+class _Pooled:
+    def __init__(self, ydl):
+        self.ydl = ydl
+        self.params = dict(ydl.params)  # As normalised by YoutubeDL.__init__
+        self.cookies = list(ydl.cookiejar)  # From the base options (cookiefile, cookiesfrombrowser)
+        self.uses = 0
+
+
+class YdlPool:
+    """
+    Long-lived YoutubeDL instances built from one set of base options.
+
+    Building a YoutubeDL (extractor registry, cookie jar, request handlers)
+    and warming up its extractors takes longer than many extractions.
+    acquire(**job_params) lends out an idle instance set up for one job and
+    takes it back afterwards. Job options, hooks, per-run counters and the
+    cookie jar are reset on every checkout and return, so nothing carries
+    over between jobs except what is meant to: the instance itself and the
+    extractor caches in SHARED_IE_CACHES, which all instances of the pool
+    share. With a yt-dlp release not in POOLABLE_VERSIONS, nothing is
+    pooled and acquire() builds a new instance every time.
+
+    Instances that raised are closed rather than reused, as are instances
+    that have served `max_uses` jobs (yt-dlp keeps some per-instance sets
+    that only grow).
+
+    Used from executor threads; `spawn(fn)` runs the blocking prewarm()
+    (e.g. on the executor) when start() is first called.
+    """
+
+    def __init__(self, base_params=None, max_idle=4, max_uses=200, spawn=None, factory=yt_dlp.YoutubeDL):
+        self.base_params = dict(base_params or {})
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.spawn = spawn
+        self.factory = factory
+        self._lock = thread_lock()
+        self._idle = []
+        self._shared = {(ie_key, attr): {} for ie_key, attrs in SHARED_IE_CACHES.items() for attr in attrs}
+        self._started = False
+        self.poolable = yt_dlp.version.__version__ in POOLABLE_VERSIONS
+        if not self.poolable:
+            logger.warning(f"yt-dlp {yt_dlp.version.__version__} is not one the instance pool was checked against "
+                           f"({', '.join(sorted(POOLABLE_VERSIONS))}); building a new instance for every job.")
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def start(self):
+        if self._started or self.spawn is None or not self.max_idle or not self.poolable:
+            return
+        self._started = True
+        self.spawn(self.prewarm)
+
+    def prewarm(self, count=None):
+        """Builds instances until `count` (default max_idle) are idle. Blocking."""
+        count = self.max_idle if count is None else min(count, self.max_idle)
+        if not self.poolable:
+            return
+        with self._lock:
+            missing = count - len(self._idle)
+        for _ in range(missing):
+            try:
+                entry = self._create()
+            except Exception:
+                logger.exception("Could not prewarm a yt-dlp instance")
+                return
+            self._release(entry, reset=False)
+
+    @contextlib.contextmanager
+    def acquire(self, **job_params):
+        unknown = set(job_params) - JOB_PARAMS
+        if unknown:
+            raise ValueError(f"Not per-job yt-dlp options (set them in the pool's base options): {', '.join(sorted(unknown))}")
+        if not self.poolable:
+            ydl = self.factory(dict(self.base_params, **job_params))
+            with self._lock:
+                self.created += 1
+            try:
+                yield ydl
+            finally:
+                ydl.close()
+            return
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+            if entry is not None:
+                self.reused += 1
+        if entry is None:
+            entry = self._create()
+        try:
+            self._configure(entry, job_params)
+            yield entry.ydl
+        except BaseException:
+            self._close(entry)
+            raise
+        entry.uses += 1
+        self._release(entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idle': len(self._idle),
+                'max_idle': self.max_idle,
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+            }
+
+    def _create(self):
+        entry = _Pooled(self.factory(dict(self.base_params)))
+        for (ie_key, attr), cache in self._shared.items():
+            ie = entry.ydl.get_info_extractor(ie_key)
+            if hasattr(ie, attr):
+                setattr(ie, attr, cache)
+        # Request handlers build their opener and TLS context (loading the CA
+        # bundle is the slow part) on the first request; do it now instead
+        for handler in entry.ydl._request_director.handlers.values():
+            get_instance = getattr(handler, '_get_instance', None)
+            if get_instance is not None:
+                get_instance(proxies=handler.proxies, cookiejar=handler.cookiejar)
+        with self._lock:
+            self.created += 1
+        return entry
+
+    def _release(self, entry, reset=True):
+        if reset:
+            # Drops the job's hooks and logger, which would otherwise keep the job alive while idle
+            self._configure(entry, {})
+            # Cookies a site set during the job must not be sent on another client's behalf
+            entry.ydl.cookiejar.clear()
+            for cookie in entry.cookies:
+                entry.ydl.cookiejar.set_cookie(cookie)
+        with self._lock:
+            if entry.uses < self.max_uses and len(self._idle) < self.max_idle:
+                self._idle.append(entry)
+                return
+        self._close(entry)
+
+    def _close(self, entry):
+        with self._lock:
+            self.discarded += 1
+        try:
+            entry.ydl.close()
+        except Exception:
+            logger.exception("Error while closing a yt-dlp instance")
+
+    @staticmethod
+    def _configure(entry, job_params):
+        # Redoes the parts of YoutubeDL.__init__ that depend on per-job options
+        ydl = entry.ydl
+        ydl.params = dict(entry.params, **job_params)
+        if isinstance(ydl.params.get('outtmpl'), dict):
+            ydl.params['outtmpl'] = dict(ydl.params['outtmpl'])  # _parse_outtmpl() fills it in place
+        ydl._parse_outtmpl()
+        selector = ydl.params.get('format')
+        ydl.format_selector = (selector if selector in (None, '-') or callable(selector)
+                               else ydl.build_format_selector(selector))
+        for param, attr, add in _HOOK_PARAMS:
+            setattr(ydl, attr, [])
+            for hook in ydl.params.get(param) or []:
+                getattr(ydl, add)(hook)
+        # Per-run state
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+        ydl._num_videos = 0
+        ydl._playlist_level = 0
+        ydl._playlist_urls = set()
+        ydl._printed_messages = set()
@@ -36,6 +36,9 @@ if (themeToggle) {
 // Global variables
 let currentVideoData = null;
 let isDownloading = false;
+let currentJobId = null; // Server-side job ID of the active download (used for cancellation)
+let currentStreamUrl = null; // Set when the active download can be saved while it is still running
+let currentBatchId = null; // Server-side batch ID while a playlist is downloading
 let currentDownloadedVideos = []; // To store fetched downloaded videos
 let socket; // Declare socket globally for real-time updates
 
@@ -55,10 +58,12 @@ const videoDuration = document.getElementById('videoDuration');
 const videoViews = document.getElementById('videoViews');
 const videoUploadDate = document.getElementById('videoUploadDate'); // New
 const videoDescription = document.getElementById('videoDescription');
+const fullDescriptionBtn = document.getElementById('fullDescriptionBtn');
 const summarizeBtn = document.getElementById('summarizeBtn'); // New
 const summaryContainer = document.getElementById('summaryContainer'); // New
 const videoSummary = document.getElementById('videoSummary'); // New
 const qualitySelect = document.getElementById('qualitySelect');
+const presetSelect = document.getElementById('presetSelect'); // Only there when the server can convert
 const downloadBtn = document.getElementById('downloadBtn');
 const externalLink = document.getElementById('externalLink'); // New
 
@@ -69,6 +74,9 @@ const progressText = document.getElementById('progressText');
 const progressMessage = document.getElementById('progressMessage');
 const downloadLinkContainer = document.getElementById('downloadLinkContainer');
 const downloadLink = document.getElementById('downloadLink');
+const cancelDownloadBtn = document.getElementById('cancelDownloadBtn');
+const batchLinks = document.getElementById('batchLinks'); // One link per finished playlist item
+const uploadStatus = document.getElementById('uploadStatus'); // Google Drive upload of the current download
 
 
 // Initialize app
@@ -81,12 +89,28 @@ function initializeApp() {
     // Removed checkAuthStatus(); // No longer needed
     addLoadingAnimations();
     // Establish Socket.IO connection
-    socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port);
+    // Behind several server processes only a WebSocket stays on one process without sticky sessions
+    const socketOptions = window.SOCKETIO_WEBSOCKET_ONLY ? { transports: ['websocket'] } : {};
+    socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port, socketOptions);
     socket.on('progress_update', handleProgressUpdate); // Listen to 'progress_update' as per app.py now
+    socket.on('progress_batch', handleProgressBatch); // Coalesced progress for every job this client follows
     socket.on('download_complete', handleDownloadComplete); // Listen for download completion
     socket.on('download_error', handleDownloadError); // Listen for download errors
+    socket.on('download_queued', handleDownloadQueued); // Job accepted by the server-side queue
+    socket.on('queue_update', handleQueueUpdate); // Position changes while waiting for a worker
+    socket.on('download_cancelled', handleDownloadCancelled);
+    socket.on('batch_started', handleBatchStarted);
+    socket.on('batch_progress', handleBatchProgress);
+    socket.on('batch_complete', handleBatchComplete);
+    socket.on('upload_progress', handleUploadUpdate);
+    socket.on('upload_complete', handleUploadUpdate);
+    socket.on('upload_error', handleUploadUpdate);
     socket.on('connect', () => {
         console.log('Socket.IO Connected!');
+        if (isDownloading && currentJobId) {
+            // Reconnected with a new session (e.g. after a server restart): follow the same job again
+            socket.emit('attach_job', { job_id: currentJobId });
+        }
         // No specific UI update for connect, handled by Flask's initial 'status_update'
     });
     socket.on('status_update', (data) => { // This is for initial server status messages
@@ -105,6 +129,8 @@ function setupEventListeners() {
     });
     downloadBtn.addEventListener('click', startDownload);
     summarizeBtn.addEventListener('click', summarizeDescription); // New event listener for summarize button
+    fullDescriptionBtn.addEventListener('click', loadFullDescription);
+    cancelDownloadBtn.addEventListener('click', cancelDownload);
 }
 
 // --- Helper Functions ---
@@ -205,11 +231,9 @@ async function getInfo() {
     downloadBtn.disabled = true; // Disable download button during info fetching
 
     try {
-        const response = await fetch('/get_video_info', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ url: url })
-        });
+        // Compact: a collapsed format ladder without URLs and a shortened description.
+        // A GET, so the browser can revalidate a repeated lookup with the ETag
+        const response = await fetch(`/get_video_info?compact=1&url=${encodeURIComponent(url)}`);
         const data = await response.json();
 
         if (response.ok) {
@@ -236,7 +260,7 @@ function displayVideoInfo(data) {
     videoTitle.textContent = data.title;
     videoChannel.innerHTML = `<i class="fas fa-user"></i> ${data.channel}`;
     videoDuration.innerHTML = `<i class="fas fa-clock"></i> ${formatDuration(data.duration)}`;
-    videoViews.innerHTML = `<i class="fas fa-eye"></i> ${data.view_count.toLocaleString()}`;
+    videoViews.innerHTML = `<i class="fas fa-eye"></i> ${(data.view_count || 0).toLocaleString()}`;
     
     // Format upload date if available (YYYYMMDD to YYYY-MM-DD)
     if (data.upload_date && data.upload_date.length === 8) {
@@ -249,7 +273,8 @@ function displayVideoInfo(data) {
         videoUploadDate.style.display = 'none'; // Hide if no date
     }
 
-    videoDescription.textContent = data.description; // Display full description
+    videoDescription.textContent = data.description; // Shortened; the rest is loaded on request
+    fullDescriptionBtn.style.display = data.description_truncated ? 'inline-flex' : 'none';
 
     // Set original video link
     if (data.webpage_url) {
@@ -262,11 +287,26 @@ function displayVideoInfo(data) {
 
     // Populate quality selection dropdown
     qualitySelect.innerHTML = '<option value="">Select Quality</option>'; // Clear previous options
+
+    if (data.is_playlist) {
+        // Items of a playlist have different formats, so offer generic selections
+        videoDuration.innerHTML = `<i class="fas fa-list"></i> ${data.playlist_count || 0} items`;
+        [['best', 'Best quality (each item)'], ['bestaudio', 'Audio only (each item)']].forEach(([value, text]) => {
+            const option = document.createElement('option');
+            option.value = value;
+            option.textContent = text;
+            qualitySelect.appendChild(option);
+        });
+        qualitySelect.value = 'best';
+        return;
+    }
     
     // Filter and sort formats for display
     // Keep only video streams with height or audio streams (if no video stream combined)
     const relevantFormats = data.formats.filter(f => f.height || f.resolution === "Audio");
 
+    // Built off-document and inserted at once, so the list is laid out a single time
+    const options = document.createDocumentFragment();
     relevantFormats.forEach(format => {
         const option = document.createElement('option');
         option.value = format.format_id;
@@ -294,8 +334,9 @@ function displayVideoInfo(data) {
             qualityText += ` - ${formatFileSize(format.filesize)}`;
         }
         option.textContent = qualityText;
-        qualitySelect.appendChild(option);
+        options.appendChild(option);
     });
+    qualitySelect.appendChild(options);
 
     // Attempt to pre-select 720p, otherwise select the first available (highest quality from sorted list)
     const seventyTwoOp = relevantFormats.find(f => f.height === 720);
@@ -306,6 +347,30 @@ function displayVideoInfo(data) {
     }
 }
 
+async function loadFullDescription() {
+    if (!currentVideoData) {
+        return;
+    }
+    fullDescriptionBtn.disabled = true;
+    try {
+        const response = await fetch(`/get_video_description?url=${encodeURIComponent(currentVideoData.original_url)}`);
+        const data = await response.json();
+        if (response.ok) {
+            currentVideoData.description = data.description;
+            currentVideoData.description_truncated = false;
+            videoDescription.textContent = data.description;
+            fullDescriptionBtn.style.display = 'none';
+        } else {
+            showError(data.error || 'Failed to load the description.');
+        }
+    } catch (error) {
+        console.error('Error loading description:', error);
+        showError('An unexpected error occurred while loading the description.');
+    } finally {
+        fullDescriptionBtn.disabled = false;
+    }
+}
+
 async function summarizeDescription() {
     if (!currentVideoData) {
         showError('No video information available to summarize.');
@@ -347,6 +412,7 @@ function startDownload() {
     }
 
     const selectedFormatId = qualitySelect.value;
+    const selectedPreset = presetSelect ? presetSelect.value || null : null;
     if (!selectedFormatId) {
         showError('Please select a quality for download.');
         return;
@@ -358,10 +424,12 @@ function startDownload() {
     }
 
     isDownloading = true;
+    currentJobId = null;
     downloadBtn.disabled = true;
     getInfoBtn.disabled = true;
     urlInput.disabled = true;
     qualitySelect.disabled = true;
+    if (presetSelect) presetSelect.disabled = true;
     summarizeBtn.disabled = true;
 
     hideVideoInfo(); // Hide video info when download starts
@@ -371,21 +439,118 @@ function startDownload() {
     downloadLinkContainer.style.display = 'none'; // Hide download link until complete
     downloadLink.href = '#'; // Clear previous link
     downloadLink.textContent = ''; // Clear previous link text
+    batchLinks.innerHTML = '';
+    batchLinks.style.display = 'none';
+    uploadStatus.textContent = '';
+    uploadStatus.style.display = 'none';
     progressBar.style.width = '0%';
     progressText.textContent = '0%';
     progressMessage.textContent = 'Starting download...';
+    cancelDownloadBtn.style.display = 'inline-flex';
     progressBarContainer.scrollIntoView({ behavior: 'smooth', block: 'center' });
 
 
+    if (currentVideoData.is_playlist) {
+        console.log('Emitting start_batch event...');
+        progressMessage.textContent = 'Expanding playlist...';
+        socket.emit('start_batch', {
+            urls: [currentVideoData.original_url],
+            format_id: selectedFormatId,
+            preset: selectedPreset
+        });
+        return;
+    }
+
     console.log('Emitting start_download event...');
     socket.emit('start_download', {
         video_url: currentVideoData.original_url,
         format_id: selectedFormatId,
-        video_title: currentVideoData.title
+        video_title: currentVideoData.title,
+        preset: selectedPreset
     });
 }
 
+function cancelDownload() {
+    if (isDownloading && currentBatchId) {
+        cancelDownloadBtn.disabled = true;
+        progressMessage.textContent = 'Cancelling...';
+        socket.emit('cancel_batch', { batch_id: currentBatchId });
+        return;
+    }
+    if (!isDownloading || !currentJobId) {
+        return;
+    }
+    cancelDownloadBtn.disabled = true;
+    progressMessage.textContent = 'Cancelling...';
+    socket.emit('cancel_download', { job_id: currentJobId });
+}
+
+// Shared by every handler that ends a download (complete, error, cancelled)
+function finishDownloadUI() {
+    isDownloading = false;
+    currentJobId = null;
+    currentStreamUrl = null;
+    currentBatchId = null;
+    downloadBtn.disabled = false;
+    getInfoBtn.disabled = false;
+    urlInput.disabled = false;
+    qualitySelect.disabled = false;
+    if (presetSelect) presetSelect.disabled = false;
+    summarizeBtn.disabled = false;
+    cancelDownloadBtn.style.display = 'none';
+    cancelDownloadBtn.disabled = false;
+}
+
 // --- Socket.IO Handlers ---
+function handleProgressBatch(data) {
+    if (currentBatchId) {
+        return; // Playlist progress is reported per item by batch_progress
+    }
+    data.updates.forEach(update => {
+        if (currentJobId && update.job_id !== currentJobId) {
+            return;
+        }
+        if (update.progress !== undefined) {
+            handleProgressUpdate(update);
+        } else if (update.log) {
+            console.log(update.log);
+        }
+    });
+}
+
+function handleDownloadQueued(data) {
+    console.log('Download Queued:', data);
+    if (currentBatchId) {
+        return;
+    }
+    currentJobId = data.job_id;
+    progressMessage.textContent = data.message;
+    currentStreamUrl = data.stream_url || null;
+    if (currentStreamUrl) {
+        // Saving can start right away; the file is streamed as it downloads
+        downloadLink.href = currentStreamUrl;
+        downloadLink.textContent = 'Save now (streams while downloading)';
+        downloadLinkContainer.style.display = 'block';
+    }
+}
+
+function handleQueueUpdate(data) {
+    if (currentBatchId || (currentJobId && data.job_id !== currentJobId)) {
+        return;
+    }
+    progressMessage.textContent = data.message;
+}
+
+function handleDownloadCancelled(data) {
+    console.log('Download Cancelled:', data);
+    if (currentBatchId) {
+        return; // batch_complete ends the UI for a cancelled batch
+    }
+    finishDownloadUI();
+    progressBarContainer.style.display = 'none';
+    showSuccess(data.message || 'Download cancelled.');
+}
+
 function handleProgressUpdate(data) {
     console.log('Progress Update:', data);
     const progress = Math.round(data.progress);
@@ -398,20 +563,58 @@ function handleProgressUpdate(data) {
     // Optional: Hide/show based on status
     if (data.status === 'downloading') {
         progressBarContainer.style.display = 'block';
-        downloadLinkContainer.style.display = 'none';
+        if (!currentStreamUrl) {
+            downloadLinkContainer.style.display = 'none';
+        }
     } else if (data.status === 'finished') {
         progressMessage.textContent = 'Download completed successfully. Preparing link...';
     }
 }
 
+function handleBatchStarted(data) {
+    console.log('Batch Started:', data);
+    currentBatchId = data.batch_id;
+}
+
+function handleBatchProgress(data) {
+    if (data.batch_id !== currentBatchId) {
+        return;
+    }
+    // The total is only known once the playlist is fully expanded
+    const finished = data.completed + data.failed;
+    const progress = data.exhausted && data.discovered ? Math.round(finished / data.discovered * 100) : 0;
+    progressBar.style.width = progress + '%';
+    progressText.textContent = data.exhausted ? `${progress}%` : `${finished}`;
+    progressMessage.textContent = data.message;
+}
+
+function handleBatchComplete(data) {
+    console.log('Batch Complete:', data);
+    if (data.batch_id !== currentBatchId) {
+        return;
+    }
+    finishDownloadUI();
+    showSuccess(data.message || 'All playlist items were processed.');
+}
+
+function addBatchLink(data) {
+    const item = document.createElement('li');
+    const link = document.createElement('a');
+    link.href = data.file_url;
+    link.download = '';
+    link.textContent = data.filename;
+    item.appendChild(link);
+    batchLinks.appendChild(item);
+    batchLinks.style.display = 'block';
+}
+
 function handleDownloadComplete(data) {
     console.log('Download Complete:', data);
-    isDownloading = false;
-    downloadBtn.disabled = false;
-    getInfoBtn.disabled = false;
-    urlInput.disabled = false;
-    qualitySelect.disabled = false;
-    summarizeBtn.disabled = false;
+    if (currentBatchId) {
+        addBatchLink(data);
+        return;
+    }
+    finishDownloadUI();
 
 
     showSuccess('Download completed successfully!');
@@ -429,14 +632,33 @@ function handleDownloadComplete(data) {
     // setTimeout(resetForm, 5000);
 }
 
+function handleUploadUpdate(data) {
+    if (currentBatchId) {
+        return;
+    }
+    uploadStatus.style.display = 'block';
+    if (data.status === 'finished') {
+        uploadStatus.innerHTML = '<i class="fab fa-google-drive"></i> Saved to Google Drive. ';
+        if (data.web_view_link) {
+            const link = document.createElement('a');
+            link.href = data.web_view_link;
+            link.target = '_blank';
+            link.textContent = 'Open in Drive';
+            uploadStatus.appendChild(link);
+        }
+    } else if (data.status === 'failed') {
+        uploadStatus.textContent = `Google Drive upload failed: ${data.error}`;
+    } else {
+        uploadStatus.textContent = `Uploading to Google Drive: ${formatFileSize(data.uploaded_bytes)} sent`;
+    }
+}
+
 function handleDownloadError(data) {
     console.error('Download Error:', data);
-    isDownloading = false;
-    downloadBtn.disabled = false;
-    getInfoBtn.disabled = false;
-    urlInput.disabled = false;
-    qualitySelect.disabled = false;
-    summarizeBtn.disabled = false;
+    if (currentBatchId) {
+        return; // A failed item is counted in batch_progress; the rest carry on
+    }
+    finishDownloadUI();
 
     showError(`Download failed: ${data.message}`);
     progressBarContainer.style.display = 'none'; // Hide progress bar on error
@@ -0,0 +1,78 @@
+import pytest
+
+from downloads.admission import AdmissionController, AdmissionError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_client_quota_is_shared_by_its_connections():
+    admission = AdmissionController(0, [], client_quota=100, quota_window=100, clock=Clock())
+    admission.reserve('203.0.113.7', 80)
+
+    with pytest.raises(AdmissionError):
+        admission.reserve('203.0.113.7', 30)
+    assert admission.reserve('198.51.100.2', 30) == 30
+
+
+def test_settle_refunds_unused_reservations():
+    clock = Clock()
+    admission = AdmissionController(0, [], client_quota=100, quota_window=100, clock=clock)
+    admission.reserve('203.0.113.7', 80)
+    admission.settle('203.0.113.7', 80, 20)
+
+    assert admission.reserve('203.0.113.7', 70) == 70
+
+
+FORMATS = [dict(f, url=f"https://media.example/{f['format_id']}", protocol='https') for f in [
+    {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'filesize': 3_000_000},
+    {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 360, 'filesize': 20_000_000},
+    {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720, 'filesize': 40_000_000},
+    {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'height': 1080, 'filesize': 90_000_000},
+]]
+INFO = {'id': 'abc', 'duration': 300, 'formats': FORMATS}  # Sorted worst to best, as yt-dlp leaves them
+
+
+def test_known_format_ids_are_admitted_as_they_are():
+    plan = AdmissionController(100_000_000, ['mp4', 'm4a']).plan(INFO, '137+140')
+    assert (plan.format_id, plan.estimated_bytes, plan.ext) == ('137+140', 93_000_000, 'mp4')
+    assert plan.note is None
+
+
+def test_selectors_are_resolved_to_the_formats_yt_dlp_would_pick():
+    admission = AdmissionController(100_000_000, ['mp4', 'm4a'])
+    assert admission.plan(INFO, 'bestvideo[height<=720]+bestaudio').format_id == '136+140'
+    assert admission.plan(INFO, 'best').format_id == '18'
+    assert admission.plan(INFO, 'bestaudio').format_id == '140'
+
+
+def test_selected_formats_over_the_limit_are_downgraded():
+    plan = AdmissionController(50_000_000, ['mp4', 'm4a']).plan(INFO, 'bestvideo+bestaudio')
+    assert plan.format_id == '136+140'
+    assert plan.downgraded_from == '137+140'
+
+
+def test_over_the_limit_without_downgrade_is_rejected():
+    admission = AdmissionController(50_000_000, ['mp4', 'm4a'], downgrade=False)
+    with pytest.raises(AdmissionError):
+        admission.plan(INFO, '137')
+    assert admission.rejected == 1
+
+
+def test_unknown_formats_and_bad_selectors_are_rejected():
+    admission = AdmissionController(100_000_000, ['mp4', 'm4a'])
+    with pytest.raises(AdmissionError):
+        admission.plan(INFO, '999')
+    with pytest.raises(AdmissionError):
+        admission.plan(INFO, 'best[height<=')
+    assert admission.rejected == 2
+
+
+def test_selectors_without_formats_are_filtered():
+    plan = AdmissionController(100, ['mp4']).plan({'id': 'abc'}, 'best')
+    assert plan.format_id == "best[filesize<?100][filesize_approx<?100][ext~='^(mp4)$']"
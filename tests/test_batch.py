@@ -0,0 +1,55 @@
+from downloads.batch import BatchDownload
+from downloads.scheduler import DownloadJob
+
+
+def make_batch(urls, concurrency=3):
+    jobs = {}
+    updates = []
+
+    def submit(url, title):
+        # Like app.request_download: a URL already downloading is joined, not queued again
+        if url not in jobs or jobs[url].done:
+            jobs[url] = DownloadJob('sid', url, 'best', title)
+        return jobs[url]
+
+    batch = BatchDownload('sid', [(url, None) for url in urls], submit, updates.append, concurrency=concurrency)
+    return batch, jobs
+
+
+def finish(job, status='finished'):
+    job.status = status
+    job._run_done_callbacks()
+
+
+def test_items_sharing_a_job_are_counted_separately():
+    batch, jobs = make_batch(['a', 'b', 'a'])
+    batch.start()
+    assert len(batch.active) == 3
+
+    finish(jobs['a'])
+    finish(jobs['b'], 'failed')
+
+    assert batch.completed == 2
+    assert batch.failed == 1
+    assert batch.done
+
+
+def test_concurrency_bounds_the_items_pulled():
+    batch, jobs = make_batch(['a', 'b', 'c', 'd'], concurrency=2)
+    batch.start()
+    assert batch.discovered == 2
+    assert set(jobs) == {'a', 'b'}
+
+    finish(jobs['a'])
+    assert batch.discovered == 3
+    assert set(jobs) == {'a', 'b', 'c'}
+
+
+def test_cancel_returns_each_job_once():
+    batch, jobs = make_batch(['a', 'a', 'b'])
+    batch.start()
+
+    cancelled = batch.cancel()
+
+    assert sorted(job.video_url for job in cancelled) == ['a', 'b']
+    assert batch.done
@@ -0,0 +1,54 @@
+import time
+
+from downloads.cache import MetadataCache, cache_key
+
+
+def test_youtube_links_of_one_video_share_a_key():
+    keys = {cache_key(url) for url in (
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'https://youtu.be/dQw4w9WgXcQ',
+        'https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=42',
+        'https://www.youtube.com/embed/dQw4w9WgXcQ',
+        'https://www.youtube.com/shorts/dQw4w9WgXcQ',
+    )}
+    assert keys == {'dQw4w9WgXcQ'}
+
+
+def test_playlist_links_are_not_the_video():
+    video = cache_key('https://youtu.be/dQw4w9WgXcQ')
+    in_playlist = cache_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLxyz')
+    assert in_playlist != video
+    assert in_playlist != cache_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLother')
+    assert cache_key('https://www.youtube.com/playlist?list=PLxyz') != cache_key('https://www.youtube.com/playlist?list=PLabc')
+
+
+def test_other_sites_are_keyed_by_the_full_url():
+    a = cache_key('https://site-a.example/v/abcdefghijk')
+    b = cache_key('https://site-b.example/clip/abcdefghijk')
+    assert a != b
+    assert a == 'https://site-a.example/v/abcdefghijk'
+    # A look-alike host is not YouTube
+    assert cache_key('https://notyoutube.com/watch?v=dQw4w9WgXcQ') != 'dQw4w9WgXcQ'
+
+
+def test_entries_expire_with_their_signed_urls():
+    cache = MetadataCache(ttl=3600, expiry_margin=300)
+    soon = int(time.time()) + 200  # Inside the margin: would be stale before it is used
+    cache.put('https://youtu.be/dQw4w9WgXcQ', {'formats': [{'url': f'https://r1.googlevideo.com/videoplayback?expire={soon}'}]})
+    assert cache.get('https://youtu.be/dQw4w9WgXcQ') is None
+
+    later = int(time.time()) + 3 * 3600
+    cache.put('https://youtu.be/dQw4w9WgXcQ', {'formats': [{'url': f'https://r1.googlevideo.com/videoplayback?expire={later}'}]})
+    assert cache.get('https://www.youtube.com/watch?v=dQw4w9WgXcQ') is not None
+    assert cache.stats()['hits'] == 1
+
+
+def test_peek_is_not_counted():
+    cache = MetadataCache()
+    assert cache.peek('https://youtu.be/dQw4w9WgXcQ') is None
+    cache.put('https://youtu.be/dQw4w9WgXcQ', {'id': 'dQw4w9WgXcQ'})
+    assert cache.peek('https://youtu.be/dQw4w9WgXcQ') == {'id': 'dQw4w9WgXcQ'}
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (0, 0)
+    cache.get('https://youtu.be/dQw4w9WgXcQ')
+    cache.get('https://youtu.be/aaaaaaaaaaa')
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
@@ -0,0 +1,33 @@
+import pytest
+
+from downloads.drive_uploader import DriveUpload, DriveUploader, DriveUploadError
+
+
+class FlakyHttp:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def request(self, url, method='GET', body=None, headers=None):
+        self.calls += 1
+        raise self.error
+
+
+def make_uploader(http):
+    return DriveUploader(lambda account: http, 'Downloads', max_workers=1, max_retries=3, sleep=lambda s: None)
+
+
+def test_missing_credentials_fail_without_retrying():
+    http = FlakyHttp(PermissionError('No Google account is authorised for Drive uploads.'))
+    with pytest.raises(PermissionError):
+        make_uploader(http).upload(DriveUpload('a.mp4', 'video/mp4', [b'data']))
+    assert http.calls == 1
+
+
+def test_connection_errors_are_retried():
+    http = FlakyHttp(ConnectionResetError('reset'))
+    upload = DriveUpload('a.mp4', 'video/mp4', [b'data'])
+    with pytest.raises(DriveUploadError):
+        make_uploader(http).upload(upload)
+    assert http.calls == 4
+    assert upload.status == 'failed'
@@ -0,0 +1,62 @@
+from downloads.janitor import DiskJanitor, is_media_file
+from downloads.store import MediaStore
+
+DAY = 24 * 3600
+NOW = 100 * DAY
+KEY = 'a' * 24
+
+
+def make_janitor(tmp_path, **policies):
+    return DiskJanitor(str(tmp_path), MediaStore(str(tmp_path)), **policies)
+
+
+def planned(janitor, files, temp_files=()):
+    listing = {name: (inode, size, mtime) for inode, (name, size, mtime) in enumerate(files)}
+    return {name: reason for name, _, _, reason, _ in janitor._plan(listing, set(temp_files), NOW)}
+
+
+def test_only_media_files_are_candidates():
+    assert is_media_file(f'{KEY}.mp4')
+    assert is_media_file(f'{KEY}.f137.mp4.part')
+    assert is_media_file('Some_Title.webm')
+    assert is_media_file('Some_Title.mp4.part-Frag12.part')
+    assert not is_media_file('store.py')
+    assert not is_media_file('__init__.py')
+    assert not is_media_file('notes.txt.tmp')
+    assert not is_media_file('README')
+
+
+def test_other_files_in_the_folder_are_never_deleted(tmp_path):
+    janitor = make_janitor(tmp_path, max_age=DAY, high_watermark=1)
+    files = [('store.py', 5000, 0), ('janitor.py', 5000, 0), ('.index.json', 10, 0), ('old.mp4', 100, 0)]
+
+    assert planned(janitor, files) == {'old.mp4': 'age'}
+
+
+def test_orphaned_temp_files_are_deleted_unless_still_downloading(tmp_path):
+    janitor = make_janitor(tmp_path, orphan_age=3600)
+    janitor.store.begin('b' * 24, object())
+    files = [(f'{KEY}.mp4.part', 10, 0), ('b' * 24 + '.mp4.part', 10, 0), ('c' * 24 + '.mp4.part', 10, NOW - 60)]
+    temp_files = [name for name, _, _ in files]
+
+    assert planned(janitor, files, temp_files) == {f'{KEY}.mp4.part': 'orphaned'}
+
+
+def test_size_policy_deletes_least_recently_used_first(tmp_path):
+    janitor = make_janitor(tmp_path, high_watermark=250, low_watermark=150)
+    files = [('a.mp4', 100, NOW - 3 * DAY), ('b.mp4', 100, NOW - 2 * DAY), ('c.mp4', 100, NOW - DAY)]
+
+    assert planned(janitor, files) == {'a.mp4': 'size', 'b.mp4': 'size'}
+
+
+def test_pinned_store_items_are_kept(tmp_path):
+    janitor = make_janitor(tmp_path, max_idle=DAY)
+    path = tmp_path / f'{KEY}.mp4'
+    path.write_bytes(b'\0' * 10)
+    janitor.store.add(KEY, str(path), 'vid', '18', 'title')
+    janitor.store._entries[KEY]['last_access'] = 0
+    files = [(f'{KEY}.mp4', 10, 0)]
+
+    assert planned(janitor, files) == {f'{KEY}.mp4': 'idle'}
+    janitor.store.acquire(KEY)
+    assert planned(janitor, files) == {}
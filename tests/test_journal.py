@@ -0,0 +1,24 @@
+import sqlite3
+
+from downloads.journal import JobJournal
+from downloads.scheduler import DownloadJob
+
+
+def test_resumed_jobs_keep_their_drive_account_in_migrated_journals(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite')
+    conn = sqlite3.connect(path)
+    # A journal from before drive_account was recorded
+    conn.execute(
+        'CREATE TABLE jobs (job_id TEXT PRIMARY KEY, session_id TEXT, client_id TEXT, video_url TEXT NOT NULL, '
+        'format_id TEXT NOT NULL, video_title TEXT, preset TEXT, store_key TEXT, status TEXT NOT NULL, '
+        'downloaded_bytes INTEGER, total_bytes INTEGER, partial_path TEXT, output_path TEXT, '
+        'created REAL NOT NULL, updated REAL NOT NULL)'
+    )
+    conn.close()
+    job = DownloadJob('sid', 'https://example.com/v', '18', 'v', store_key='key')
+    job.drive_account = 'account'
+    JobJournal(path).record(job)
+
+    [row] = JobJournal(path).unfinished()
+    assert row['job_id'] == job.job_id
+    assert row['drive_account'] == 'account'
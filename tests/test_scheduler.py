@@ -0,0 +1,35 @@
+from downloads.scheduler import DownloadJob, DownloadScheduler
+
+
+def make_scheduler():
+    # Workers are never spawned, so submitted jobs stay queued
+    return DownloadScheduler(run_job=lambda job: None, spawn=lambda fn: None)
+
+
+def test_rekeyed_job_is_found_under_both_keys():
+    scheduler = make_scheduler()
+    job = scheduler.submit(DownloadJob('a', 'https://example.com/v', 'best', 'v', store_key='url-key'))
+
+    assert scheduler.rekey(job, 'item-key') is job
+    assert job.store_key == 'item-key'
+    assert scheduler.in_flight('item-key') is job
+    assert scheduler.in_flight('url-key') is job
+
+
+def test_rekey_onto_a_key_in_flight_returns_its_owner():
+    scheduler = make_scheduler()
+    owner = scheduler.submit(DownloadJob('a', 'https://example.com/v', 'best', 'v', store_key='item-key'))
+    job = scheduler.submit(DownloadJob('b', 'https://example.com/v?ref=x', 'best', 'v', store_key='url-key'))
+
+    assert scheduler.rekey(job, 'item-key') is owner
+    assert job.store_key == 'url-key'
+
+
+def test_moved_keys_are_forgotten_once_the_job_is_cancelled():
+    scheduler = make_scheduler()
+    job = scheduler.submit(DownloadJob('a', 'https://example.com/v', 'best', 'v', store_key='url-key'))
+    scheduler.rekey(job, 'item-key')
+    scheduler.cancel(job.job_id)
+
+    assert scheduler.in_flight('url-key') is None
+    assert scheduler.in_flight('item-key') is None
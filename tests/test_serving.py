@@ -0,0 +1,33 @@
+from flask import Flask, request
+
+from downloads.serving import send_media
+
+app = Flask(__name__)
+
+
+def media(tmp_path, size=10):
+    path = tmp_path / 'a.mp4'
+    path.write_bytes(bytes(range(size)))
+    return str(path)
+
+
+def test_body_closed_before_it_was_read_reports_the_response_done(tmp_path):
+    closed = []
+    with app.test_request_context('/'):
+        response = send_media(request, media(tmp_path), 'a.mp4', chunk_size=4, on_close=closed.append)
+    response.response.close()
+    response.response.close()
+
+    assert closed == [0]
+
+
+def test_ranges_are_read_in_chunks_and_counted(tmp_path):
+    closed = []
+    with app.test_request_context('/', headers={'Range': 'bytes=2-7'}):
+        response = send_media(request, media(tmp_path), 'a.mp4', chunk_size=4, on_close=closed.append)
+    chunks = list(response.response)
+    response.response.close()
+
+    assert response.status_code == 206
+    assert chunks == [bytes([2, 3, 4, 5]), bytes([6, 7])]
+    assert closed == [6]
@@ -0,0 +1,164 @@
+import os
+import subprocess
+import sys
+
+from werkzeug.wrappers import Response
+
+from downloads.scheduler import DownloadJob, DownloadScheduler
+from downloads.store import MediaStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Another process using item 'a' until told to stop
+PIN_SCRIPT = '''
+import sys
+from downloads.store import MediaStore
+store = MediaStore(sys.argv[1])
+store.acquire('a')
+print('pinned', flush=True)
+sys.stdin.readline()
+'''
+# Another process updating the index until told to stop (or killed by the alarm)
+INDEX_LOCK_SCRIPT = '''
+import signal
+import sys
+from downloads.store import MediaStore
+signal.alarm(30)
+store = MediaStore(sys.argv[1])
+with store._index_locked():
+    print('locked', flush=True)
+    sys.stdin.readline()
+'''
+
+
+def write(folder, name, size):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    return path
+
+
+def add(store, key, size, last_access=None):
+    entry = store.add(key, write(store.folder, f'{key}.mp4', size), 'vid', '18', key)
+    if last_access is not None:
+        store._entries[key]['last_access'] = last_access
+    return entry
+
+
+def test_items_added_by_another_process_are_seen_and_kept(tmp_path):
+    first = MediaStore(str(tmp_path))
+    second = MediaStore(str(tmp_path))
+    add(first, 'a', 10)
+    add(second, 'b', 10)  # Reloads first's item before saving, instead of overwriting it
+
+    assert first.lookup('b') is not None
+    assert sorted(key for key, _ in MediaStore(str(tmp_path)).entries()) == ['a', 'b']
+
+
+def test_reload_forgets_items_removed_elsewhere(tmp_path):
+    first = MediaStore(str(tmp_path))
+    second = MediaStore(str(tmp_path))
+    add(first, 'a', 10)
+    add(first, 'b', 10)
+    second.remove(['a'])
+
+    assert [key for key, _ in first.entries()] == ['b']
+    assert first.lookup_filename('a.mp4') == (None, None)
+
+
+def test_missing_files_are_dropped_on_lookup(tmp_path):
+    store = MediaStore(str(tmp_path))
+    add(store, 'a', 10)
+    os.remove(os.path.join(str(tmp_path), 'a.mp4'))
+
+    assert store.lookup('a') is None
+    assert MediaStore(str(tmp_path)).entries() == []
+
+
+def test_last_access_is_written_in_batches(tmp_path):
+    store = MediaStore(str(tmp_path), access_flush_interval=3600)
+    add(store, 'a', 10, last_access=1)
+    add(store, 'b', 10, last_access=1)  # Saves a's last access too
+    accessed = store.lookup('a')['last_access']
+
+    assert dict(MediaStore(str(tmp_path)).entries())['a']['last_access'] == 1
+    add(store, 'c', 10)  # Another update must not lose the pending access
+    assert dict(MediaStore(str(tmp_path)).entries())['a']['last_access'] == accessed
+    store.lookup('b')
+    store.entries()  # The janitor's read flushes it
+    assert dict(MediaStore(str(tmp_path)).entries())['b']['last_access'] > 1
+
+
+def test_eviction_is_least_recently_used_and_skips_pinned_items(tmp_path):
+    store = MediaStore(str(tmp_path), max_bytes=25)
+    add(store, 'old', 10, last_access=1)
+    add(store, 'pinned', 10, last_access=2)
+    store.acquire('pinned')
+    add(store, 'new', 10)
+
+    assert sorted(key for key, _ in store.entries()) == ['new', 'pinned']
+    assert not os.path.exists(os.path.join(str(tmp_path), 'old.mp4'))
+
+
+def test_pinned_items_are_not_removed(tmp_path):
+    store = MediaStore(str(tmp_path))
+    add(store, 'a', 10)
+    add(store, 'b', 10)
+    store.begin('a', object())
+
+    assert list(store.remove(['a', 'b'])) == ['b']
+
+
+def test_response_pin_is_released_under_its_own_key_after_a_rekey(tmp_path):
+    store = MediaStore(str(tmp_path))
+    scheduler = DownloadScheduler(run_job=lambda job: None, spawn=lambda fn: None)
+    job = scheduler.submit(DownloadJob('a', 'https://example.com/v', 'best', 'v', store_key='url-key'))
+    response = store.pin_response(Response(iter([b'data'])), job.store_key)
+    scheduler.rekey(job, 'item-key')
+    store.begin('item-key', job)
+    response.close()
+
+    assert not store.pinned('url-key')
+    assert store._refcounts == {'item-key': 1}
+
+
+def test_items_pinned_by_another_process_are_not_removed(tmp_path):
+    store = MediaStore(str(tmp_path))
+    add(store, 'a', 10)
+    add(store, 'b', 10)
+    other = subprocess.Popen(
+        [sys.executable, '-c', PIN_SCRIPT, str(tmp_path)],
+        cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    try:
+        assert other.stdout.readline() == b'pinned\n'
+        assert store.pinned('a')
+        assert list(store.remove(['a', 'b'])) == ['b']
+    finally:
+        other.communicate(b'\n', timeout=30)
+    assert not store.pinned('a')
+
+
+def test_index_lock_of_another_process_is_waited_for_by_sleeping(tmp_path, monkeypatch):
+    store = MediaStore(str(tmp_path))
+    other = subprocess.Popen(
+        [sys.executable, '-c', INDEX_LOCK_SCRIPT, str(tmp_path)],
+        cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+    )
+    sleeps = []
+
+    def sleep(seconds):
+        # Under eventlet this is where other green threads run; here it lets the other process go
+        if not sleeps:
+            other.stdin.write(b'\n')
+            other.stdin.flush()
+        sleeps.append(seconds)
+
+    monkeypatch.setattr('downloads.store.time.sleep', sleep)
+    try:
+        assert other.stdout.readline() == b'locked\n'
+        add(store, 'a', 10)
+    finally:
+        other.communicate(timeout=30)
+    assert sleeps
+    assert [key for key, _ in store.entries()] == ['a']
+
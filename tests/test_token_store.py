@@ -0,0 +1,26 @@
+import os
+import stat
+
+from auth.token_store import TokenStore
+
+
+def test_tokens_are_found_by_an_unrelated_account_id(tmp_path):
+    path = str(tmp_path / 'tokens.sqlite')
+    store = TokenStore(path)
+    account = store.add('{"refresh_token": "secret"}')
+
+    assert 'secret' not in account
+    assert TokenStore(path).get(account) == '{"refresh_token": "secret"}'
+    assert store.get('other') is None
+    assert store.get(None) is None
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+
+def test_tokens_are_updated_and_removed(tmp_path):
+    store = TokenStore(str(tmp_path / 'tokens.sqlite'))
+    account = store.add('old')
+    store.update(account, 'new')
+    assert store.get(account) == 'new'
+
+    store.remove(account)
+    assert store.get(account) is None
@@ -0,0 +1,55 @@
+import pytest
+
+from downloads.transcode import PRESETS, TranscodeError, Transcoder, choose_audio_source
+
+
+def command(preset, source='in.webm', output='out', vcodec=None, acodec=None):
+    return Transcoder(ffmpeg='ffmpeg').command(PRESETS[preset], source, output, vcodec, acodec)
+
+
+def test_audio_is_copied_when_the_preset_allows_it():
+    args = command('opus', acodec='opus')
+    assert args[args.index('-c:a') + 1] == 'copy'
+    assert '-b:a' not in args
+    assert args[-1] == 'out'
+
+
+def test_audio_is_encoded_otherwise():
+    args = command('mp3', acodec='mp4a.40.2')
+    assert args[args.index('-c:a') + 1:args.index('-c:a') + 4] == ['libmp3lame', '-b:a', '192k']
+    assert '-vn' in args
+
+
+def test_remux_copies_streams_and_mp4_gets_faststart():
+    args = command('mp4', vcodec='avc1.64001f', acodec='mp4a.40.2')
+    assert args[args.index('-c') + 1] == 'copy'
+    assert args[args.index('-movflags') + 1] == '+faststart'
+    assert '-movflags' not in command('mkv', vcodec='vp9', acodec='opus')
+    assert '-movflags' in command('m4a', acodec='mp4a.40.2')
+
+
+def test_codecs_mp4_cannot_hold_are_refused():
+    with pytest.raises(TranscodeError):
+        command('mp4', vcodec='vp8', acodec='vorbis')
+    command('mkv', vcodec='vp8', acodec='vorbis')
+
+
+def test_ffmpeg_is_skipped_when_the_source_already_fits():
+    transcoder = Transcoder(ffmpeg='ffmpeg')
+    assert not transcoder.needs_ffmpeg(PRESETS['m4a'], 'a.m4a', vcodec='none', acodec='mp4a.40.2')
+    assert transcoder.needs_ffmpeg(PRESETS['m4a'], 'a.m4a', vcodec='avc1', acodec='mp4a.40.2')
+    assert transcoder.needs_ffmpeg(PRESETS['mp3'], 'a.m4a', acodec='mp4a.40.2')
+    assert not transcoder.needs_ffmpeg(PRESETS['mp4'], 'a.mp4', vcodec='avc1', acodec='mp4a.40.2')
+
+
+def test_audio_source_prefers_the_smallest_good_enough_copyable_format():
+    info = {'duration': 100, 'formats': [
+        {'format_id': '139', 'vcodec': 'none', 'acodec': 'mp4a.40.5', 'abr': 48},
+        {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129},
+        {'format_id': '251', 'vcodec': 'none', 'acodec': 'opus', 'abr': 130},
+        {'format_id': '18', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2'},
+    ]}
+    assert choose_audio_source(info, PRESETS['opus']) == '251'
+    assert choose_audio_source(info, PRESETS['m4a']) == '140'
+    assert choose_audio_source(info, PRESETS['mp3-320']) == '251'  # None is good enough: the best there is
+    assert choose_audio_source({'formats': []}, PRESETS['mp3']) == 'bestaudio/best'
@@ -0,0 +1,35 @@
+from http.cookiejar import Cookie
+
+from downloads import ydl_pool
+from downloads.ydl_pool import YdlPool
+
+
+def cookie(name, domain='.example.com'):
+    return Cookie(0, name, 'v', None, False, domain, True, True, '/', True, False, None, False, None, None, {})
+
+
+def test_instances_are_reused_with_a_clean_cookie_jar(tmp_path):
+    cookiefile = tmp_path / 'cookies.txt'
+    cookiefile.write_text('# Netscape HTTP Cookie File\n.example.com\tTRUE\t/\tFALSE\t0\tbase\t1\n')
+    pool = YdlPool({'quiet': True, 'cookiefile': str(cookiefile)}, max_idle=1)
+
+    with pool.acquire(format='best') as ydl:
+        first = ydl
+        ydl.cookiejar.set_cookie(cookie('session'))
+    with pool.acquire() as ydl:
+        assert ydl is first
+        assert sorted(c.name for c in ydl.cookiejar) == ['base']
+        assert ydl.params.get('format') is None
+    assert pool.stats()['reused'] == 1
+
+
+def test_other_yt_dlp_versions_get_a_fresh_instance_per_job(monkeypatch):
+    monkeypatch.setattr(ydl_pool, 'POOLABLE_VERSIONS', frozenset())
+    pool = YdlPool({'quiet': True}, max_idle=1)
+
+    with pool.acquire(format='best') as ydl:
+        first = ydl
+        assert ydl.params['format'] == 'best'
+    with pool.acquire() as ydl:
+        assert ydl is not first
+    assert pool.stats()['created'] == 2
@@ -27,6 +27,18 @@ def setup_logging(log_dir='logs', log_level='INFO'):
     )
     logging.getLogger(__name__).info(f"Logging setup complete. Level: {log_level}")
 
+YOUTUBE_DOMAINS = ('youtube.com', 'youtu.be', 'youtube-nocookie.com')
+
+def is_youtube_url(url):
+    """
+    Checks whether a URL points at a YouTube host (any subdomain, e.g. www., m. or music.).
+    """
+    try:
+        host = (urlparse(url.strip()).hostname or '').lower()
+    except ValueError:
+        return False
+    return any(host == domain or host.endswith('.' + domain) for domain in YOUTUBE_DOMAINS)
+
 def extract_video_id(url):
     """
     Extracts the YouTube video ID from various YouTube URL formats.
@@ -0,0 +1,55 @@
+"""
+Download worker for multi-worker mode.
+
+Pulls jobs from the shared queue and runs them, sending progress to the
+clients through the Socket.IO message queue. Run as many as needed, next
+to web processes started with RUN_DOWNLOAD_WORKERS=false:
+
+    export JOB_QUEUE_URL=redis://localhost:6379/0
+    export SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0
+    RUN_DOWNLOAD_WORKERS=false gunicorn -k eventlet -w 4 -b 0.0.0.0:5000 app:app
+    python worker.py
+
+All processes must share the download folder, on a local filesystem: the
+items each process is using are pinned with POSIX locks on a file in it,
+so that no process's janitor deletes them. With WORKER_METRICS_PORT
+set, the worker's /metrics (download timings and throughput are measured
+here, not in the web processes) is served on that port.
+"""
+import eventlet
+import eventlet.wsgi
+
+from app import app_logger, disk_janitor, download_queue, download_ydl_pool, hub_lag_monitor, info_ydl_pool, metrics, socketio
+from config import Config
+from downloads.shared_queue import SharedJobQueue
+
+
+def metrics_app(environ, start_response):
+    if environ.get('PATH_INFO') != '/metrics':
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not found\n']
+    body = metrics.render().encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def main():
+    if not isinstance(download_queue, SharedJobQueue):
+        raise SystemExit('worker.py needs JOB_QUEUE_URL to point at the shared job queue (e.g. redis://localhost:6379/0).')
+    if not download_queue.max_workers:
+        raise SystemExit('RUN_DOWNLOAD_WORKERS is disabled for this process.')
+    download_queue.start()
+    hub_lag_monitor.start()
+    info_ydl_pool.start()
+    download_ydl_pool.start()
+    disk_janitor.start()
+    if Config.WORKER_METRICS_PORT:
+        listener = eventlet.listen(('0.0.0.0', Config.WORKER_METRICS_PORT))
+        socketio.start_background_task(eventlet.wsgi.server, listener, metrics_app, log_output=False)
+    app_logger.info(f"Download worker {download_queue.worker_id} running {download_queue.max_workers} downloads at a time")
+    while True:
+        socketio.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()